@@ -0,0 +1,53 @@
+"""后端健康度 - 滚动统计各模型后端的首 token 延迟、输出速率与错误率
+
+每轮生成结束后记录一个样本（首 token 延迟、输出片段数与生成时长、是否出错），
+只保留最近的若干个且不超过最大时长；样本过期后该后端回到"数据不足"状态，
+延迟感知路由随之退回静态规则，被冷落的后端因此能重新获得流量和新样本。
+"""
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+# (记录时间, 首 token 延迟毫秒, 输出速率 token/s, 是否出错)
+Sample = Tuple[float, Optional[float], Optional[float], bool]
+
+
+class BackendHealth:
+    """单个后端的滚动健康度"""
+
+    def __init__(self, name: str, window: int = None, max_age: float = None):
+        self.name = name
+        self.window = window or int(os.getenv("BACKEND_HEALTH_WINDOW", "50"))
+        self.max_age = max_age or float(os.getenv("BACKEND_HEALTH_MAX_AGE", "300"))
+        self.samples: Deque[Sample] = deque(maxlen=self.window)
+        # 正在生成的请求数
+        self.in_flight = 0
+
+    def observe(self, ttft_ms: Optional[float], tokens: int, duration_s: float, error: bool) -> None:
+        """
+        记录一轮生成
+        :param ttft_ms: 首 token 延迟，未产出 token 时为 None
+        :param duration_s: 首 token 之后的生成时长
+        """
+        rate = tokens / duration_s if tokens > 1 and duration_s > 0 else None
+        self.samples.append((time.monotonic(), ttft_ms, rate, error))
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.max_age
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        return list(self.samples)
+
+    def stats(self) -> Dict:
+        samples = self._recent()
+        ttfts = sorted(ttft for _, ttft, _, error in samples if ttft is not None and not error)
+        rates = [rate for _, _, rate, error in samples if rate is not None and not error]
+        return {
+            "samples": len(samples),
+            "ttft_p10_ms": round(ttfts[len(ttfts) // 10], 1) if ttfts else None,
+            "ttft_p50_ms": round(ttfts[len(ttfts) // 2], 1) if ttfts else None,
+            "tokens_per_s": round(sum(rates) / len(rates), 1) if rates else None,
+            "error_rate": round(sum(1 for sample in samples if sample[3]) / len(samples), 3) if samples else 0.0,
+            "in_flight": self.in_flight
+        }
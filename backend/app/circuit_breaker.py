@@ -0,0 +1,87 @@
+"""熔断器 - 跟踪模型后端的连续失败，故障期间暂停向其路由"""
+import time
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    三态熔断器
+    - closed：正常放行
+    - open：连续失败达到阈值后熔断，拒绝路由
+    - half_open：熔断超过恢复时间后每次只放行一个试探请求，成功则关闭，失败则重新熔断；
+      试探结果返回前其他请求仍被拒绝（试探未报告结果超过恢复时间时视为丢失，允许新的试探）
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.total_failures = 0
+        self.total_successes = 0
+        self.open_count = 0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        """是否可以向该后端发送请求（只查询，不占用试探名额，用于路由判断）"""
+        state = self.state
+        if state == "half_open":
+            return not self._probe_pending()
+        return state == "closed"
+
+    def allow_request(self) -> bool:
+        """当前是否允许向该后端发送请求；半开状态下放行的请求占用唯一的试探名额"""
+        if not self.available():
+            return False
+        if self.state == "half_open":
+            self._probe_in_flight = True
+            self._probe_started_at = time.monotonic()
+            logger.info(f"熔断器 {self.name} 半开，放行试探请求")
+        return True
+
+    def _probe_pending(self) -> bool:
+        """是否有尚未报告结果的试探请求（被取消的请求不会报告，超过恢复时间后不再等待）"""
+        return self._probe_in_flight and time.monotonic() - self._probe_started_at < self.recovery_timeout
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"熔断器 {self.name} 试探成功，恢复正常")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self.total_successes += 1
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        # 半开状态下试探失败，或连续失败达到阈值，进入熔断
+        if self.state == "half_open" or (
+            self.opened_at is None and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+            self.open_count += 1
+            self._probe_in_flight = False
+            logger.warning(f"熔断器 {self.name} 已熔断（连续失败 {self.consecutive_failures} 次）")
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "probe_in_flight": self._probe_pending(),
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "total_successes": self.total_successes,
+            "open_count": self.open_count
+        }
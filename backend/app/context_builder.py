@@ -0,0 +1,121 @@
+"""上下文构建器 - 按 token 预算截取最近对话，较早的对话折叠为滚动摘要
+
+- 最近的消息在预算内原样保留（预算按后端区分，本地小模型预算更小）
+- 超出窗口的消息折叠为摘要条目，增量保存在 Conversation.meta_info 中
+- 摘要只包含窗口之前的消息，与窗口内容不重复
+
+长对话的提示词长度因此保持稳定，本地模型的预填充耗时不再随轮次增长。
+"""
+import os
+import re
+from typing import Dict, List, Optional
+
+# 摘要条目中每条消息保留的最大字符数
+SUMMARY_LINE_CHARS = 60
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文约一字一 token，其余字符约四个一 token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: Dict) -> int:
+    """单条消息的 token 数（含角色标记等固定开销）"""
+    return estimate_tokens(message["content"]) + 4
+
+
+def render_history(history: List[Dict]) -> str:
+    """将对话历史格式化为纯文本（供感知规划提示词使用）"""
+    return "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
+
+
+class ContextBuilder:
+    """按后端 token 预算构建模型上下文"""
+
+    def __init__(self):
+        self.budgets = {
+            "local": int(os.getenv("CONTEXT_BUDGET_LOCAL", "1500")),
+            "remote": int(os.getenv("CONTEXT_BUDGET_REMOTE", "6000")),
+            "perception": int(os.getenv("CONTEXT_BUDGET_PERCEPTION", "300")),
+        }
+        self.summary_budget = int(os.getenv("CONTEXT_SUMMARY_BUDGET", "400"))
+        # 每轮从数据库读取的最近消息条数上限
+        self.tail_limit = int(os.getenv("CONTEXT_TAIL_MESSAGES", "40"))
+
+    def select_window(self, messages: List[Dict], budget: int) -> List[Dict]:
+        """从最新消息向前累加，返回预算内的最近消息（至少保留最新一条）"""
+        used = 0
+        start = len(messages)
+        for index in range(len(messages) - 1, -1, -1):
+            used += message_tokens(messages[index])
+            if used > budget and start < len(messages):
+                break
+            start = index
+        return messages[start:]
+
+    def render_recent(self, history: List[Dict]) -> str:
+        """感知规划使用的最近对话文本"""
+        return render_history(self.select_window(history, self.budgets["perception"]))
+
+    def build(self, conversation, messages: List[Dict], backend: str) -> List[Dict]:
+        """
+        构建发给模型的对话历史
+        :param conversation: 对话对象（摘要写回其 meta_info）
+        :param messages: 按时间升序的最近消息，需包含 id/role/content（尚未落盘的消息 id 为 None）
+        :param backend: 后端类型（local/remote），决定 token 预算
+        :return: [{"role", "content"}]，窗口前有摘要时以一条 system 消息开头
+        """
+        window = self.select_window(messages, self.budgets.get(backend, self.budgets["local"]))
+        older = messages[:len(messages) - len(window)]
+        self._fold(conversation, older)
+
+        history = [{"role": msg["role"], "content": msg["content"]} for msg in window]
+        summary = self._summary_before(conversation, window[0]["id"] if window else None)
+        if summary:
+            history.insert(0, {"role": "system", "content": f"此前对话摘要：\n{summary}"})
+        return history
+
+    def _fold(self, conversation, older: List[Dict]) -> None:
+        """将窗口外、尚未摘要的消息追加为摘要条目，超出摘要预算时丢弃最早的条目"""
+        meta_info = conversation.meta_info or {}
+        summarized_until = meta_info.get("summarized_until", 0)
+        new_entries = [
+            [msg["id"], self._summarize_line(msg)]
+            for msg in older
+            if msg["id"] is not None and msg["id"] > summarized_until
+        ]
+        if not new_entries:
+            return
+
+        entries = meta_info.get("context_summary", []) + new_entries
+        total = sum(estimate_tokens(line) for _, line in entries)
+        while entries and total > self.summary_budget:
+            total -= estimate_tokens(entries.pop(0)[1])
+
+        # 重新赋值以便 SQLAlchemy 检测到 JSON 字段变化
+        conversation.meta_info = {
+            **meta_info,
+            "context_summary": entries,
+            "summarized_until": new_entries[-1][0]
+        }
+
+    def _summary_before(self, conversation, window_start_id: Optional[int]) -> str:
+        entries = (conversation.meta_info or {}).get("context_summary", [])
+        return "\n".join(
+            line for message_id, line in entries
+            if window_start_id is None or message_id < window_start_id
+        )
+
+    def _summarize_line(self, message: Dict) -> str:
+        speaker = "用户" if message["role"] == "user" else "心翼"
+        content = " ".join(message["content"].split())
+        if len(content) > SUMMARY_LINE_CHARS:
+            content = content[:SUMMARY_LINE_CHARS] + "…"
+        return f"{speaker}：{content}"
+
+
+# 全局上下文构建器实例
+context_builder = ContextBuilder()
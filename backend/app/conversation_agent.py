@@ -1,13 +1,14 @@
 """对话智能体 - 根据阶段生成回复"""
 from typing import List, Dict
-import ollama
+from .ollama_pool import ollama_pool
+from .model_warmup import configured_model
 
 class ConversationAgent:
     """对话代理：根据会话阶段调整回复风格"""
     
-    def __init__(self, model: str = "Ethanwhh/Qwen3-4B-xinyi"):
-        self.model = model
-        self.client = ollama.AsyncClient()
+    def __init__(self, model: str = None):
+        self.model = model or configured_model("chat")
+        self.client = ollama_pool
         
         # 阶段提示词
         self.phase_prompts = {
@@ -89,10 +90,9 @@ class ConversationAgent:
         try:
             if stream:
                 # 流式响应
-                stream_response = await self.client.chat(
+                stream_response = self.client.chat_stream(
                     model=self.model,
-                    messages=messages,
-                    stream=True
+                    messages=messages
                 )
                 async for chunk in stream_response:
                     if 'message' in chunk and 'content' in chunk['message']:
@@ -101,8 +101,7 @@ class ConversationAgent:
                 # 非流式响应
                 response = await self.client.chat(
                     model=self.model,
-                    messages=messages,
-                    stream=False
+                    messages=messages
                 )
                 yield response['message']['content']
         
@@ -0,0 +1,85 @@
+"""对话状态缓存 - 进程内 LRU 缓存，避免每轮重新读取 Message 行
+
+每个对话缓存最近若干条消息（环形缓冲）以及阶段、轮次。
+协调器在追加消息时同步更新缓存，清空对话时失效；
+缓存未命中时回退到只查询 id/role/content 的尾部查询。
+"""
+import os
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+
+class ConversationState:
+    """单个对话的缓存状态"""
+
+    __slots__ = ("phase", "round_count", "messages")
+
+    def __init__(self, phase: str, round_count: int, messages: List[Dict], max_messages: int):
+        self.phase = phase
+        self.round_count = round_count
+        self.messages = deque(messages, maxlen=max_messages)
+
+
+class ConversationCache:
+    """按对话 id 索引的有界 LRU 缓存"""
+
+    def __init__(self, capacity: int = None, max_messages: int = None):
+        self.capacity = capacity or int(os.getenv("CONVERSATION_CACHE_SIZE", "1000"))
+        self.max_messages = max_messages or int(os.getenv("CONTEXT_TAIL_MESSAGES", "40"))
+        self.entries: "OrderedDict[int, ConversationState]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conversation_id: int, phase: str, round_count: int) -> Optional[ConversationState]:
+        """
+        读取缓存；阶段或轮次与数据库不一致（如其他进程写入过）时视为失效
+        """
+        state = self.entries.get(conversation_id)
+        if state is None or state.phase != phase or state.round_count != round_count:
+            if state is not None:
+                del self.entries[conversation_id]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(conversation_id)
+        self.hits += 1
+        return state
+
+    def put(self, conversation_id: int, phase: str, round_count: int, messages: List[Dict]) -> ConversationState:
+        state = ConversationState(phase, round_count, messages, self.max_messages)
+        self.entries[conversation_id] = state
+        self.entries.move_to_end(conversation_id)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return state
+
+    def append(self, conversation_id: int, message_id: Optional[int], role: str, content: str) -> Optional[Dict]:
+        """追加一条消息（对话不在缓存中时忽略），返回缓存中的消息字典"""
+        state = self.entries.get(conversation_id)
+        if state is None:
+            return None
+        message = {"id": message_id, "role": role, "content": content}
+        state.messages.append(message)
+        return message
+
+    def update_state(self, conversation_id: int, phase: str, round_count: int) -> None:
+        state = self.entries.get(conversation_id)
+        if state is not None:
+            state.phase = phase
+            state.round_count = round_count
+
+    def invalidate(self, conversation_id: int) -> None:
+        self.entries.pop(conversation_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# 全局对话缓存实例
+conversation_cache = ConversationCache()
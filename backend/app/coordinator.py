@@ -1,11 +1,35 @@
 """多智能体协调器 - 核心调度模块"""
+import os
+import asyncio
+import time
+import logging
 from typing import AsyncGenerator, Dict, List
 from sqlalchemy.orm import Session
+from .database import SessionLocal
 from .models import Conversation, Message, User
-from .perception_planning import PerceptionPlanningModule
+from .perception_planning import PerceptionPlanningModule, COMBINED_PERCEPTION_PROMPT
 from .conversation_agent import ConversationAgent
 from .phase_manager import PhaseManager
-from .model_router import ModelRouter
+from .model_router import model_router
+from .speculative import SpeculativeGeneration, SpeculationStats
+from .context_builder import context_builder
+from .conversation_cache import conversation_cache
+from .write_behind import write_behind
+from .metrics import StageTimer, pipeline_metrics
+from .output_transducers import output_pipeline
+from .model_warmup import model_warmup
+from .keyword_engine import keyword_engine
+
+logger = logging.getLogger(__name__)
+
+# 感知规划返回的耗时键与指标阶段名的对应关系
+PERCEPTION_STAGES = {
+    "crisis_scan_ms": "crisis_scan",
+    "privacy_ms": "privacy_model",
+    "complexity_ms": "complexity_model",
+    # 合并感知：一次调用同时完成隐私与复杂度判断
+    "perception_ms": "perception_model",
+}
 
 class MultiAgentCoordinator:
     """多智能体协调器"""
@@ -14,7 +38,42 @@ class MultiAgentCoordinator:
         self.perception_module = PerceptionPlanningModule()
         self.agent = ConversationAgent()
         self.phase_manager = PhaseManager()
-        self.model_router = ModelRouter()
+        # 与应用 lifespan 共用全局路由器，保证云端连接池在进程内唯一
+        self.model_router = model_router
+        
+        # 登记需要预热的本地模型：感知规划与对话生成（本地后端为 Ollama 时），预热时缓存各自的系统提示词
+        model_warmup.register(
+            "perception",
+            self.perception_module,
+            "model_name",
+            self.perception_module.keep_alive,
+            [COMBINED_PERCEPTION_PROMPT] if self.perception_module.combined else []
+        )
+        if self.model_router.local_backend == "ollama":
+            model_warmup.register(
+                "chat",
+                self.model_router.local_service,
+                "model",
+                self.model_router.local_service.keep_alive,
+                [self.agent.phase_prompts["emotional"]]
+            )
+        self.context_builder = context_builder
+        self.conversation_cache = conversation_cache
+        self.metrics = pipeline_metrics
+        # 模型输出下发前的变换链（推理块过滤、危机词扫描、错误归一化）
+        self.output_pipeline = output_pipeline
+        
+        # 每个工作单元单独开启短会话，提交后立即归还连接；模型生成期间不占用数据库连接。
+        # 提交后不过期属性，对话对象在会话关闭后仍可读取并在下一个工作单元中重新加入
+        self.session_factory = lambda: SessionLocal(expire_on_commit=False)
+        
+        # assistant 消息持久化方式：write_behind（批量异步写入）或 sync（逐条同步提交）
+        self.persistence_mode = os.getenv("CHAT_PERSISTENCE", "write_behind").lower()
+        self.write_behind = write_behind
+        
+        # 推测式生成：感知规划期间提前启动本地模型，路由确认后放行
+        self.speculative_local = os.getenv("SPECULATIVE_LOCAL", "false").lower() == "true"
+        self.speculation_stats = SpeculationStats()
         
         # 危机应对话术
         self.crisis_response = """我注意到你现在可能很痛苦，这让我很担心。请相信，这些感受是可以改变的。
@@ -32,134 +91,297 @@ class MultiAgentCoordinator:
         self,
         user_input: str,
         user: User,
-        db: Session,
-        conversation_id: int = None
+        conversation_id: int = None,
+        debug_timings: bool = False
     ) -> AsyncGenerator[Dict, None]:
         """
         处理用户消息的核心流程
+        
+        数据库访问分为三个短工作单元：读取对话与历史、提交用户消息与对话状态、
+        保存 assistant 回复；感知规划与模型生成期间不持有数据库连接。
         :param user_input: 用户输入
-        :param user: 当前用户
-        :param db: 数据库会话
+        :param user: 当前用户（只使用 id）
         :param conversation_id: 对话ID
+        :param debug_timings: 是否在 metadata / end 事件中附带分阶段耗时
         :yield: 流式响应数据
         """
-        # 步骤1：获取或创建对话
-        conversation = await self._get_or_create_conversation(
-            user, db, conversation_id
-        )
+        timer = StageTimer()
         
-        # 步骤2：保存用户消息
-        user_message = Message(
-            conversation_id=conversation.id,
-            role="user",
-            content=user_input
-        )
-        db.add(user_message)
-        db.commit()
+        # 上一轮的 assistant 消息仍在写后队列中时先等待落盘，保证消息 id 与时间顺序一致
+        # （在开启会话之前等待，避免持有连接时等待写入线程；单独计入 persistence_wait 阶段）
+        if conversation_id is not None and self.write_behind.has_pending(conversation_id):
+            with timer.span("persistence_wait"):
+                await self.write_behind.flush()
+        
+        # 工作单元 1：只读。会话关闭后对话对象脱离会话，本轮的修改在提交时重新加入
+        with self.session_factory() as db:
+            # 步骤1：获取或创建对话（新对话暂不写库，与本轮其他变更一起提交）
+            with timer.span("conversation_lookup"):
+                conversation = self._get_or_create_conversation(user, db, conversation_id)
+            
+            # 步骤2：获取对话历史（不含本轮用户消息，本轮输入由模型服务拼接在末尾）
+            with timer.span("history_load"):
+                recent_messages = self._get_conversation_history(conversation, db) if conversation.id else []
+        conversation_history = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in recent_messages
+        ]
         
-        # 更新轮次
+        # 步骤3：记录用户消息并更新轮次（随本轮事务一起提交）
+        user_message = Message(conversation=conversation, role="user", content=user_input)
         conversation.round_count += 1
-        db.commit()
         
-        # 步骤3：获取对话历史
-        conversation_history = self._get_conversation_history(conversation, db)
+        # 用户输入只做一次关键词扫描，危机检测、阶段判断与感知规划共用扫描结果
+        with timer.span("crisis_scan"):
+            scan = keyword_engine.scan(user_input)
         
-        # 步骤4：执行感知规划（双层判断 - 使用本地模型）
-        perception_result = await self.perception_module.execute(
-            user_input, conversation_history
+        # 阶段判断只依赖轮次与用户输入，提前计算以便推测式生成使用正确的阶段提示词
+        should_transition, new_phase = self.phase_manager.should_transition(
+            conversation.phase,
+            conversation.round_count,
+            user_input,
+            scan=scan
         )
+        target_phase = new_phase if should_transition else conversation.phase
+        
+        speculation = None
+        # 命中危机关键词的轮次必然返回危机话术，不启动推测生成（避免白占本地推理槽位）
+        if self.speculative_local and not self.perception_module.detect_crisis(user_input, scan):
+            local_history = self.context_builder.build(conversation, recent_messages, "local")
+            # 推测流同样计入本地后端的在途请求数与健康度样本
+            speculation = SpeculativeGeneration(
+                self.model_router.track(
+                    "local",
+                    self.model_router.local_service.generate_with_prompt(
+                        self._get_system_prompt(target_phase),
+                        user_input,
+                        local_history,
+                        stream=True,
+                        session_id=conversation.id
+                    )
+                )
+            )
+            self.speculation_stats.record_started()
+        
+        try:
+            # 步骤4：执行感知规划（双层判断 - 使用本地模型）
+            with timer.span("perception"):
+                perception_result = await self.perception_module.execute(
+                    user_input, conversation_history, scan=scan
+                )
+        except BaseException:
+            if speculation:
+                await speculation.discard()
+            raise
+        for key, duration_ms in perception_result.get("timings", {}).items():
+            timer.record(PERCEPTION_STAGES.get(key, key), duration_ms)
+        
+        # 步骤7（前置）：选择模型服务（结合熔断状态与后端健康度，决策原因写入日志）
+        with timer.span("routing"):
+            decision = self.model_router.route(
+                perception_result["is_privacy_issue"],
+                perception_result["is_complex_issue"]
+            )
+            backend = decision.backend
+        self.metrics.observe_route(decision.backend, decision.rule)
+        
+        # 推测流仅在确认走本地路由且非危机时保留
+        if speculation and (
+            perception_result["is_crisis"] or decision.service is not self.model_router.local_service
+        ):
+            wasted_chunks = await speculation.discard()
+            self.speculation_stats.record_wasted(wasted_chunks)
+            logger.info(f"推测式生成被丢弃，浪费 {wasted_chunks} 个输出片段")
+            speculation = None
         
         # 步骤5：危机检测
         if perception_result["is_crisis"]:
-            # 危机情况：返回紧急应对话术
+            # 危机情况：返回紧急应对话术，对话状态与危机响应随本轮一次提交
             conversation.status = "crisis"
-            db.commit()
-            
-            yield {
-                "type": "crisis",
-                "content": self.crisis_response,
-                "conversation_id": conversation.id
-            }
-            
-            # 保存危机响应
             crisis_message = Message(
-                conversation_id=conversation.id,
+                conversation=conversation,
                 role="assistant",
                 content=self.crisis_response,
                 agent_type="SafetyAgent",
                 model_used="local"
             )
-            db.add(crisis_message)
-            db.commit()
+            with timer.span("message_insert"):
+                self._commit_turn(conversation, user_message, crisis_message)
+            # 危机对话不再继续，移出缓存并释放模型上下文
+            self.conversation_cache.invalidate(conversation.id)
+            self.model_router.evict_session(conversation.id)
+            timer.record("total", timer.elapsed_ms())
+            self.metrics.observe_turn(timer.stages, "local", conversation.phase, "crisis")
+            
+            event = {
+                "type": "crisis",
+                "content": self.crisis_response,
+                "conversation_id": conversation.id
+            }
+            if debug_timings:
+                event["timings"] = timer.snapshot()
+            yield event
             return
         
         # 步骤6：阶段管理
-        should_transition, new_phase = self.phase_manager.should_transition(
-            conversation.phase,
-            conversation.round_count,
-            user_input
-        )
         if should_transition:
             conversation.phase = new_phase
-            db.commit()
         
-        # 步骤7：选择模型服务并生成AI响应
-        model_service = self.model_router.get_model_service(
-            perception_result["is_privacy_issue"],
-            perception_result["is_complex_issue"]
-        )
-        model_name = self.model_router.get_model_name(
-            perception_result["is_privacy_issue"],
-            perception_result["is_complex_issue"]
-        )
+        # 按实际后端的 token 预算截取历史，窗口外的对话折叠为摘要（摘要随本轮事务提交）
+        if not speculation:
+            with timer.span("context_build"):
+                model_history = self.context_builder.build(conversation, recent_messages, backend)
+        
+        # 工作单元 2：本轮唯一一次同步提交（新对话、用户消息、轮次、阶段、摘要），提交后即归还连接
+        with timer.span("message_insert"):
+            self._commit_turn(conversation, user_message)
+        if not recent_messages:
+            self.conversation_cache.put(conversation.id, conversation.phase, conversation.round_count, [])
+        self.conversation_cache.append(conversation.id, user_message.id, "user", user_input)
+        self.conversation_cache.update_state(conversation.id, conversation.phase, conversation.round_count)
         
-        yield {
+        metadata = {
             "type": "metadata",
             "conversation_id": conversation.id,
             "phase": conversation.phase,
             "round_count": conversation.round_count,
             "is_privacy": perception_result["is_privacy_issue"],
             "is_complex": perception_result["is_complex_issue"],
-            "model_used": model_name
+            "model_used": decision.model_name,
+            "route_reason": decision.reason
         }
+        if debug_timings:
+            # 生成开始前的各阶段耗时；生成与持久化的耗时随 end 事件返回
+            metadata["timings"] = timer.snapshot()
+        yield metadata
         
-        # 根据阶段构造系统提示词
-        phase_prompts = {
-            "emotional": self.agent.phase_prompts["emotional"],
-            "rational": self.agent.phase_prompts["rational"],
-            "solution": self.agent.phase_prompts["solution"]
-        }
-        system_prompt = phase_prompts.get(conversation.phase, self.agent.phase_prompts["emotional"])
+        # 步骤7：生成AI响应（已推测生成的直接放行缓冲内容）
+        if speculation:
+            self.speculation_stats.record_used()
+            response_stream = speculation.release()
+        else:
+            response_stream = self.model_router.generate(
+                decision,
+                self._get_system_prompt(conversation.phase),
+                user_input,
+                model_history,
+                session_id=conversation.id
+            )
         
+        # 模型输出经变换链后下发与保存；first_token 为用户可见的首个片段，first_model_token 为模型原始输出
+        output_chain = self.output_pipeline.build()
+        visible_stream = output_chain.apply(response_stream)
         full_response = ""
-        async for chunk in model_service.generate_with_prompt(
-            system_prompt,
-            user_input,
-            conversation_history,
-            stream=True
-        ):
-            full_response += chunk
-            yield {
-                "type": "chunk",
-                "content": chunk
-            }
+        generation_started = time.perf_counter()
+        first_token_at = None
+        try:
+            async for chunk in visible_stream:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    timer.record("first_token", (first_token_at - generation_started) * 1000)
+                full_response += chunk
+                yield {
+                    "type": "chunk",
+                    "content": chunk
+                }
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开：立即关闭上游流（ollama / httpx 连接与推理槽位随之释放），保存已生成的部分
+            await visible_stream.aclose()
+            await response_stream.aclose()
+            backend = decision.served_by
+            generated = output_chain.chunks
+            saved = self.metrics.record_disconnect(backend, generated)
+            logger.info("对话 %s 客户端断开，已生成 %d 个片段，估计节省 %d 个 token", conversation.id, generated, saved)
+            if full_response:
+                await self._persist_response(
+                    conversation.id,
+                    self._assistant_message(
+                        conversation.id, full_response, decision.model_name, perception_result, truncated=True
+                    )
+                )
+            timer.record("total", timer.elapsed_ms())
+            self.metrics.observe_turn(timer.stages, backend, conversation.phase, "disconnected")
+            raise
+        # 指标与 model_used 按实际产出回复的后端记录（对冲时可能由本地胜出）
+        backend = decision.served_by
+        if output_chain.first_chunk_at is not None:
+            timer.record("first_model_token", (output_chain.first_chunk_at - generation_started) * 1000)
+        if first_token_at is not None:
+            timer.record("stream_end", (time.perf_counter() - first_token_at) * 1000)
+        
+        output_events = output_chain.events()
+        self.metrics.observe_output(backend, output_events)
+        crisis_scan = output_chain.get("crisis_scan")
+        if crisis_scan is not None and crisis_scan.hits:
+            logger.warning(f"对话 {conversation.id} 的回复包含危机关键词: {', '.join(dict.fromkeys(crisis_scan.hits))}")
+        error_normalizer = output_chain.get("error_normalize")
+        model_error = error_normalizer is not None and error_normalizer.error is not None
+        if not model_error:
+            self.metrics.observe_reply(backend, output_chain.chunks)
         
         # 步骤8：保存AI响应
-        ai_message = Message(
-            conversation_id=conversation.id,
+        ai_message = self._assistant_message(conversation.id, full_response, decision.model_name, perception_result)
+        # 工作单元 3：保存回复（同步模式短会话提交，写后模式由后台任务批量写入）
+        with timer.span("persistence"):
+            await self._persist_response(conversation.id, ai_message)
+        
+        timer.record("total", timer.elapsed_ms())
+        self.metrics.observe_turn(timer.stages, backend, conversation.phase, "model_error" if model_error else "completed")
+        
+        end = {"type": "end"}
+        if debug_timings:
+            end["timings"] = timer.snapshot()
+        yield end
+    
+    def _assistant_message(
+        self,
+        conversation_id: int,
+        content: str,
+        model_name: str,
+        perception_result: Dict,
+        truncated: bool = False
+    ) -> Message:
+        return Message(
+            conversation_id=conversation_id,
             role="assistant",
-            content=full_response,
+            content=content,
             agent_type="ConversationAgent",
             model_used=model_name,
             is_privacy_issue=perception_result["is_privacy_issue"],
-            is_complex_issue=perception_result["is_complex_issue"]
+            is_complex_issue=perception_result["is_complex_issue"],
+            truncated=truncated
         )
-        db.add(ai_message)
-        db.commit()
+    
+    def _commit_turn(self, conversation: Conversation, *messages: Message) -> None:
+        """在短会话中提交对话（新建或脱离会话后修改的）及本轮消息"""
+        with self.session_factory() as db:
+            db.add(conversation)
+            db.add_all(messages)
+            db.commit()
+    
+    async def _persist_response(self, conversation_id: int, ai_message: Message) -> None:
+        """保存 assistant 消息：同步模式立即提交，写后模式放入批量写入队列"""
+        if self.persistence_mode == "sync":
+            with self.session_factory() as db:
+                db.add(ai_message)
+                db.commit()
+            self.conversation_cache.append(conversation_id, ai_message.id, "assistant", ai_message.content)
+            return
+        
+        # 缓存条目先以空 id 加入，落盘后回填（id 仅用于摘要折叠的先后判断）
+        cached = self.conversation_cache.append(conversation_id, None, "assistant", ai_message.content)
+        
+        def on_commit(message: Message) -> None:
+            if cached is not None:
+                cached["id"] = message.id
         
-        yield {"type": "end"}
+        await self.write_behind.enqueue(ai_message, conversation_id, on_commit)
     
-    async def _get_or_create_conversation(
+    def _get_system_prompt(self, phase: str) -> str:
+        """根据阶段构造系统提示词"""
+        return self.agent.phase_prompts.get(phase, self.agent.phase_prompts["emotional"])
+    
+    def _get_or_create_conversation(
         self, 
         user: User, 
         db: Session, 
@@ -175,16 +397,15 @@ class MultiAgentCoordinator:
             if conversation:
                 return conversation
         
-        # 创建新对话
+        # 创建新对话（由调用方在本轮事务中提交）
         conversation = Conversation(
             user_id=user.id,
             phase="emotional",
             round_count=0,
-            status="ongoing"
+            status="ongoing",
+            meta_info={}
         )
         db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
         return conversation
     
     def _get_conversation_history(
@@ -192,15 +413,24 @@ class MultiAgentCoordinator:
         conversation: Conversation, 
         db: Session
     ) -> List[Dict]:
-        """获取对话历史"""
-        messages = db.query(Message).filter(
+        """
+        获取最近的对话历史（按时间升序，包含消息 id 供上下文构建器折叠摘要）
+        优先读取进程内缓存，未命中时只查询所需列的尾部数据并回填缓存
+        """
+        state = self.conversation_cache.get(conversation.id, conversation.phase, conversation.round_count)
+        if state is not None:
+            return list(state.messages)
+        
+        rows = db.query(Message.id, Message.role, Message.content).filter(
             Message.conversation_id == conversation.id
-        ).order_by(Message.created_at.asc()).limit(20).all()
+        ).order_by(Message.id.desc()).limit(self.context_builder.tail_limit).all()
         
-        return [
-            {"role": msg.role, "content": msg.content}
-            for msg in messages
+        messages = [
+            {"id": row.id, "role": row.role, "content": row.content}
+            for row in reversed(rows)
         ]
+        self.conversation_cache.put(conversation.id, conversation.phase, conversation.round_count, messages)
+        return messages
 
 
 # 全局协调器实例
@@ -1,5 +1,5 @@
 """数据库配置和连接"""
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -7,15 +7,38 @@ import os
 # SQLite 数据库文件路径
 DATABASE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 os.makedirs(DATABASE_DIR, exist_ok=True)
-DATABASE_URL = f"sqlite:///{os.path.join(DATABASE_DIR, 'xinyi.db')}"
+# 可通过 DATABASE_URL 指向其他 SQLite 文件（如压测使用的临时库）
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(DATABASE_DIR, 'xinyi.db')}")
+
+# 连接池：聊天流式生成期间不占用连接，池大小只需覆盖同时进行的短事务
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
 
 # 创建数据库引擎
 engine = create_engine(
     DATABASE_URL, 
     connect_args={"check_same_thread": False},  # SQLite 特定配置
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
     echo=False  # 设为 True 可以看到 SQL 语句
 )
 
+# SQLite 持久化级别（可选）：如 SQLITE_JOURNAL_MODE=WAL、SQLITE_SYNCHRONOUS=NORMAL
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS")
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """为每个新连接设置 SQLite 日志模式与同步级别"""
+    cursor = dbapi_connection.cursor()
+    if SQLITE_JOURNAL_MODE:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    if SQLITE_SYNCHRONOUS:
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -0,0 +1,165 @@
+"""推理调度器 - 统一调度所有发往本地 Ollama 的请求
+
+- 并发槽位：同时在 Ollama 上执行的请求数（与 OLLAMA_NUM_PARALLEL 对齐）
+- 优先级：chat（对话首 token）> perception（感知规划）> background（日记分析等）
+- 同一优先级内按用户轮转，避免单个用户的并发请求占满队列
+- 排队总数有上限，超出时立即拒绝并给出建议重试时间（HTTP 503 + Retry-After）
+"""
+import os
+import math
+import asyncio
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Hashable, Optional
+
+# 优先级从高到低
+PRIORITY_CLASSES = ("chat", "perception", "background")
+
+# 当前请求所属用户（由请求入口设置，供公平排队使用；后台任务会继承该值）
+current_user_id: contextvars.ContextVar[Optional[Hashable]] = contextvars.ContextVar(
+    "inference_user_id", default=None
+)
+
+
+class SchedulerOverloaded(Exception):
+    """排队已满，请求被拒绝"""
+
+    def __init__(self, priority: str, retry_after: int):
+        super().__init__(f"本地模型繁忙（{priority} 队列已满），请 {retry_after} 秒后重试")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class InferenceScheduler:
+    """带优先级、按用户公平排队和准入控制的并发槽位"""
+
+    def __init__(self, slots: int = None, max_queue: int = None):
+        self.slots = slots or int(os.getenv("OLLAMA_SLOTS", "4"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("OLLAMA_MAX_QUEUE", "64"))
+        self.active = 0
+        self.waiting = 0
+        # 每个优先级：用户 -> 等待队列，OrderedDict 的顺序即轮转顺序
+        self.queues: Dict[str, "OrderedDict[Hashable, Deque[asyncio.Future]]"] = {
+            priority: OrderedDict() for priority in PRIORITY_CLASSES
+        }
+        # 槽位平均占用时长（秒，指数滑动平均），用于估算 Retry-After
+        self.hold_seconds: Optional[float] = None
+        self.class_stats = {
+            priority: {"admitted": 0, "rejected": 0, "waits": deque(maxlen=1000)}
+            for priority in PRIORITY_CLASSES
+        }
+
+    def retry_after(self) -> int:
+        hold = self.hold_seconds or 5.0
+        return max(1, math.ceil(hold * (self.waiting + 1) / self.slots))
+
+    def expected_wait(self, priority: str) -> float:
+        """按当前排队深度估算该优先级新请求拿到槽位前的等待时间（秒）"""
+        if self.active < self.slots and self.waiting == 0:
+            return 0.0
+        ahead = 0
+        for name in PRIORITY_CLASSES:
+            ahead += sum(len(waiters) for waiters in self.queues[name].values())
+            if name == priority:
+                break
+        return (self.hold_seconds or 5.0) * (ahead + 1) / self.slots
+
+    def check_admission(self, priority: str) -> None:
+        """请求入口的快速准入检查，排队已满时抛出 SchedulerOverloaded"""
+        if self.active >= self.slots and self.waiting >= self.max_queue:
+            self.class_stats[priority]["rejected"] += 1
+            raise SchedulerOverloaded(priority, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self, priority: str, user_id: Hashable = None):
+        """
+        占用一个推理槽位
+        :param priority: 优先级类别，见 PRIORITY_CLASSES
+        :param user_id: 公平排队的用户标识，默认取当前请求的用户
+        """
+        loop = asyncio.get_running_loop()
+        queued_at = loop.time()
+        await self._acquire(priority, user_id if user_id is not None else current_user_id.get())
+        acquired_at = loop.time()
+        stats = self.class_stats[priority]
+        stats["admitted"] += 1
+        stats["waits"].append(acquired_at - queued_at)
+        try:
+            yield
+        finally:
+            held = loop.time() - acquired_at
+            self.hold_seconds = held if self.hold_seconds is None else 0.8 * self.hold_seconds + 0.2 * held
+            self._release()
+
+    async def _acquire(self, priority: str, user_id: Hashable) -> None:
+        if self.active < self.slots and self.waiting == 0:
+            self.active += 1
+            return
+        self.check_admission(priority)
+
+        future = asyncio.get_running_loop().create_future()
+        users = self.queues[priority]
+        users.setdefault(user_id, deque()).append(future)
+        self.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 取消与分配同时发生：已拿到槽位，交给下一个等待者
+                self._release()
+            else:
+                waiters = users.get(user_id)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    self.waiting -= 1
+                    if not waiters:
+                        del users[user_id]
+            raise
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """把空闲槽位按优先级、用户轮转分配给等待者"""
+        while self.active < self.slots and self.waiting:
+            for priority in PRIORITY_CLASSES:
+                users = self.queues[priority]
+                if not users:
+                    continue
+                user_id, waiters = next(iter(users.items()))
+                future = waiters.popleft()
+                self.waiting -= 1
+                if waiters:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                if not future.done():
+                    future.set_result(None)
+                    self.active += 1
+                break
+
+    def stats(self) -> Dict:
+        classes = {}
+        for priority, stats in self.class_stats.items():
+            waits = sorted(stats["waits"])
+            classes[priority] = {
+                "admitted": stats["admitted"],
+                "rejected": stats["rejected"],
+                "queued": sum(len(waiters) for waiters in self.queues[priority].values()),
+                "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "wait_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0
+            }
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "classes": classes
+        }
+
+
+# 全局推理调度器实例
+inference_scheduler = InferenceScheduler()
@@ -0,0 +1,195 @@
+"""关键词引擎 - 基于 Aho-Corasick 自动机的多模式匹配
+
+危机、隐私、复杂度和阶段触发词统一编译为一个自动机，启动时构建一次。
+每条消息只需线性扫描一遍即可得到全部命中类别及其在原文中的位置，
+扫描耗时与关键词数量无关。自动机状态可以跨片段保留，用于流式输出的
+增量扫描（关键词被拆在两个片段之间也能命中）。
+"""
+import re
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# 危机关键词（保留关键词检测，因为危机情况需要快速响应）
+CRISIS_KEYWORDS = [
+    "自杀", "想死", "活不下去", "结束生命", "不想活了",
+    "自残", "割腕", "跳楼", "吃药", "了结",
+    "暴力", "伤害", "报复", "杀", "打死"
+]
+
+# 隐私关键词
+PRIVACY_KEYWORDS = [
+    "身份证", "家庭住址", "电话号码", "学号", "真名",
+    "恋爱", "分手", "出轨", "暗恋", "前任", "男朋友", "女朋友",
+    "父母离婚", "家暴", "家庭矛盾",
+    "性侵", "欺凌", "霸凌", "保密", "隐私"
+]
+
+# 复杂度关键词
+COMPLEXITY_KEYWORDS = [
+    "计划", "步骤", "方案", "分析", "建议", "对策",
+    "怎么办", "如何", "怎样", "怎么做", "具体", "详细"
+]
+
+# 用户主动询问解决方案时直接进入 solution 阶段
+SOLUTION_TRIGGERS = ["怎么办", "怎么做", "如何", "方法", "建议"]
+
+# 疑似手机号 / 身份证号（在全角折叠后、未剔除分隔符的文本上匹配）
+PHONE_PATTERN = re.compile(r'\d{11}')
+ID_CARD_PATTERN = re.compile(r'\d{17}[\dxX]')
+
+
+class KeywordMatch(NamedTuple):
+    """一次命中：关键词及其在原文中的 [start, end) 位置"""
+    keyword: str
+    start: int
+    end: int
+
+
+class ScanResult:
+    """一次扫描的结果，按类别汇总命中"""
+
+    def __init__(self, matches: Dict[str, List[KeywordMatch]]):
+        self.matches = matches
+
+    def has(self, category: str) -> bool:
+        return bool(self.matches.get(category))
+
+    def first(self, category: str) -> Optional[KeywordMatch]:
+        hits = self.matches.get(category)
+        return hits[0] if hits else None
+
+    def categories(self) -> List[str]:
+        return [category for category, hits in self.matches.items() if hits]
+
+
+def normalize(text: str) -> tuple[str, List[int]]:
+    """
+    轻量归一化：全角/半角折叠（NFKC）、转小写、剔除空白/标点/符号
+    用于识别 "自 杀"、"自*杀"、"ＳＯＳ" 之类的变体写法
+    :return: (归一化文本, 每个字符对应的原文下标)
+    """
+    chars = []
+    offsets = []
+    for index, ch in enumerate(text):
+        for folded in unicodedata.normalize("NFKC", ch).lower():
+            category = unicodedata.category(folded)
+            if category[0] in ("P", "Z", "S") or category in ("Cc", "Cf"):
+                continue
+            chars.append(folded)
+            offsets.append(index)
+    return "".join(chars), offsets
+
+
+class AhoCorasick:
+    """Aho-Corasick 自动机：一次扫描匹配全部模式"""
+
+    def __init__(self, patterns: Dict[str, Iterable[str]]):
+        """
+        :param patterns: {模式: 所属类别集合}
+        """
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[tuple]] = [[]]
+
+        for pattern, categories in patterns.items():
+            state = 0
+            for ch in pattern:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][ch] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].extend((pattern, category) for category in categories)
+
+        # 广度优先构建失败指针，并把失败状态的输出合并进来
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text: str):
+        """逐个产出 (结束下标, 模式, 类别)，结束下标为模式最后一个字符的位置"""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for index, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern, category in output[state]:
+                yield index, pattern, category
+
+    def advance(self, state: int, text: str) -> Tuple[int, List[tuple]]:
+        """从给定状态继续扫描，返回 (新状态, [(模式, 类别)])"""
+        goto, fail, output = self.goto, self.fail, self.output
+        hits = []
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            hits.extend(output[state])
+        return state, hits
+
+
+class KeywordEngine:
+    """统一关键词引擎：归一化 + 单次自动机扫描"""
+
+    def __init__(self, categories: Dict[str, List[str]]):
+        self.categories = categories
+        patterns: Dict[str, set] = {}
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                normalized, _ = normalize(keyword)
+                if normalized:
+                    patterns.setdefault(normalized, set()).add(category)
+        self.automaton = AhoCorasick(patterns)
+
+    def scan(self, text: str) -> ScanResult:
+        """扫描文本，返回各类别的命中（位置映射回原文）"""
+        normalized, offsets = normalize(text)
+        matches: Dict[str, List[KeywordMatch]] = {category: [] for category in self.categories}
+        for end, pattern, category in self.automaton.iter_matches(normalized):
+            start = end - len(pattern) + 1
+            matches[category].append(KeywordMatch(pattern, offsets[start], offsets[end] + 1))
+        for hits in matches.values():
+            hits.sort(key=lambda m: (m.start, -m.end))
+        return ScanResult(matches)
+
+    def stream_scanner(self, categories: Iterable[str]) -> "StreamScanner":
+        return StreamScanner(self.automaton, set(categories))
+
+
+class StreamScanner:
+    """流式增量扫描：逐片段归一化后续接自动机状态"""
+
+    def __init__(self, automaton: AhoCorasick, categories: Set[str]):
+        self.automaton = automaton
+        self.categories = categories
+        self.state = 0
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """
+        扫描新片段
+        :return: 本片段内结束的命中 [(关键词, 类别)]
+        """
+        normalized, _ = normalize(text)
+        self.state, hits = self.automaton.advance(self.state, normalized)
+        return [(pattern, category) for pattern, category in hits if category in self.categories]
+
+
+# 全局关键词引擎实例（导入时构建一次自动机）
+keyword_engine = KeywordEngine({
+    "crisis": CRISIS_KEYWORDS,
+    "privacy": PRIVACY_KEYWORDS,
+    "complexity": COMPLEXITY_KEYWORDS,
+    "solution_trigger": SOLUTION_TRIGGERS,
+})
@@ -1,22 +1,55 @@
 """FastAPI 主应用"""
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI
+
+# 加载环境变量（需早于各模块导入，模块级实例在导入时读取配置）
+load_dotenv()
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import inspect, text
 from .database import engine, Base
 from .routers import auth, chat, assessment, training, diary, growth, analytics
-
-# 加载环境变量
-load_dotenv()
+from .model_router import model_router
+from .models import Message
+from .write_behind import write_behind
+from .inference_scheduler import SchedulerOverloaded
+from .metrics import pipeline_metrics
+from .model_warmup import model_warmup
+from .ollama_pool import ollama_pool
 
 # 创建数据库表
 Base.metadata.create_all(bind=engine)
 
+# create_all 不会为已存在的表补建索引和新增列，这里单独补建
+for index in Message.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+if "truncated" not in {column["name"] for column in inspect(engine).get_columns("messages")}:
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE messages ADD COLUMN truncated BOOLEAN DEFAULT 0"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享的模型客户端与写后队列并开始后台预热模型，关闭时落盘并释放连接"""
+    await ollama_pool.startup()
+    await model_router.startup()
+    await write_behind.start()
+    await model_warmup.start()
+    yield
+    await model_warmup.stop()
+    await write_behind.stop()
+    await model_router.shutdown()
+    await ollama_pool.shutdown()
+
 # 创建 FastAPI 应用
 app = FastAPI(
     title="心翼 Xinyi API",
     description="心理健康陪伴助手后端 API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 配置 CORS（允许前端跨域请求）
@@ -28,6 +61,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 本地推理排队已满：快速拒绝并提示重试时间
+@app.exception_handler(SchedulerOverloaded)
+async def scheduler_overloaded_handler(request: Request, exc: SchedulerOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # 注册路由
 app.include_router(auth.router)
 app.include_router(chat.router)
@@ -52,3 +94,16 @@ async def root():
 async def health_check():
     """健康检查端点"""
     return {"status": "healthy"}
+
+# 就绪检查：本地模型全部预热完成前返回 503
+@app.get("/health/ready")
+async def readiness_check():
+    """就绪检查端点，按模型报告预热状态"""
+    readiness = model_warmup.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+# Prometheus 指标
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """聊天链路分阶段耗时直方图（Prometheus 文本格式）"""
+    return PlainTextResponse(pipeline_metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,199 @@
+"""聊天链路分阶段耗时统计 - 直方图聚合与 Prometheus 文本格式输出
+
+协调器用 StageTimer 记录每轮各阶段耗时，结束后按阶段、模型后端、对话阶段
+聚合为直方图，由 /metrics 以 Prometheus 文本格式暴露。
+"""
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+# 直方图桶上限（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class StageTimer:
+    """单轮对话的分阶段计时（毫秒）"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def record(self, stage: str, duration_ms: float) -> None:
+        # 同一阶段多次出现时累加
+        self.stages[stage] = round(self.stages.get(stage, 0.0) + duration_ms, 2)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def snapshot(self) -> Dict[str, float]:
+        return dict(self.stages)
+
+
+class Histogram:
+    """按标签分组的累积直方图"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series: Dict[Tuple[str, ...], List] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # [各桶计数, 总和, 总数]
+                series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.series.items()):
+                base = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+                lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+class Counter:
+    """按标签分组的计数器"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                base = ",".join(f'{name}="{_escape(value_)}"' for name, value_ in zip(self.label_names, labels))
+                lines.append(f"{self.name}{{{base}}} {value:g}" if base else f"{self.name} {value:g}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PipelineMetrics:
+    """聊天链路指标注册表"""
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "xinyi_chat_stage_seconds",
+            "Duration of each chat pipeline stage.",
+            ("stage", "backend", "phase")
+        )
+        self.turns = Counter(
+            "xinyi_chat_turns_total",
+            "Chat turns processed.",
+            ("backend", "phase", "outcome")
+        )
+        self.disconnects = Counter(
+            "xinyi_chat_disconnects_total",
+            "Turns whose client disconnected before the reply finished.",
+            ("backend", "stage")
+        )
+        self.tokens_saved = Counter(
+            "xinyi_chat_tokens_saved_total",
+            "Estimated reply tokens not generated because generation was cancelled on disconnect.",
+            ("backend",)
+        )
+        self.output_events = Counter(
+            "xinyi_chat_output_events_total",
+            "Events reported by the output transducers (think blocks removed, crisis keywords, normalized errors).",
+            ("backend", "transducer", "event")
+        )
+        self.routes = Counter(
+            "xinyi_chat_routes_total",
+            "Routing decisions by chosen backend and the rule that decided it.",
+            ("backend", "rule")
+        )
+        self.persistence_failures = Counter(
+            "xinyi_chat_persistence_failures_total",
+            "Assistant messages dropped by the write-behind queue after retries and per-row fallback.",
+            ()
+        )
+        # 各后端完整回复的平均输出片段数（指数滑动平均），用于估算断开时省下的 token
+        self.reply_tokens: Dict[str, float] = {}
+
+    def observe_turn(self, stages: Dict[str, float], backend: str, phase: str, outcome: str = "completed") -> None:
+        """记录一轮对话的各阶段耗时（毫秒）"""
+        for stage, duration_ms in stages.items():
+            self.stage_seconds.observe((stage, backend, phase), duration_ms / 1000)
+        self.turns.inc((backend, phase, outcome))
+
+    def observe_route(self, backend: str, rule: str) -> None:
+        """记录一次路由决策（privacy / static / breaker / latency / error_rate）"""
+        self.routes.inc((backend, rule))
+
+    def observe_output(self, backend: str, events) -> None:
+        """记录输出变换链的事件 [(变换器, 事件, 计数)]"""
+        for transducer, event, count in events:
+            self.output_events.inc((backend, transducer, event), count)
+
+    def observe_reply(self, backend: str, tokens: int) -> None:
+        """记录一次完整回复的输出片段数"""
+        average = self.reply_tokens.get(backend)
+        self.reply_tokens[backend] = tokens if average is None else 0.9 * average + 0.1 * tokens
+
+    def record_disconnect(self, backend: str, generated: int) -> int:
+        """
+        记录一次客户端断开
+        :param generated: 断开前已生成的片段数
+        :return: 估算省下的 token 数（按完整回复的平均长度）
+        """
+        average = self.reply_tokens.get(backend)
+        if average is None:
+            # 该后端尚无完整回复时按所有后端的平均长度估算
+            average = sum(self.reply_tokens.values()) / len(self.reply_tokens) if self.reply_tokens else 0
+        saved = max(0, round(average - generated))
+        self.disconnects.inc((backend, "streaming" if generated else "before_first_token"))
+        self.tokens_saved.inc((backend,), saved)
+        return saved
+
+    def disconnect_stats(self) -> Dict:
+        return {
+            "disconnects": {"/".join(labels): count for labels, count in self.disconnects.values.items()},
+            "tokens_saved": {labels[0]: count for labels, count in self.tokens_saved.values.items()},
+            "avg_reply_tokens": {backend: round(value, 1) for backend, value in self.reply_tokens.items()}
+        }
+
+    def render(self) -> str:
+        lines = (
+            self.stage_seconds.render() + self.turns.render()
+            + self.disconnects.render() + self.tokens_saved.render()
+            + self.output_events.render() + self.routes.render()
+            + self.persistence_failures.render()
+        )
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标实例
+pipeline_metrics = PipelineMetrics()
@@ -1,21 +1,67 @@
 """模型路由器 - 根据感知规划结果选择合适的模型服务"""
 import os
+import json
+import time
+import socket
+import asyncio
 import logging
-from typing import Union, AsyncGenerator
-import ollama
+import ipaddress
+from urllib.parse import urlparse
+from typing import Callable, Dict, Optional, Union, AsyncGenerator
 import httpx
+from .circuit_breaker import CircuitBreaker
+from .session_affinity import session_affinity
+from .inference_scheduler import inference_scheduler, SchedulerOverloaded
+from .backend_health import BackendHealth
+from .model_warmup import configured_model
+from .ollama_pool import ollama_pool
+from .output_transducers import ERROR_PREFIXES, output_pipeline
 
 logger = logging.getLogger(__name__)
 
+
+class RemoteModelError(Exception):
+    """云端模型调用失败（超时、非 200 响应、网络异常等）"""
+
 class LocalModelService:
     """本地模型服务（Ollama）"""
     
-    def __init__(self, model: str = "Ethanwhh/Qwen3-4B-xinyi"):
-        self.model = model
-        self.client = ollama.AsyncClient()
+    def __init__(self, model: str = None):
+        self.model = model or configured_model("chat")
+        self.model_label = "local-Qwen3-4B"
+        self.client = ollama_pool
+        self.breaker = CircuitBreaker(
+            "local",
+            failure_threshold=int(os.getenv("LOCAL_BREAKER_FAILURES", "3")),
+            recovery_timeout=float(os.getenv("LOCAL_BREAKER_RECOVERY", "15"))
+        )
+        self.affinity = session_affinity
+        self.keep_alive = os.getenv("LOCAL_KEEP_ALIVE", "30m")
+        # 请求时关闭 Qwen3 思考（需模型模板支持思考开关）；未关闭时由输出变换链去除推理块
+        self.disable_thinking = os.getenv("DISABLE_THINKING", "false").lower() == "true"
     
-    async def generate_with_prompt(self, system_prompt, user_input, conversation_history, stream=True):
-        """生成响应"""
+    async def generate_with_prompt(self, system_prompt, user_input, conversation_history, stream=True, session_id=None):
+        """
+        生成响应（经推理调度器以对话优先级占用 Ollama 槽位，生成结束后释放）
+        :param session_id: 对话 id；开启会话亲和时用于续接上一轮的模型上下文
+        """
+        try:
+            async with inference_scheduler.slot("chat"):
+                async for chunk in self._generate(
+                    system_prompt, user_input, conversation_history, stream, session_id
+                ):
+                    yield chunk
+        except SchedulerOverloaded as e:
+            yield f"[错误] {e}"
+    
+    async def _generate(self, system_prompt, user_input, conversation_history, stream, session_id):
+        if session_id is not None and self.affinity.enabled:
+            async for chunk in self._generate_with_session(
+                system_prompt, user_input, conversation_history, stream, session_id
+            ):
+                yield chunk
+            return
+        
         # 构建消息列表
         messages = [{"role": "system", "content": system_prompt}]
         messages.extend(conversation_history)
@@ -24,10 +70,11 @@ class LocalModelService:
         try:
             if stream:
                 # 流式响应
-                stream_response = await self.client.chat(
+                stream_response = self.client.chat_stream(
                     model=self.model,
                     messages=messages,
-                    stream=True
+                    think=False if self.disable_thinking else None,
+                    keep_alive=self.keep_alive
                 )
                 async for chunk in stream_response:
                     if 'message' in chunk and 'content' in chunk['message']:
@@ -37,11 +84,243 @@ class LocalModelService:
                 response = await self.client.chat(
                     model=self.model,
                     messages=messages,
-                    stream=False
+                    think=False if self.disable_thinking else None,
+                    keep_alive=self.keep_alive
                 )
                 yield response['message']['content']
         except Exception as e:
+            self.breaker.record_failure()
+            yield f"[错误] 本地模型调用失败: {str(e)}"
+        else:
+            self.breaker.record_success()
+    
+    async def _generate_with_session(self, system_prompt, user_input, conversation_history, stream, session_id):
+        """
+        会话亲和生成：使用 raw 模式自行渲染 ChatML，前缀未变时携带上一轮的 context 只发送新轮次
+        """
+        entry = self.affinity.lookup(session_id, system_prompt, conversation_history)
+        if entry is not None:
+            # context 截止于上一轮回复的最后一个 token（不含结束符）
+            prompt = "<|im_end|>\n" + _render_chatml([{"role": "user", "content": user_input}])
+            context = entry.context
+        else:
+            prompt = _render_chatml(
+                [{"role": "system", "content": system_prompt}]
+                + list(conversation_history)
+                + [{"role": "user", "content": user_input}]
+            )
+            context = None
+        if self.disable_thinking:
+            # raw 模式不套用模板，按 Qwen3 的方式在 assistant 轮次开头预填空推理块
+            prompt += EMPTY_THINK_BLOCK
+        
+        reply = []
+        final = None
+        try:
+            request = dict(model=self.model, prompt=prompt, raw=True, context=context, keep_alive=self.keep_alive)
+            response = self.client.generate_stream(**request) if stream else await self.client.generate(**request)
+            if stream:
+                async for chunk in response:
+                    if chunk.get("response"):
+                        reply.append(chunk["response"])
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        final = chunk
+            else:
+                reply.append(response["response"])
+                final = response
+                yield response["response"]
+        except Exception as e:
+            self.breaker.record_failure()
+            self.affinity.evict(session_id)
             yield f"[错误] 本地模型调用失败: {str(e)}"
+            return
+        self.breaker.record_success()
+        
+        # 只有完整结束的生成才保存上下文（被取消的流不会执行到这里）
+        if final is None:
+            return
+        if entry is not None:
+            self.affinity.record_reuse(session_id, len(entry.context))
+        else:
+            self.affinity.record_prefill(final.get("prompt_eval_count"), final.get("prompt_eval_duration"))
+        # context 保留原始输出（含推理块）用于续接；签名按协调器经变换链后保存的可见回复计算，
+        # 与下一轮从历史中读到的 assistant 消息一致
+        self.affinity.store(
+            session_id,
+            final.get("context"),
+            system_prompt,
+            list(conversation_history) + [
+                {"role": "user", "content": user_input},
+                {"role": "assistant", "content": output_pipeline.render("".join(reply))}
+            ]
+        )
+
+
+# Qwen3 关闭思考时 assistant 轮次开头的空推理块
+EMPTY_THINK_BLOCK = "<think>\n\n</think>\n\n"
+
+
+def _render_chatml(messages: list) -> str:
+    """按 Qwen 系列的 ChatML 模板渲染消息，末尾开启 assistant 轮次"""
+    rendered = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+    return rendered + "<|im_start|>assistant\n"
+
+
+class OpenAICompatibleLocalService:
+    """
+    本地 OpenAI 兼容推理服务（llama.cpp server、vLLM 等支持连续批处理的服务端）
+    服务端把并发会话的解码合并进同一批次，吞吐不受 Ollama 单模型并发数限制，
+    因此不经过 Ollama 推理调度器，并发上限由连接池大小控制。
+    只允许回环或内网地址，隐私对话不会离开本机 / 内网。
+    """
+    
+    def __init__(self, name: str, base_url: str, model: str, api_key: str = ""):
+        _require_local_address(name, base_url)
+        self.name = name
+        self.model = model
+        self.api_key = api_key
+        self.model_label = f"local-{name}"
+        # 地址可写到 /v1 或完整的 /v1/chat/completions
+        base_url = base_url.rstrip("/")
+        self.base_url = base_url if base_url.endswith("/chat/completions") else f"{base_url}/chat/completions"
+        self.disable_thinking = os.getenv("DISABLE_THINKING", "false").lower() == "true"
+        self.max_connections = int(os.getenv("LOCAL_OPENAI_MAX_CONNECTIONS", "64"))
+        self.client: Optional[httpx.AsyncClient] = None
+        self.breaker = CircuitBreaker(
+            f"local:{name}",
+            failure_threshold=int(os.getenv("LOCAL_BREAKER_FAILURES", "3")),
+            recovery_timeout=float(os.getenv("LOCAL_BREAKER_RECOVERY", "15"))
+        )
+    
+    async def startup(self) -> None:
+        """创建共享 HTTP 客户端"""
+        if self.client is not None:
+            return
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            )
+        )
+    
+    async def shutdown(self) -> None:
+        """关闭共享 HTTP 客户端，释放连接池"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """获取共享客户端；未经 lifespan 启动时（如脚本调用）按需创建"""
+        if self.client is None:
+            await self.startup()
+        return self.client
+    
+    async def generate_with_prompt(
+        self,
+        system_prompt: str,
+        user_input: str,
+        conversation_history: list,
+        stream: bool = True,
+        session_id: Optional[int] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        生成响应（服务端自行缓存前缀，session_id 忽略）
+        :yield: 响应文本片段（调用失败时输出错误提示）
+        """
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(conversation_history)
+        messages.append({"role": "user", "content": user_input})
+        
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "temperature": 0.7,
+            "top_p": 0.8
+        }
+        if self.disable_thinking:
+            # llama.cpp（--jinja）与 vLLM 通过模板参数关闭 Qwen3 思考
+            payload["chat_template_kwargs"] = {"enable_thinking": False}
+        
+        try:
+            client = await self._get_client()
+            if stream:
+                async with client.stream("POST", self.base_url, headers=headers, json=payload) as response:
+                    if response.status_code != 200:
+                        error_text = await response.aread()
+                        raise RuntimeError(f"HTTP {response.status_code}: {error_text.decode()}")
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data_str = line[5:].strip()
+                        if data_str == "[DONE]":
+                            continue
+                        try:
+                            data = json.loads(data_str)
+                        except json.JSONDecodeError:
+                            continue
+                        if data.get("choices"):
+                            content = data["choices"][0].get("delta", {}).get("content")
+                            if content:
+                                yield content
+            else:
+                response = await client.post(self.base_url, headers=headers, json=payload)
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code}: {response.text}")
+                result = response.json()
+                if result.get("choices"):
+                    yield result["choices"][0]["message"]["content"]
+        except Exception as e:
+            self.breaker.record_failure()
+            logger.error(f"本地模型 {self.name} 调用失败: {e}")
+            yield f"[错误] 本地模型调用失败: {str(e)}"
+        else:
+            self.breaker.record_success()
+
+
+def _require_local_address(name: str, url: str) -> None:
+    """本地后端地址必须解析为回环或内网地址，否则拒绝启动（隐私对话只能留在本地）"""
+    host = urlparse(url).hostname
+    if not host:
+        raise ValueError(f"本地模型后端 {name} 的地址无效: {url}")
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror as e:
+        raise ValueError(f"本地模型后端 {name} 的地址无法解析: {host} ({e})")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not (address.is_loopback or address.is_private or address.is_link_local):
+            raise ValueError(f"本地模型后端 {name} 的地址 {host} 解析到公网地址 {address}，不能承载隐私对话")
+
+
+def load_local_backends() -> Dict[str, OpenAICompatibleLocalService]:
+    """
+    从环境变量读取 OpenAI 兼容的本地后端
+    LOCAL_OPENAI_BACKENDS 格式：名称=地址,名称=地址（如 llamacpp=http://127.0.0.1:8080/v1）
+    """
+    backends = {}
+    model = os.getenv("LOCAL_OPENAI_MODEL", configured_model("chat"))
+    api_key = os.getenv("LOCAL_OPENAI_API_KEY", "")
+    for item in os.getenv("LOCAL_OPENAI_BACKENDS", "").split(","):
+        if not item.strip():
+            continue
+        name, sep, url = item.partition("=")
+        name = name.strip()
+        if not sep or not name or not url.strip():
+            raise ValueError(f"LOCAL_OPENAI_BACKENDS 格式错误: {item}（应为 名称=地址）")
+        if name in ("ollama", "remote") or name in backends:
+            raise ValueError(f"本地模型后端名称重复或为保留名称: {name}")
+        backends[name] = OpenAICompatibleLocalService(name, url.strip(), model, api_key)
+    return backends
+
+
+# 本地后端（Ollama 或 OpenAI 兼容服务），隐私对话只路由到这一类
+LocalService = Union[LocalModelService, OpenAICompatibleLocalService]
 
 
 class RemoteModelService:
@@ -54,15 +333,66 @@ class RemoteModelService:
         # 从环境变量读取 API Key
         self.api_key = os.getenv("MODELSCOPE_API_KEY", "")
         self.model_name = "Qwen/Qwen3-Next-80B-A3B-Instruct"
+        self.disable_thinking = os.getenv("DISABLE_THINKING", "false").lower() == "true"
         # ModelScope 官方推理 API
-        self.base_url = "https://api-inference.modelscope.cn/v1/chat/completions"
+        self.base_url = os.getenv(
+            "MODELSCOPE_BASE_URL",
+            "https://api-inference.modelscope.cn/v1/chat/completions"
+        )
+        
+        # 进程内共享的连接池（在应用 lifespan 中创建和关闭）
+        self.max_connections = int(os.getenv("REMOTE_MAX_CONNECTIONS", "100"))
+        self.max_keepalive_connections = int(os.getenv("REMOTE_MAX_KEEPALIVE", "20"))
+        self.keepalive_expiry = float(os.getenv("REMOTE_KEEPALIVE_EXPIRY", "60"))
+        self.http2 = os.getenv("REMOTE_HTTP2", "false").lower() == "true"
+        self.client: Optional[httpx.AsyncClient] = None
+        
+        self.breaker = CircuitBreaker(
+            "remote",
+            failure_threshold=int(os.getenv("REMOTE_BREAKER_FAILURES", "3")),
+            recovery_timeout=float(os.getenv("REMOTE_BREAKER_RECOVERY", "30"))
+        )
+    
+    async def startup(self) -> None:
+        """创建共享 HTTP 客户端"""
+        if self.client is not None:
+            return
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，云端模型客户端回退到 HTTP/1.1（pip install 'httpx[http2]'）")
+                http2 = False
+        self.client = httpx.AsyncClient(
+            timeout=60.0,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            )
+        )
+    
+    async def shutdown(self) -> None:
+        """关闭共享 HTTP 客户端，释放连接池"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """获取共享客户端；未经 lifespan 启动时（如脚本调用）按需创建"""
+        if self.client is None:
+            await self.startup()
+        return self.client
     
     async def generate_with_prompt(
         self,
         system_prompt: str,
         user_input: str,
         conversation_history: list,
-        stream: bool = True
+        stream: bool = True,
+        session_id: Optional[int] = None
     ) -> AsyncGenerator[str, None]:
         """
         使用系统提示词生成响应
@@ -70,11 +400,28 @@ class RemoteModelService:
         :param user_input: 用户输入
         :param conversation_history: 对话历史
         :param stream: 是否流式响应
-        :yield: 响应文本片段
+        :param session_id: 仅本地模型使用，云端忽略
+        :yield: 响应文本片段（调用失败时输出错误提示）
+        """
+        try:
+            async for chunk in self.stream_chat(system_prompt, user_input, conversation_history, stream):
+                yield chunk
+        except RemoteModelError as e:
+            yield f"错误：{e}"
+    
+    async def stream_chat(
+        self,
+        system_prompt: str,
+        user_input: str,
+        conversation_history: list,
+        stream: bool = True
+    ) -> AsyncGenerator[str, None]:
+        """
+        生成响应，失败时抛出 RemoteModelError 并计入熔断器
+        供对冲请求等需要区分正常输出与错误的调用方使用
         """
         if not self.api_key:
-            yield "错误：云端模型未配置 API Key，请联系管理员。"
-            return
+            raise RemoteModelError("云端模型未配置 API Key，请联系管理员。")
         
         # 构建消息列表
         messages = [{"role": "system", "content": system_prompt}]
@@ -93,120 +440,481 @@ class RemoteModelService:
             "temperature": 0.7,
             "top_p": 0.8
         }
+        if self.disable_thinking:
+            # ModelScope 的 Qwen3 混合思考模型以 enable_thinking 关闭思考
+            payload["enable_thinking"] = False
         
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                if stream:
-                    # 流式响应
-                    async with client.stream(
-                        "POST",
-                        self.base_url,
-                        headers=headers,
-                        json=payload
-                    ) as response:
-                        if response.status_code != 200:
-                            error_text = await response.aread()
-                            error_msg = f"云端模型调用失败 ({response.status_code}): {error_text.decode()}"
-                            logger.error(error_msg)
-                            yield f"错误：{error_msg}"
-                            return
-                        
-                        async for line in response.aiter_lines():
-                            if line.startswith("data:"):
-                                data_str = line[5:].strip()
-                                if data_str == "[DONE]":
-                                    break
-                                
-                                try:
-                                    import json
-                                    data = json.loads(data_str)
-                                    
-                                    # ModelScope 流式响应格式
-                                    if "choices" in data and len(data["choices"]) > 0:
-                                        delta = data["choices"][0].get("delta", {})
-                                        content = delta.get("content", "")
-                                        if content:
-                                            yield content
-                                except json.JSONDecodeError:
-                                    continue
-                else:
-                    # 非流式响应
-                    response = await client.post(
-                        self.base_url,
-                        headers=headers,
-                        json=payload
-                    )
-                    
+            client = await self._get_client()
+            if stream:
+                # 流式响应
+                async with client.stream(
+                    "POST",
+                    self.base_url,
+                    headers=headers,
+                    json=payload
+                ) as response:
                     if response.status_code != 200:
-                        error_msg = f"云端模型调用失败 ({response.status_code}): {response.text}"
-                        logger.error(error_msg)
-                        yield f"错误：{error_msg}"
-                        return
+                        error_text = await response.aread()
+                        raise RemoteModelError(
+                            f"云端模型调用失败 ({response.status_code}): {error_text.decode()}"
+                        )
                     
-                    result = response.json()
-                    if "choices" in result and len(result["choices"]) > 0:
-                        content = result["choices"][0]["message"]["content"]
-                        yield content
+                    async for line in response.aiter_lines():
+                        if line.startswith("data:"):
+                            data_str = line[5:].strip()
+                            # [DONE] 之后服务端随即结束响应；继续读到流末尾，
+                            # 使连接完整归还连接池而不是被提前关闭
+                            if data_str == "[DONE]":
+                                continue
+                            
+                            try:
+                                data = json.loads(data_str)
+                                
+                                # ModelScope 流式响应格式
+                                if "choices" in data and len(data["choices"]) > 0:
+                                    delta = data["choices"][0].get("delta", {})
+                                    content = delta.get("content", "")
+                                    if content:
+                                        yield content
+                            except json.JSONDecodeError:
+                                continue
+            else:
+                # 非流式响应
+                response = await client.post(
+                    self.base_url,
+                    headers=headers,
+                    json=payload
+                )
+                
+                if response.status_code != 200:
+                    raise RemoteModelError(f"云端模型调用失败 ({response.status_code}): {response.text}")
+                
+                result = response.json()
+                if "choices" in result and len(result["choices"]) > 0:
+                    content = result["choices"][0]["message"]["content"]
+                    yield content
         
+        except RemoteModelError as e:
+            logger.error(str(e))
+            self.breaker.record_failure()
+            raise
         except httpx.TimeoutException:
             error_msg = "云端模型响应超时，请稍后重试"
             logger.error(error_msg)
-            yield f"错误：{error_msg}"
+            self.breaker.record_failure()
+            raise RemoteModelError(error_msg)
         except Exception as e:
             error_msg = f"云端模型调用异常 - {type(e).__name__}: {str(e)}"
             logger.error(error_msg)
-            yield f"错误：{error_msg}"
+            self.breaker.record_failure()
+            raise RemoteModelError(error_msg)
+        else:
+            self.breaker.record_success()
+
+
+class HedgedModelService:
+    """
+    对冲服务：云端优先，本地兜底
+    云端在截止时间内未产出首个 token 时，同时向本地模型发起请求，先产出者胜出；
+    云端在产出首个 token 前失败则直接改用本地模型
+    """
+    
+    def __init__(
+        self,
+        primary: "RemoteModelService",
+        fallback: "LocalService",
+        deadline: float,
+        stats: Dict[str, int]
+    ):
+        self.primary = primary
+        self.fallback = fallback
+        self.deadline = deadline
+        self.stats = stats
+    
+    async def generate_with_prompt(
+        self,
+        system_prompt: str,
+        user_input: str,
+        conversation_history: list,
+        stream: bool = True,
+        session_id: Optional[int] = None,
+        on_winner: Optional[Callable[[str], None]] = None
+    ) -> AsyncGenerator[str, None]:
+        """:param on_winner: 确定胜出方后回调 "local" / "remote"，用于记录实际使用的后端"""
+        primary_stream = self.primary.stream_chat(system_prompt, user_input, conversation_history, stream)
+        fallback_stream = None
+        pending = {asyncio.create_task(anext(primary_stream)): primary_stream}
+        winner, first_chunk = None, None
+        # 两端都失败时输出的错误提示（本地服务以错误片段报告失败，云端抛出异常）
+        error = None
+        timeout = self.deadline
+        hedged = False
+        
+        def start_fallback():
+            # 本地熔断时不发起兜底请求（半开时本次即为试探请求）
+            if not self.fallback.breaker.allow_request():
+                return None
+            stream_ = self.fallback.generate_with_prompt(
+                system_prompt, user_input, conversation_history, stream, session_id=session_id
+            )
+            pending[asyncio.create_task(anext(stream_))] = stream_
+            return stream_
+        
+        try:
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 首 token 超过截止时间：发起本地对冲请求
+                    timeout = None
+                    fallback_stream = start_fallback()
+                    if fallback_stream is not None:
+                        hedged = True
+                        self.stats["hedged"] += 1
+                        logger.info(f"云端模型 {self.deadline}s 内未产出首个 token，发起本地对冲请求")
+                    continue
+                for task in done:
+                    source = pending.pop(task)
+                    if task.exception() is None:
+                        chunk = task.result()
+                        if source is fallback_stream and chunk.startswith(ERROR_PREFIXES):
+                            # 本地快速失败（服务不可用、槽位繁忙）不能胜出，继续等待云端
+                            error = chunk
+                            await source.aclose()
+                            continue
+                        winner, first_chunk = source, chunk
+                        break
+                    if source is fallback_stream:
+                        error = f"[错误] 本地模型调用失败: {task.exception()}"
+                        await source.aclose()
+                        continue
+                    error = error or f"错误：{str(task.exception()) or '云端模型未返回内容'}"
+                    # 云端首 token 前失败：改用本地模型
+                    if fallback_stream is None:
+                        timeout = None
+                        fallback_stream = start_fallback()
+                        if fallback_stream is not None:
+                            self.stats["remote_error_fallbacks"] += 1
+            
+            if winner is None:
+                if error is not None:
+                    yield error
+                return
+            if on_winner is not None:
+                on_winner("local" if winner is fallback_stream else "remote")
+            if hedged:
+                self.stats["hedge_won_local" if winner is fallback_stream else "hedge_won_remote"] += 1
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for source in pending.values():
+                await source.aclose()
+        
+        try:
+            yield first_chunk
+            try:
+                async for chunk in winner:
+                    yield chunk
+            except RemoteModelError as e:
+                yield f"错误：{e}"
+        finally:
+            await winner.aclose()
+
+
+class RoutingDecision:
+    """单轮路由决策"""
+
+    __slots__ = ("backend", "service", "rule", "reason", "served_by", "model_name")
+    
+    def __init__(self, backend: str, service, rule: str, reason: str, model_name: str):
+        # 路由选择的后端类型（local/remote），决定上下文预算等
+        self.backend = backend
+        self.service = service
+        # 命中的规则：privacy / static / breaker / latency / error_rate
+        self.rule = rule
+        self.reason = reason
+        # 实际产出回复的后端与模型名（对冲时本地胜出会与 backend 不同）
+        self.served_by = backend
+        self.model_name = model_name
 
 
 class ModelRouter:
     """
     模型路由器
-    根据感知规划模块的判断结果，选择使用本地模型或远程模型
+    根据感知规划模块的判断结果，选择使用本地模型或远程模型；
+    非隐私问题再结合各后端的实时健康度（首 token 延迟、输出速率、排队深度、错误率）调整
     """
     
     def __init__(self):
-        self.local_service = LocalModelService(model="Ethanwhh/Qwen3-4B-xinyi")
+        # 本地后端注册表：Ollama 与 LOCAL_OPENAI_BACKENDS 中的 OpenAI 兼容服务，LOCAL_BACKEND 选择生效的一个
+        self.local_backends: Dict[str, LocalService] = {
+            "ollama": LocalModelService()
+        }
+        self.local_backends.update(load_local_backends())
+        self.local_backend = os.getenv("LOCAL_BACKEND", "ollama")
+        if self.local_backend not in self.local_backends:
+            raise ValueError(
+                f"LOCAL_BACKEND={self.local_backend} 未注册（可选: {', '.join(self.local_backends)}）"
+            )
+        self.local_service = self.local_backends[self.local_backend]
         self.remote_service = RemoteModelService()
+        
+        # 降级统计
+        self.fallback_stats = {
+            "remote_breaker_fallbacks": 0,
+            "local_breaker_fallbacks": 0,
+            "remote_error_fallbacks": 0,
+            "hedged": 0,
+            "hedge_won_local": 0,
+            "hedge_won_remote": 0,
+            "latency_to_local": 0,
+            "latency_to_remote": 0
+        }
+        # 云端首 token 截止时间（秒），超时后发起本地对冲请求；0 表示不对冲
+        self.hedge_deadline = float(os.getenv("REMOTE_HEDGE_DEADLINE", "8"))
+        self.hedged_service = HedgedModelService(
+            self.remote_service,
+            self.local_service,
+            self.hedge_deadline or None,
+            self.fallback_stats
+        )
+        
+        # 延迟感知路由策略：复杂问题可改走本地、简单问题可改走云端，
+        # 前提是两端样本充足、目标后端错误率与输出速率达标，且预计首 token 至少快 margin
+        self.health = {"local": BackendHealth("local"), "remote": BackendHealth("remote")}
+        self.latency_routing = os.getenv("LATENCY_ROUTING", "true").lower() == "true"
+        self.complex_to_local = os.getenv("LATENCY_ROUTING_COMPLEX_TO_LOCAL", "true").lower() == "true"
+        self.simple_to_remote = os.getenv("LATENCY_ROUTING_SIMPLE_TO_REMOTE", "true").lower() == "true"
+        self.latency_margin_ms = float(os.getenv("LATENCY_ROUTING_MARGIN_MS", "1500"))
+        self.min_samples = int(os.getenv("LATENCY_ROUTING_MIN_SAMPLES", "5"))
+        self.max_error_rate = float(os.getenv("LATENCY_ROUTING_MAX_ERROR_RATE", "0.2"))
+        self.min_tokens_per_s = float(os.getenv("LATENCY_ROUTING_MIN_TOKENS_PER_S", "5"))
     
-    def get_model_service(
-        self,
-        is_privacy_issue: bool,
-        is_complex_issue: bool
-    ) -> Union[LocalModelService, RemoteModelService]:
+    def route(self, is_privacy_issue: bool, is_complex_issue: bool) -> RoutingDecision:
         """
-        根据双层判断结果返回合适的模型服务
+        根据双层判断结果与后端健康度做出本轮路由决策，并记录决策原因
         
         路由逻辑：
-        1. 隐私问题 → 强制使用本地模型（保护隐私）
-        2. 复杂问题 → 使用云端大模型（Qwen3-Next-80B）
-        3. 简单问答 → 使用本地模型（Qwen3-4B）
+        1. 隐私问题 → 强制使用本地模型（保护隐私，不受熔断与延迟影响；本地后端均限定为本机 / 内网地址）
+        2. 复杂问题 → 使用云端大模型（Qwen3-Next-80B），本地对冲兜底；云端熔断时改用本地
+        3. 简单问答 → 使用本地模型（Qwen3-4B）；本地熔断且云端正常时改用云端
+        4. 非隐私问题在 2、3 的基础上，另一端预计首 token 明显更快（或默认后端错误率过高）时改走另一端
         
         :param is_privacy_issue: 是否为隐私问题
         :param is_complex_issue: 是否为复杂问题
-        :return: 模型服务实例
         """
-        if is_privacy_issue:
-            # 隐私问题强制本地
-            return self.local_service
+        backend, rule, reason = self._decide(is_privacy_issue, is_complex_issue)
+        # 目标后端的熔断器处于半开状态时，本轮请求即为其唯一的试探请求
+        # （_decide 只查询熔断器状态；强制本地的隐私问题在熔断时照常发往本地）
+        breaker = self.local_service.breaker if backend == "local" else self.remote_service.breaker
+        breaker.allow_request()
+        if rule == "breaker":
+            key = "remote_breaker_fallbacks" if is_complex_issue else "local_breaker_fallbacks"
+            self.fallback_stats[key] += 1
+        elif rule in ("latency", "error_rate"):
+            self.fallback_stats[f"latency_to_{backend}"] += 1
+        
+        if backend == "local":
+            service = self.local_service
         elif is_complex_issue:
-            # 复杂问题使用云端
-            return self.remote_service
+            # 复杂问题使用云端，本地对冲兜底
+            service = self.hedged_service
         else:
-            # 默认本地
-            return self.local_service
+            service = self.remote_service
+        logger.info(f"路由决策: {backend}（{reason}）")
+        return RoutingDecision(backend, service, rule, reason, self.model_label(backend))
+    
+    def _decide(self, is_privacy_issue: bool, is_complex_issue: bool):
+        """返回 (后端, 规则, 原因)，不产生统计副作用"""
+        if is_privacy_issue:
+            # 隐私问题强制本地，不参与任何降级或延迟调整
+            return "local", "privacy", "隐私问题强制本地"
+        preferred = "remote" if is_complex_issue else "local"
+        other = "local" if is_complex_issue else "remote"
+        breakers = {"local": self.local_service.breaker, "remote": self.remote_service.breaker}
+        if not breakers[preferred].available():
+            if is_complex_issue:
+                return "local", "breaker", "云端模型已熔断，复杂问题改用本地模型"
+            if breakers["remote"].available():
+                return "remote", "breaker", "本地模型已熔断，非隐私简单问题改用云端模型"
+            return "local", "static", "本地与云端均已熔断，使用本地模型"
+        static_reason = "复杂问题使用云端模型" if is_complex_issue else "简单问题使用本地模型"
+        
+        allowed = self.complex_to_local if is_complex_issue else self.simple_to_remote
+        if not self.latency_routing or not allowed or not breakers[other].available():
+            return preferred, "static", static_reason
+        
+        preferred_stats = self.health[preferred].stats()
+        other_stats = self.health[other].stats()
+        if preferred_stats["samples"] < self.min_samples or other_stats["samples"] < self.min_samples:
+            return preferred, "static", f"{static_reason}（健康度样本不足）"
+        if other_stats["error_rate"] > self.max_error_rate:
+            return preferred, "static", static_reason
+        if other_stats["tokens_per_s"] is not None and other_stats["tokens_per_s"] < self.min_tokens_per_s:
+            return preferred, "static", static_reason
+        if preferred_stats["error_rate"] > self.max_error_rate:
+            return other, "error_rate", (
+                f"{preferred} 错误率 {preferred_stats['error_rate']:.0%} 超过上限，改走 {other}"
+            )
+        
+        preferred_ttft = self.expected_ttft_ms(preferred, preferred_stats)
+        other_ttft = self.expected_ttft_ms(other, other_stats)
+        if preferred_ttft is not None and other_ttft is not None \
+                and other_ttft + self.latency_margin_ms <= preferred_ttft:
+            return other, "latency", (
+                f"预计首 token {other} {other_ttft:.0f}ms，{preferred} {preferred_ttft:.0f}ms"
+            )
+        return preferred, "static", static_reason
+    
+    def expected_ttft_ms(self, backend: str, stats: Dict = None) -> Optional[float]:
+        """
+        预计首 token 延迟：滚动中位数；本地 Ollama 当前有排队时，
+        取无排队首 token 延迟（p10）加当前排队的预计等待，二者的较大值
+        """
+        stats = stats or self.health[backend].stats()
+        if stats["ttft_p50_ms"] is None:
+            return None
+        expected = stats["ttft_p50_ms"]
+        if backend == "local" and isinstance(self.local_service, LocalModelService):
+            wait_ms = inference_scheduler.expected_wait("chat") * 1000
+            expected = max(expected, stats["ttft_p10_ms"] + wait_ms)
+        return expected
+    
+    def generate(
+        self,
+        decision: RoutingDecision,
+        system_prompt: str,
+        user_input: str,
+        conversation_history: list,
+        session_id: Optional[int] = None
+    ) -> AsyncGenerator[str, None]:
+        """按路由决策流式生成，结束后把首 token 延迟、输出速率与错误计入实际后端的健康度"""
+        kwargs = {}
+        if decision.service is self.hedged_service:
+            def on_winner(source: str) -> None:
+                decision.served_by = source
+                decision.model_name = self.model_label(source)
+            kwargs["on_winner"] = on_winner
+        stream = decision.service.generate_with_prompt(
+            system_prompt, user_input, conversation_history, stream=True, session_id=session_id, **kwargs
+        )
+        return self.track(decision.backend, stream, decision)
+    
+    async def track(
+        self,
+        backend: str,
+        stream: AsyncGenerator[str, None],
+        decision: Optional[RoutingDecision] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        包装模型流，统计正在生成的请求数，完整结束后记录一个健康度样本
+        （推测式生成在路由决策之前启动，不传 decision，按 backend 记录）
+        """
+        in_flight = self.health[backend]
+        in_flight.in_flight += 1
+        started = time.perf_counter()
+        first_at = None
+        tokens = 0
+        error = False
+        try:
+            async for chunk in stream:
+                # 对冲在产出首个片段前确定胜出方，在途请求改记到实际产出回复的后端
+                if decision is not None and self.health[decision.served_by] is not in_flight:
+                    in_flight.in_flight -= 1
+                    in_flight = self.health[decision.served_by]
+                    in_flight.in_flight += 1
+                if chunk.startswith(ERROR_PREFIXES):
+                    error = True
+                elif chunk:
+                    if first_at is None:
+                        first_at = time.perf_counter()
+                    # 错误提示不计入输出速率
+                    tokens += 1
+                yield chunk
+        finally:
+            in_flight.in_flight -= 1
+            await stream.aclose()
+        # 只统计完整结束的生成（客户端断开时不会执行到这里）；
+        # 对冲改由另一端产出时首 token 含等待截止时间，不计入首 token 延迟
+        served_by = decision.served_by if decision is not None else backend
+        ttft_ms = None
+        if first_at is not None and served_by == backend:
+            ttft_ms = (first_at - started) * 1000
+        duration = time.perf_counter() - first_at if first_at is not None else 0.0
+        self.health[served_by].observe(ttft_ms, tokens, duration, error)
+    
+    def model_label(self, backend: str) -> str:
+        """后端类型对应的模型名（写入 Message.model_used）"""
+        if backend == "remote":
+            return "remote-Qwen3-Next-80B"
+        return self.local_service.model_label
+    
+    def get_model_service(
+        self,
+        is_privacy_issue: bool,
+        is_complex_issue: bool
+    ) -> Union[LocalService, RemoteModelService, HedgedModelService]:
+        """返回本轮使用的模型服务（见 route）"""
+        return self.route(is_privacy_issue, is_complex_issue).service
     
     def get_model_name(
         self,
         is_privacy_issue: bool,
         is_complex_issue: bool
     ) -> str:
-        """返回模型名称（用于日志记录）"""
-        if is_privacy_issue:
-            return "local-Qwen3-4B"
-        elif is_complex_issue:
-            return "remote-Qwen3-Next-80B"
-        else:
-            return "local-Qwen3-4B"
+        """返回路由选择的模型名称（对冲时实际使用的模型以 RoutingDecision.model_name 为准）"""
+        return self.model_label(self.get_backend(is_privacy_issue, is_complex_issue))
+    
+    def get_backend(self, is_privacy_issue: bool, is_complex_issue: bool) -> str:
+        """结合熔断状态与健康度返回本轮使用的后端类型（local/remote），不产生统计副作用"""
+        return self._decide(is_privacy_issue, is_complex_issue)[0]
+    
+    def get_backend_status(self) -> Dict[str, object]:
+        """熔断器状态、后端健康度与降级统计（用于监控）"""
+        return {
+            "local_backend": self.local_backend,
+            "breakers": {
+                "local": self.local_service.breaker.snapshot(),
+                "remote": self.remote_service.breaker.snapshot()
+            },
+            "local_backends": {
+                name: service.breaker.snapshot() for name, service in self.local_backends.items()
+            },
+            "health": {
+                backend: dict(health.stats(), expected_ttft_ms=self.expected_ttft_ms(backend))
+                for backend, health in self.health.items()
+            },
+            "latency_routing": {
+                "enabled": self.latency_routing,
+                "complex_to_local": self.complex_to_local,
+                "simple_to_remote": self.simple_to_remote,
+                "margin_ms": self.latency_margin_ms,
+                "min_samples": self.min_samples,
+                "max_error_rate": self.max_error_rate,
+                "min_tokens_per_s": self.min_tokens_per_s
+            },
+            "fallbacks": dict(self.fallback_stats),
+            "ollama_pool": ollama_pool.stats()
+        }
+    
+    def evict_session(self, conversation_id: int) -> None:
+        """释放对话在本地模型上保存的上下文（会话亲和）"""
+        session_affinity.evict(conversation_id)
+    
+    async def startup(self) -> None:
+        """创建各 HTTP 后端的共享客户端"""
+        await self.remote_service.startup()
+        for service in self.local_backends.values():
+            if isinstance(service, OpenAICompatibleLocalService):
+                await service.startup()
+    
+    async def shutdown(self) -> None:
+        """关闭各 HTTP 后端的共享客户端"""
+        await self.remote_service.shutdown()
+        for service in self.local_backends.values():
+            if isinstance(service, OpenAICompatibleLocalService):
+                await service.shutdown()
 
 
 # 全局路由器实例
@@ -0,0 +1,193 @@
+"""模型预热与常驻 - 应用启动时预加载本地 Ollama 模型，卸载后在后台重新预热
+
+- 每个角色（chat 对话生成、perception 感知规划）解析出唯一的规范模型名：
+  按配置名与 Ollama 已安装模型做不区分大小写的匹配，统一使用安装时的写法，
+  各调用方不再各自使用大小写不同的名称
+- 预热：以角色配置的 keep_alive 加载模型，再用共享的系统提示词做一次只生成 1 个
+  token 的预热生成，使系统提示词前缀进入 Ollama 的提示词缓存
+- 常驻：后台定期查询 /api/ps，发现模型被卸载（keep_alive 到期、内存压力）后重新预热
+- 就绪检查按模型报告 warm / warming / cold / missing
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from .inference_scheduler import inference_scheduler
+from .ollama_pool import ollama_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_MODEL = "Ethanwhh/Qwen3-4B-xinyi"
+
+
+def configured_model(role: str) -> str:
+    """角色的配置模型名：OLLAMA_<ROLE>_MODEL，未配置时使用 OLLAMA_MODEL"""
+    return os.getenv(f"OLLAMA_{role.upper()}_MODEL") or os.getenv("OLLAMA_MODEL", DEFAULT_OLLAMA_MODEL)
+
+
+def model_key(name: str) -> str:
+    """Ollama 模型名的比较键：不区分大小写，未写标签时视为 :latest"""
+    name = name.strip().lower()
+    return name if ":" in name.rsplit("/", 1)[-1] else f"{name}:latest"
+
+
+class WarmTarget:
+    """一个需要预热的模型（可被多个角色共用）"""
+
+    def __init__(self, name: str, keep_alive: str):
+        self.name = name
+        self.keep_alive = keep_alive
+        self.roles: List[str] = []
+        # 使用该模型的对象与属性名，解析出规范名后回写
+        self.holders: List[tuple] = []
+        self.prompts: List[str] = []
+        self.state = "cold"
+        self.resolved = False
+        self.warmups = 0
+        self.unloads = 0
+        self.last_warmup_ms: Optional[float] = None
+        self.warmed_at: Optional[float] = None
+        self.expires_at: Optional[str] = None
+        self.error: Optional[str] = None
+
+    def snapshot(self) -> Dict:
+        return {
+            "model": self.name,
+            "roles": self.roles,
+            "state": self.state,
+            "keep_alive": self.keep_alive,
+            "warmups": self.warmups,
+            "unloads": self.unloads,
+            "last_warmup_ms": self.last_warmup_ms,
+            "warm_seconds": round(time.monotonic() - self.warmed_at, 1) if self.state == "warm" else None,
+            "expires_at": self.expires_at,
+            "error": self.error
+        }
+
+
+class ModelWarmup:
+    """本地模型预热与常驻管理"""
+
+    def __init__(self):
+        self.enabled = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+        self.check_interval = float(os.getenv("MODEL_WARMUP_CHECK_SECONDS", "60"))
+        self.client = ollama_pool
+        self.targets: Dict[str, WarmTarget] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def register(self, role: str, holder, attr: str, keep_alive: str, prompts: List[str] = ()) -> None:
+        """
+        登记一个角色使用的模型
+        :param holder: 使用该模型的对象，holder.<attr> 为模型名，解析后回写为规范名
+        :param prompts: 预热时缓存的系统提示词
+        """
+        name = getattr(holder, attr)
+        target = self.targets.get(model_key(name))
+        if target is None:
+            target = self.targets[model_key(name)] = WarmTarget(name, keep_alive)
+        target.roles.append(role)
+        target.holders.append((holder, attr))
+        target.prompts.extend(prompt for prompt in prompts if prompt not in target.prompts)
+
+    async def start(self) -> None:
+        """在后台开始预热（不阻塞应用启动，预热完成前就绪检查报告 cold / warming）"""
+        if self.enabled and self.targets and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.resolve()
+                await self.check()
+            except Exception as e:
+                logger.warning(f"模型预热检查失败: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    async def resolve(self) -> None:
+        """按已安装模型解析各角色的规范模型名，并回写到使用方"""
+        if all(target.resolved for target in self.targets.values()):
+            return
+        response = await self.client.list()
+        installed = {model_key(model.model): model.model for model in response.models}
+        for key, target in self.targets.items():
+            if target.resolved:
+                continue
+            name = installed.get(key)
+            if name is None:
+                target.state = "missing"
+                target.error = f"Ollama 未安装模型 {target.name}"
+                logger.error(target.error)
+                continue
+            if name != target.name:
+                logger.info(f"角色 {', '.join(target.roles)} 的模型名 {target.name} 统一为 {name}")
+            target.name = name
+            target.resolved = True
+            target.error = None
+            for holder, attr in target.holders:
+                setattr(holder, attr, name)
+
+    async def check(self) -> None:
+        """查询已加载的模型，未加载（首次或被卸载）的重新预热"""
+        response = await self.client.ps()
+        loaded = {model_key(model.model): model for model in response.models}
+        for key, target in self.targets.items():
+            if not target.resolved:
+                continue
+            model = loaded.get(key)
+            if model is not None:
+                target.expires_at = str(model.expires_at) if model.expires_at else None
+                continue
+            if target.state == "warm":
+                target.unloads += 1
+                logger.warning(f"模型 {target.name} 已被 Ollama 卸载，重新预热")
+            await self.warm(target)
+
+    async def warm(self, target: WarmTarget) -> None:
+        """加载模型并用系统提示词做一次预热生成（占用后台优先级槽位，不挤占对话）"""
+        target.state = "warming"
+        started = time.perf_counter()
+        try:
+            async with inference_scheduler.slot("background"):
+                # 空提示词只加载模型并设置常驻时间
+                await self.client.generate(
+                    "background", model=target.name, prompt="", keep_alive=target.keep_alive
+                )
+                for prompt in target.prompts:
+                    await self.client.chat(
+                        "background",
+                        model=target.name,
+                        messages=[{"role": "system", "content": prompt}, {"role": "user", "content": "你好"}],
+                        options={"num_predict": 1},
+                        keep_alive=target.keep_alive
+                    )
+        except Exception as e:
+            target.state = "cold"
+            target.error = f"预热失败: {e}"
+            logger.warning(f"模型 {target.name} {target.error}")
+            return
+        target.state = "warm"
+        target.error = None
+        target.warmups += 1
+        target.warmed_at = time.monotonic()
+        target.last_warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"模型 {target.name} 预热完成，耗时 {target.last_warmup_ms}ms")
+
+    def readiness(self) -> Dict:
+        """就绪状态：所有登记的模型均已预热时就绪（未开启预热时始终就绪）"""
+        models = {target.name: target.snapshot() for target in self.targets.values()}
+        ready = not self.enabled or all(target.state == "warm" for target in self.targets.values())
+        return {"ready": ready, "warmup": self.enabled, "models": models}
+
+
+# 全局预热管理器
+model_warmup = ModelWarmup()
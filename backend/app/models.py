@@ -1,5 +1,5 @@
 """数据库模型定义"""
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -51,6 +51,10 @@ class Conversation(Base):
 class Message(Base):
     """对话消息模型"""
     __tablename__ = "messages"
+    __table_args__ = (
+        # 按对话读取最近消息的尾部查询
+        Index("ix_messages_conversation_tail", "conversation_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
@@ -63,6 +67,7 @@ class Message(Base):
     model_used = Column(String(100), nullable=True)  # 使用的模型
     is_privacy_issue = Column(Boolean, default=False)  # 是否隐私问题
     is_complex_issue = Column(Boolean, default=False)  # 是否复杂问题
+    truncated = Column(Boolean, default=False)  # 客户端中途断开，回复未生成完整
 
     # 关系
     conversation = relationship("Conversation", back_populates="messages")
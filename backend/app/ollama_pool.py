@@ -0,0 +1,155 @@
+"""共享 Ollama 客户端 - 进程内唯一的异步客户端与连接池
+
+对话生成、感知规划、对话智能体、日记分析与模型预热共用同一个 ollama.AsyncClient，
+底层 httpx 连接池在应用 lifespan 中创建和关闭，请求路径上不再新建客户端和连接。
+
+统一的调用语义：
+- 超时按优先级类别（chat / perception / background / control）配置：
+  非流式调用限制整次调用，流式调用限制到首个片段（含模型加载与预填充），
+  之后片段之间的间隔由连接池的读超时限制
+- 重试只针对请求尚未被处理的失败：连接失败与 Ollama 排队已满（503），
+  按指数退避重试；超时与其他错误不重试，流式调用产出首个片段后不再重试
+"""
+import os
+import asyncio
+import logging
+from typing import AsyncGenerator, Dict, Optional
+import httpx
+import ollama
+
+logger = logging.getLogger(__name__)
+
+# 可安全重试的失败：连接未建立（ollama 把非流式的连接错误转换为 ConnectionError）
+RETRYABLE_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class OllamaPool:
+    """进程内共享的 Ollama 异步客户端"""
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+        self.max_keepalive_connections = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "16"))
+        self.connect_timeout = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+        # 流式生成中两个片段之间的最长间隔
+        self.read_timeout = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+        self.retries = int(os.getenv("OLLAMA_RETRIES", "2"))
+        self.retry_backoff = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.2"))
+        # 各优先级的调用超时（秒）
+        self.timeouts = {
+            "chat": float(os.getenv("OLLAMA_TIMEOUT_CHAT", "120")),
+            "perception": float(os.getenv("OLLAMA_TIMEOUT_PERCEPTION", "30")),
+            "background": float(os.getenv("OLLAMA_TIMEOUT_BACKGROUND", "180")),
+            "control": float(os.getenv("OLLAMA_TIMEOUT_CONTROL", "10"))
+        }
+        self.client: Optional[ollama.AsyncClient] = None
+        self.stats_counts = {"calls": 0, "retries": 0, "timeouts": 0, "errors": 0}
+
+    async def startup(self) -> None:
+        """创建共享客户端与连接池"""
+        if self.client is not None:
+            return
+        self.client = ollama.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections
+            )
+        )
+
+    async def shutdown(self) -> None:
+        """关闭共享客户端，释放连接池"""
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def _get_client(self) -> ollama.AsyncClient:
+        """获取共享客户端；未经 lifespan 启动时（如脚本调用）按需创建"""
+        if self.client is None:
+            await self.startup()
+        return self.client
+
+    async def chat(self, priority: str = "chat", **kwargs):
+        """非流式对话调用（参数同 ollama.AsyncClient.chat）"""
+        return await self._call("chat", priority, kwargs)
+
+    async def generate(self, priority: str = "chat", **kwargs):
+        """非流式生成调用（参数同 ollama.AsyncClient.generate）"""
+        return await self._call("generate", priority, kwargs)
+
+    def chat_stream(self, priority: str = "chat", **kwargs) -> AsyncGenerator:
+        """流式对话调用，逐个产出响应片段"""
+        return self._stream("chat", priority, kwargs)
+
+    def generate_stream(self, priority: str = "chat", **kwargs) -> AsyncGenerator:
+        """流式生成调用，逐个产出响应片段"""
+        return self._stream("generate", priority, kwargs)
+
+    async def list(self):
+        return await self._call("list", "control", {})
+
+    async def ps(self):
+        return await self._call("ps", "control", {})
+
+    async def _call(self, method: str, priority: str, kwargs: Dict):
+        client = await self._get_client()
+        self.stats_counts["calls"] += 1
+        for attempt in range(self.retries + 1):
+            try:
+                async with asyncio.timeout(self.timeouts[priority]):
+                    return await getattr(client, method)(**kwargs)
+            except Exception as e:
+                if not await self._should_retry(e, attempt, method):
+                    raise
+
+    async def _stream(self, method: str, priority: str, kwargs: Dict) -> AsyncGenerator:
+        client = await self._get_client()
+        self.stats_counts["calls"] += 1
+        for attempt in range(self.retries + 1):
+            # ollama 的流式调用在首次迭代时才发出请求，因此连接失败与首个片段的超时都在这里处理
+            stream = await getattr(client, method)(stream=True, **kwargs)
+            try:
+                async with asyncio.timeout(self.timeouts[priority]):
+                    first = await anext(stream)
+            except StopAsyncIteration:
+                return
+            except Exception as e:
+                await stream.aclose()
+                if not await self._should_retry(e, attempt, method):
+                    raise
+                continue
+            break
+        try:
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    async def _should_retry(self, error: Exception, attempt: int, method: str) -> bool:
+        """判断失败是否可重试；可重试时等待退避时间"""
+        if isinstance(error, TimeoutError):
+            self.stats_counts["timeouts"] += 1
+            return False
+        retryable = isinstance(error, RETRYABLE_ERRORS) or (
+            isinstance(error, ollama.ResponseError) and error.status_code == 503
+        )
+        if not retryable or attempt >= self.retries:
+            self.stats_counts["errors"] += 1
+            return False
+        self.stats_counts["retries"] += 1
+        delay = self.retry_backoff * (2 ** attempt)
+        logger.warning(f"Ollama {method} 调用失败（{type(error).__name__}: {error}），{delay:.1f}s 后重试")
+        await asyncio.sleep(delay)
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "max_connections": self.max_connections,
+            "timeouts_config": dict(self.timeouts),
+            "retries_config": self.retries,
+            **self.stats_counts
+        }
+
+
+# 全局共享客户端
+ollama_pool = OllamaPool()
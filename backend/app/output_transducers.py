@@ -0,0 +1,234 @@
+"""流式输出变换链 - 模型输出进入 SSE 编码前的逐片段处理
+
+协调器每轮构建一条变换链，模型流的每个片段依次经过各变换器后再下发：
+- error_normalize：模型服务的错误提示统一为面向用户的固定文案，原始错误只写日志
+- think_filter：去除 Qwen3 的 <think>…</think> 推理块，只下发和保存正式回答
+- crisis_scan：扫描 assistant 输出中的危机关键词并记录（不修改文本）
+
+变换器按片段增量处理、在片段之间保留状态：标签或关键词被拆在两个片段之间
+时，可能构成标签前缀的尾部会暂存到下一个片段再判断。
+变换器及顺序由 OUTPUT_TRANSDUCERS 配置（逗号分隔的名称）。
+"""
+import os
+import time
+import logging
+from typing import AsyncGenerator, AsyncIterator, Dict, List, Optional, Tuple
+from .keyword_engine import keyword_engine
+
+logger = logging.getLogger(__name__)
+
+# 模型服务输出的错误提示前缀（本地 / 调度器为 "[错误]"，云端为 "错误："）
+ERROR_PREFIXES = ("[错误]", "错误：")
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+class StreamTransducer:
+    """变换器基类：feed 处理一个片段并返回可下发的文本，flush 在流结束时输出暂存内容"""
+
+    name = "base"
+
+    def feed(self, text: str) -> str:
+        return text
+
+    def flush(self) -> str:
+        return ""
+
+    def events(self) -> Dict[str, int]:
+        """本轮的事件计数，用于指标"""
+        return {}
+
+
+class ErrorNormalizer(StreamTransducer):
+    """
+    错误提示归一化
+    模型服务把调用失败整体作为一个片段输出，因此按片段开头匹配，不会误伤正文中的 "错误"
+    """
+
+    name = "error_normalize"
+    BUSY_MESSAGE = "[错误] 模型服务繁忙，请稍后重试。"
+    UNAVAILABLE_MESSAGE = "[错误] 模型服务暂时不可用，请稍后再试。"
+
+    def __init__(self):
+        self.error: Optional[str] = None
+
+    def feed(self, text: str) -> str:
+        if not text.startswith(ERROR_PREFIXES):
+            return text
+        self.error = text
+        logger.warning(f"模型服务返回错误: {text}")
+        return self.BUSY_MESSAGE if "繁忙" in text else self.UNAVAILABLE_MESSAGE
+
+    def events(self) -> Dict[str, int]:
+        return {"normalized": 1} if self.error else {}
+
+
+class ThinkBlockFilter(StreamTransducer):
+    """去除 <think>…</think> 推理块及其后的空行"""
+
+    name = "think_filter"
+
+    def __init__(self):
+        self.inside = False
+        self.pending = ""
+        self.strip_leading = False
+        self.blocks = 0
+        self.suppressed_chars = 0
+
+    def feed(self, text: str) -> str:
+        buffer = self.pending + text
+        self.pending = ""
+        output = []
+        while buffer:
+            tag = THINK_CLOSE if self.inside else THINK_OPEN
+            index = buffer.find(tag)
+            if index >= 0:
+                if self.inside:
+                    self.suppressed_chars += index
+                    self.strip_leading = True
+                else:
+                    output.append(buffer[:index])
+                    self.blocks += 1
+                self.inside = not self.inside
+                buffer = buffer[index + len(tag):]
+                continue
+            # 末尾可能是被拆开的标签前缀，留到下一个片段
+            keep = _partial_suffix(buffer, tag)
+            visible, self.pending = buffer[:len(buffer) - keep], buffer[len(buffer) - keep:]
+            if self.inside:
+                self.suppressed_chars += len(visible)
+            else:
+                output.append(visible)
+            break
+        return self._strip("".join(output))
+
+    def flush(self) -> str:
+        # 未闭合的推理块直接丢弃；暂存的标签前缀不是推理块时原样输出
+        tail, self.pending = self.pending, ""
+        if self.inside:
+            self.suppressed_chars += len(tail)
+            return ""
+        return self._strip(tail)
+
+    def _strip(self, text: str) -> str:
+        if self.strip_leading and text:
+            text = text.lstrip()
+            if text:
+                self.strip_leading = False
+        return text
+
+    def events(self) -> Dict[str, int]:
+        if not self.blocks:
+            return {}
+        return {"blocks": self.blocks, "suppressed_chars": self.suppressed_chars}
+
+
+class CrisisOutputScanner(StreamTransducer):
+    """assistant 输出的危机关键词扫描（跨片段续接自动机状态），命中只记录不修改输出"""
+
+    name = "crisis_scan"
+
+    def __init__(self):
+        self.scanner = keyword_engine.stream_scanner(["crisis"])
+        self.hits: List[str] = []
+
+    def feed(self, text: str) -> str:
+        for keyword, _ in self.scanner.feed(text):
+            self.hits.append(keyword)
+        return text
+
+    def events(self) -> Dict[str, int]:
+        return {"flagged": 1} if self.hits else {}
+
+
+def _partial_suffix(text: str, tag: str) -> int:
+    """text 末尾与 tag 前缀重合的最长长度（不含完整 tag）"""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+TRANSDUCERS = {
+    ErrorNormalizer.name: ErrorNormalizer,
+    ThinkBlockFilter.name: ThinkBlockFilter,
+    CrisisOutputScanner.name: CrisisOutputScanner,
+}
+
+
+class TransducerChain:
+    """单轮输出的变换链"""
+
+    def __init__(self, transducers: List[StreamTransducer]):
+        self.transducers = transducers
+        # 模型原始输出的片段数与首个片段时间（变换前）
+        self.chunks = 0
+        self.first_chunk_at: Optional[float] = None
+
+    def get(self, name: str) -> Optional[StreamTransducer]:
+        return next((t for t in self.transducers if t.name == name), None)
+
+    def feed(self, text: str) -> str:
+        for transducer in self.transducers:
+            if not text:
+                break
+            text = transducer.feed(text)
+        return text
+
+    def flush(self) -> str:
+        """依次清空各变换器的暂存内容，前一级的剩余输出继续经过后续变换器"""
+        text = ""
+        for transducer in self.transducers:
+            if text:
+                text = transducer.feed(text)
+            text += transducer.flush()
+        return text
+
+    async def apply(self, stream: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """包装模型流：逐片段变换后输出，被关闭时一并关闭上游"""
+        try:
+            async for chunk in stream:
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.perf_counter()
+                self.chunks += 1
+                text = self.feed(chunk)
+                if text:
+                    yield text
+            tail = self.flush()
+            if tail:
+                yield tail
+        finally:
+            await stream.aclose()
+
+    def events(self) -> List[Tuple[str, str, int]]:
+        return [
+            (transducer.name, event, count)
+            for transducer in self.transducers
+            for event, count in transducer.events().items()
+        ]
+
+
+class OutputPipeline:
+    """按配置构建每轮的变换链"""
+
+    def __init__(self, names: str = None):
+        names = names if names is not None else os.getenv(
+            "OUTPUT_TRANSDUCERS", "error_normalize,think_filter,crisis_scan"
+        )
+        self.names = [name.strip() for name in names.split(",") if name.strip()]
+        unknown = [name for name in self.names if name not in TRANSDUCERS]
+        if unknown:
+            raise ValueError(f"未知的输出变换器: {', '.join(unknown)}（可选: {', '.join(TRANSDUCERS)}）")
+
+    def build(self) -> TransducerChain:
+        return TransducerChain([TRANSDUCERS[name]() for name in self.names])
+
+    def render(self, text: str) -> str:
+        """对完整的模型输出应用一条新的变换链，结果与逐片段下发、保存的文本一致"""
+        chain = self.build()
+        return chain.feed(text) + chain.flush()
+
+
+# 全局输出变换配置
+output_pipeline = OutputPipeline()
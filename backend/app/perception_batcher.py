@@ -0,0 +1,131 @@
+"""感知微批处理 - 合并同一时间窗口内多个请求的感知调用
+
+并发到达的感知请求在短窗口（毫秒级）内攒成一批，作为一次结构化提示词
+发给本地模型，按编号把结果分发回各个等待的协程。CPU 推理时一次长提示词的
+预填充远比多次独立调用便宜，感知吞吐随批大小而非请求数增长。
+窗口内只有一个请求时走原有的单条合并感知调用（保留提示词缓存）。
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+from .context_builder import context_builder
+from .inference_scheduler import inference_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class PerceptionBatcher:
+    """按时间窗口 / 批大小攒批的感知调用"""
+
+    def __init__(self, module, window_ms: float = None, max_batch: int = None):
+        """
+        :param module: PerceptionPlanningModule，提供模型客户端、单条感知与规则降级
+        """
+        self.module = module
+        self.window = (window_ms if window_ms is not None else float(os.getenv("PERCEPTION_BATCH_WINDOW_MS", "0"))) / 1000
+        self.max_batch = max_batch or int(os.getenv("PERCEPTION_BATCH_MAX", "8"))
+        self.pending: List[Tuple[str, list, asyncio.Future]] = []
+        self.flush_handle = None
+        self.running = set()
+        self.batches = 0
+        self.requests = 0
+        self.batch_failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+
+    async def perceive(self, user_input: str, conversation_history: list) -> tuple[bool, str, bool, str]:
+        """提交一条感知请求，等待所在批次完成"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((user_input, conversation_history, future))
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _run(self, batch: List[Tuple[str, list, asyncio.Future]]) -> None:
+        # 已被取消的请求（如客户端断开）不再占用批次
+        live = [item for item in batch if not item[2].done()]
+        if not live:
+            return
+        self.batches += 1
+        self.requests += len(live)
+        try:
+            if len(live) == 1:
+                user_input, history, _ = live[0]
+                results = [await self.module.perceive(user_input, history)]
+            else:
+                results = await self._perceive_batch(live)
+        except Exception as e:
+            for _, _, future in live:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(live, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _perceive_batch(self, items: List[Tuple[str, list, asyncio.Future]]) -> List[tuple]:
+        """一次调用判断整批消息，缺失或解析失败的条目降级为规则检测"""
+        from .perception_planning import BATCH_PERCEPTION_PROMPT, batch_perception_schema
+        
+        module = self.module
+        sections = []
+        for index, (user_input, history, _) in enumerate(items, 1):
+            history_text = context_builder.render_recent(history)
+            sections.append(f"【消息{index}】\n对话历史：\n{history_text}\n\n当前用户输入：{user_input}")
+
+        parsed: Dict[int, dict] = {}
+        try:
+            async with inference_scheduler.slot("perception"):
+                response = await module.ollama_client.chat(
+                    "perception",
+                    model=module.model_name,
+                    messages=[
+                        {"role": "system", "content": BATCH_PERCEPTION_PROMPT},
+                        {"role": "user", "content": "\n\n".join(sections)}
+                    ],
+                    format=batch_perception_schema(len(items)),
+                    options={"temperature": 0.1, "num_predict": module.num_predict * len(items)},
+                    keep_alive=module.keep_alive
+                )
+            for position, entry in enumerate(json.loads(response['message']['content'])["results"], 1):
+                parsed.setdefault(int(entry.get("id", position)), entry)
+        except Exception as e:
+            self.batch_failures += 1
+            logger.warning(f"批量感知调用失败（{len(items)} 条），降级到规则检测: {e}")
+
+        results = []
+        for index, (user_input, history, _) in enumerate(items, 1):
+            try:
+                results.append(module.parse_combined(parsed[index]))
+            except (KeyError, TypeError, ValueError):
+                results.append(module.fallback_combined(user_input, history))
+        return results
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "requests": self.requests,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "batch_failures": self.batch_failures
+        }
@@ -0,0 +1,119 @@
+"""感知结果缓存 - TTL + LRU 缓存与相同请求合并（singleflight）
+
+用户经常重发同一条消息（SSE 断线重试、前端重复点击），每次都会重新执行
+隐私与复杂度判断。缓存键为归一化输入的哈希加最近几条历史的短指纹；
+同一键的并发请求共享一次进行中的模型调用。
+
+缓存只保存判断结果（布尔值与理由），不保存消息原文；
+危机检测不经过缓存，每轮都重新执行；模型调用失败后的规则降级结果不缓存，
+下一次相同请求重新调用模型。
+"""
+import os
+import time
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# 缓存值：(判定层, (是否隐私, 隐私理由, 是否复杂, 复杂度理由))
+PerceptionDecision = Tuple[str, Tuple[bool, str, bool, str]]
+
+
+class PerceptionCache:
+    """按输入与历史指纹索引的感知结果缓存"""
+
+    def __init__(self, capacity: int = None, ttl_seconds: float = None, history_messages: int = None):
+        self.capacity = capacity or int(os.getenv("PERCEPTION_CACHE_SIZE", "2048"))
+        self.ttl = ttl_seconds if ttl_seconds is not None else float(os.getenv("PERCEPTION_CACHE_TTL", "300"))
+        self.history_messages = history_messages or int(os.getenv("PERCEPTION_CACHE_HISTORY", "4"))
+        self.entries: "OrderedDict[str, Tuple[float, PerceptionDecision]]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.expired = 0
+        self.uncacheable = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def key(self, user_input: str, conversation_history: list) -> str:
+        """归一化输入哈希 + 最近历史指纹"""
+        text = " ".join(unicodedata.normalize("NFKC", user_input).lower().split())
+        history = hashlib.sha1()
+        for msg in conversation_history[-self.history_messages:]:
+            history.update(f"{msg['role']}\x1f{msg['content']}\x1e".encode("utf-8"))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest() + ":" + history.hexdigest()[:12]
+
+    def get(self, key: str) -> Optional[PerceptionDecision]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, decision = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.expired += 1
+            return None
+        self.entries.move_to_end(key)
+        return decision
+
+    def put(self, key: str, decision: PerceptionDecision) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl, decision)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    async def get_or_run(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Tuple[str, tuple, bool]]]
+    ) -> Tuple[PerceptionDecision, str]:
+        """
+        读取缓存，未命中时执行 factory；同一键的并发调用共享同一次执行
+        :param factory: 返回 (判定层, 判断结果, 是否可缓存)，不可缓存的结果只与并发等待者共享
+        :return: (判断结果, 来源 hit / shared / miss)
+        """
+        decision = self.get(key)
+        if decision is not None:
+            self.hits += 1
+            return decision, "hit"
+
+        task = self.inflight.get(key)
+        if task is not None:
+            self.shared += 1
+            # shield：某个等待者被取消（客户端断开）不影响其他等待者
+            return (await asyncio.shield(task))[:2], "shared"
+
+        self.misses += 1
+        task = asyncio.create_task(factory())
+        self.inflight[key] = task
+
+        def done(finished: asyncio.Task) -> None:
+            self.inflight.pop(key, None)
+            if not finished.cancelled() and finished.exception() is None:
+                tier, decision, cacheable = finished.result()
+                if cacheable:
+                    self.put(key, (tier, decision))
+                else:
+                    self.uncacheable += 1
+
+        task.add_done_callback(done)
+        return (await asyncio.shield(task))[:2], "miss"
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.shared + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "shared": self.shared,
+            "misses": self.misses,
+            "expired": self.expired,
+            "uncacheable": self.uncacheable,
+            "inflight": len(self.inflight),
+            "hit_rate": round((self.hits + self.shared) / lookups, 4) if lookups else 0.0
+        }
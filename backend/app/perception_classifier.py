@@ -0,0 +1,176 @@
+"""轻量感知分类器 - 字符 n-gram 哈希 + 逻辑回归（NumPy 实现）
+
+作为感知规划级联的第二层：在规则无法判定时给出隐私/复杂度概率，
+只有概率落在不确定区间内才交给本地大模型判断。
+
+离线训练（在 backend 目录下）：
+    python -m app.perception_classifier
+训练数据来自数据库中已记录的感知结果（assistant 消息上的 is_privacy_issue /
+is_complex_issue 标签与其对应的用户输入），不会额外落盘任何对话内容。
+"""
+import math
+import zlib
+import logging
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时分类器层自动跳过
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class HashingNgramClassifier:
+    """字符 n-gram 特征哈希 + 双头逻辑回归（隐私 / 复杂度）"""
+
+    heads = ("privacy", "complexity")
+
+    def __init__(self, n_features: int = 2 ** 18, ngram_range: Tuple[int, int] = (1, 3)):
+        if np is None:
+            raise RuntimeError("轻量感知分类器需要安装 numpy")
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.weights = np.zeros((len(self.heads), n_features), dtype=np.float32)
+        self.bias = np.zeros(len(self.heads), dtype=np.float32)
+
+    def featurize(self, text: str):
+        """将文本映射为 (特征下标, 特征值)，同一 n-gram 出现多次时累加"""
+        text = "".join(text.lower().split())
+        min_n, max_n = self.ngram_range
+        grams = [
+            text[i:i + n]
+            for n in range(min_n, max_n + 1)
+            for i in range(len(text) - n + 1)
+        ]
+        # 长度分桶特征，帮助区分长篇倾诉与简短回复
+        grams.append(f"__len_{min(len(text) // 20, 10)}")
+
+        # crc32 保证跨进程哈希稳定（内置 hash 受 PYTHONHASHSEED 影响）
+        hashed = np.fromiter(
+            (zlib.crc32(g.encode("utf-8")) % self.n_features for g in grams),
+            dtype=np.int64,
+            count=len(grams)
+        )
+        indices, counts = np.unique(hashed, return_counts=True)
+        values = counts.astype(np.float32) / math.sqrt(len(grams))
+        return indices, values
+
+    def predict_proba(self, text: str) -> Tuple[float, float]:
+        """返回 (隐私概率, 复杂度概率)"""
+        indices, values = self.featurize(text)
+        logits = self.weights[:, indices] @ values + self.bias
+        probs = 1.0 / (1.0 + np.exp(-logits))
+        return float(probs[0]), float(probs[1])
+
+    def fit(
+        self,
+        texts: List[str],
+        labels: List[Tuple[bool, bool]],
+        epochs: int = 10,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5
+    ) -> None:
+        """随机梯度下降训练两个逻辑回归头"""
+        features = [self.featurize(t) for t in texts]
+        targets = np.asarray(labels, dtype=np.float32)
+        order = np.arange(len(texts))
+        rng = np.random.default_rng(0)
+
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            loss = 0.0
+            for i in order:
+                indices, values = features[i]
+                logits = self.weights[:, indices] @ values + self.bias
+                probs = 1.0 / (1.0 + np.exp(-logits))
+                grad = probs - targets[i]
+                self.weights[:, indices] -= learning_rate * (
+                    np.outer(grad, values) + l2 * self.weights[:, indices]
+                )
+                self.bias -= learning_rate * grad
+                loss -= float(np.sum(
+                    targets[i] * np.log(probs + 1e-7) + (1 - targets[i]) * np.log(1 - probs + 1e-7)
+                ))
+            logger.info(f"epoch {epoch + 1}/{epochs} loss={loss / max(len(texts), 1):.4f}")
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            n_features=self.n_features,
+            ngram_range=np.asarray(self.ngram_range)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "HashingNgramClassifier":
+        data = np.load(path)
+        clf = cls(int(data["n_features"]), tuple(int(n) for n in data["ngram_range"]))
+        clf.weights = data["weights"]
+        clf.bias = data["bias"]
+        return clf
+
+
+def load_classifier(path: str) -> Optional[HashingNgramClassifier]:
+    """加载已训练的分类器，文件或 numpy 缺失时返回 None"""
+    if not path or np is None:
+        return None
+    try:
+        return HashingNgramClassifier.load(path)
+    except FileNotFoundError:
+        logger.info(f"未找到感知分类器模型文件 {path}，跳过分类器层")
+    except Exception as e:
+        logger.warning(f"感知分类器加载失败，跳过分类器层: {e}")
+    return None
+
+
+def load_training_data(db) -> Tuple[List[str], List[Tuple[bool, bool]]]:
+    """从数据库读取 (用户输入, (是否隐私, 是否复杂)) 训练样本"""
+    from .models import Message
+
+    rows = db.query(
+        Message.conversation_id, Message.role, Message.content,
+        Message.agent_type, Message.is_privacy_issue, Message.is_complex_issue
+    ).order_by(Message.conversation_id, Message.created_at, Message.id).all()
+
+    texts, labels = [], []
+    previous = None
+    for row in rows:
+        if (
+            row.role == "assistant"
+            and row.agent_type == "ConversationAgent"
+            and previous is not None
+            and previous.role == "user"
+            and previous.conversation_id == row.conversation_id
+        ):
+            texts.append(previous.content)
+            labels.append((bool(row.is_privacy_issue), bool(row.is_complex_issue)))
+        previous = row
+    return texts, labels
+
+
+if __name__ == "__main__":
+    import os
+    import argparse
+    from .database import SessionLocal, DATABASE_DIR
+
+    parser = argparse.ArgumentParser(description="训练轻量感知分类器")
+    parser.add_argument("--out", default=os.path.join(DATABASE_DIR, "perception_classifier.npz"))
+    parser.add_argument("--epochs", type=int, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        texts, labels = load_training_data(db)
+    finally:
+        db.close()
+
+    if not texts:
+        raise SystemExit("数据库中没有可用的感知记录")
+
+    classifier = HashingNgramClassifier()
+    classifier.fit(texts, labels, epochs=args.epochs)
+    classifier.save(args.out)
+    print(f"已使用 {len(texts)} 条样本训练分类器，保存至 {args.out}")
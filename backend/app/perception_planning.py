@@ -1,24 +1,138 @@
 """感知规划模块 - 基于本地模型的智能判断"""
-import re
+import os
+import json
+import time
+import asyncio
 import logging
-import ollama
-from typing import Dict, List
+import contextlib
+import unicodedata
+from typing import Dict, List, Optional
+from .database import DATABASE_DIR
+from .perception_classifier import load_classifier
+from .context_builder import context_builder
+from .inference_scheduler import inference_scheduler
+from .model_warmup import configured_model
+from .ollama_pool import ollama_pool
+from .perception_batcher import PerceptionBatcher
+from .perception_cache import PerceptionCache
+from .keyword_engine import (
+    keyword_engine, ScanResult, CRISIS_KEYWORDS, PHONE_PATTERN, ID_CARD_PATTERN
+)
 
 logger = logging.getLogger(__name__)
 
+# 隐私与复杂度的判断标准（单条与批量感知共用）
+PERCEPTION_CRITERIA = """一、隐私判断：用户输入是否涉及隐私信息，包括但不限于：
+1. 个人身份信息：身份证号、手机号、家庭住址、真实姓名、学号等
+2. 情感隐私：恋爱关系、分手、出轨、性相关话题等
+3. 家庭隐私：家暴、家庭矛盾、父母离婚等
+4. 创伤事件：性侵、欺凌、霸凌、自残等
+5. 明确的隐私表达：用户明确说"保密"、"不要记录"、"别告诉别人"等
+
+二、复杂度判断：问题是否复杂，需要调用更强大的云端模型来回答。复杂问题的特征：
+1. 需要详细的计划、步骤、方案
+2. 询问"怎么办"、"如何做"、"具体方法"等需要系统性建议的问题
+3. 涉及长期规划、目标制定、策略分析
+4. 问题描述很长（超过100字）且信息量大
+5. 对话已经持续多轮但问题还未收敛"""
+
+# 合并感知调用的固定前缀（作为 system 消息，保持不变以命中 Ollama 提示词缓存）
+COMBINED_PERCEPTION_PROMPT = f"""你是心理陪伴系统的感知规划模块，需要同时完成两项判断。
+
+{PERCEPTION_CRITERIA}
+
+只输出 JSON，理由各不超过20字：
+{{"is_privacy": true/false, "privacy_reason": "...", "is_complex": true/false, "complexity_reason": "..."}}"""
+
+# 合并感知调用的输出结构（Ollama JSON Schema 结构化输出）
+COMBINED_PERCEPTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_privacy": {"type": "boolean"},
+        "privacy_reason": {"type": "string"},
+        "is_complex": {"type": "boolean"},
+        "complexity_reason": {"type": "string"}
+    },
+    "required": ["is_privacy", "privacy_reason", "is_complex", "complexity_reason"]
+}
+
+# 批量感知的固定前缀（见 perception_batcher）
+BATCH_PERCEPTION_PROMPT = f"""你是心理陪伴系统的感知规划模块。下面有多条来自不同用户、相互独立的消息，
+请对每一条分别完成两项判断，不要让一条消息影响另一条的结论。
+
+{PERCEPTION_CRITERIA}
+
+按消息编号依次输出 JSON，id 为消息编号，理由各不超过20字：
+{{"results": [{{"id": 1, "is_privacy": true/false, "privacy_reason": "...", "is_complex": true/false, "complexity_reason": "..."}}, ...]}}"""
+
+
+def batch_perception_schema(size: int) -> dict:
+    """批量感知的输出结构：与消息一一对应的结果数组"""
+    return {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "minItems": size,
+                "maxItems": size,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        "is_privacy": {"type": "boolean"},
+                        "privacy_reason": {"type": "string"},
+                        "is_complex": {"type": "boolean"},
+                        "complexity_reason": {"type": "string"}
+                    },
+                    "required": ["id", "is_privacy", "privacy_reason", "is_complex", "complexity_reason"]
+                }
+            }
+        },
+        "required": ["results"]
+    }
+
+
+class DegradedDecision(tuple):
+    """模型调用失败后按规则降级得到的判断结果（不写入感知缓存）"""
+
+
 class PerceptionPlanningModule:
     """感知规划模块：使用本地 Ollama 模型执行双层判断（隐私检测 + 复杂度分析）"""
     
-    def __init__(self):
-        self.ollama_client = ollama.AsyncClient()
-        self.model_name = "ethanwhh/qwen3-4b-xinyi"
+    def __init__(self, concurrent: bool = None, combined: bool = None):
+        self.ollama_client = ollama_pool
+        # 与对话生成共用同一个规范模型名（启动预热时按已安装模型解析）
+        self.model_name = configured_model("perception")
+        
+        # 合并感知：一次结构化输出调用同时完成隐私与复杂度判断
+        if combined is None:
+            combined = os.getenv("PERCEPTION_COMBINED", "true").lower() == "true"
+        self.combined = combined
+        self.num_predict = int(os.getenv("PERCEPTION_NUM_PREDICT", "96"))
+        self.keep_alive = os.getenv("PERCEPTION_KEEP_ALIVE", "30m")
+        # 微批处理：并发到达的合并感知请求在短窗口内攒批为一次调用（窗口为 0 时关闭）
+        self.batcher = PerceptionBatcher(self)
         
-        # 危机关键词（保留关键词检测，因为危机情况需要快速响应）
-        self.crisis_keywords = [
-            "自杀", "想死", "活不下去", "结束生命", "不想活了",
-            "自残", "割腕", "跳楼", "吃药", "了结",
-            "暴力", "伤害", "报复", "杀", "打死"
-        ]
+        # 级联感知：规则 → 轻量分类器 → 本地大模型（仅在分类器不确定时调用）
+        self.cascade = os.getenv("PERCEPTION_CASCADE", "true").lower() == "true"
+        self.trivial_length = int(os.getenv("PERCEPTION_TRIVIAL_LENGTH", "8"))
+        self.uncertain_low = float(os.getenv("PERCEPTION_UNCERTAIN_LOW", "0.2"))
+        self.uncertain_high = float(os.getenv("PERCEPTION_UNCERTAIN_HIGH", "0.8"))
+        self.classifier = load_classifier(
+            os.getenv("PERCEPTION_CLASSIFIER_PATH", os.path.join(DATABASE_DIR, "perception_classifier.npz"))
+        ) if self.cascade else None
+        self.tier_counts = {"rules": 0, "classifier": 0, "llm": 0, "cache": 0}
+        
+        # 感知结果缓存（TTL 为 0 时关闭）；危机检测在查缓存之前执行，不受缓存影响
+        self.cache = PerceptionCache()
+        
+        # 并发感知：隐私检测与复杂度分析同时发起，隐私命中时取消复杂度分析
+        if concurrent is None:
+            concurrent = os.getenv("PERCEPTION_CONCURRENT", "true").lower() == "true"
+        self.concurrent = concurrent
+        
+        # 危机关键词（保留关键词检测，因为危机情况需要快速响应；匹配由共享关键词引擎完成）
+        self.crisis_keywords = CRISIS_KEYWORDS
     
     async def detect_privacy(self, user_input: str) -> tuple[bool, str]:
         """
@@ -44,11 +158,14 @@ class PerceptionPlanningModule:
 - 否|普通情绪表达"""
 
         try:
-            response = await self.ollama_client.chat(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                options={"temperature": 0.1}  # 低温度保证判断稳定
-            )
+            async with inference_scheduler.slot("perception"):
+                response = await self.ollama_client.chat(
+                    "perception",
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    options={"temperature": 0.1},  # 低温度保证判断稳定
+                    keep_alive=self.keep_alive
+                )
             
             result = response['message']['content'].strip()
             
@@ -64,26 +181,20 @@ class PerceptionPlanningModule:
                 
         except Exception as e:
             logger.warning(f"隐私检测模型调用失败，降级到关键词检测: {e}")
-            return self._fallback_privacy_detection(user_input)
+            return DegradedDecision(self._fallback_privacy_detection(user_input))
     
-    def _fallback_privacy_detection(self, user_input: str) -> tuple[bool, str]:
+    def _fallback_privacy_detection(self, user_input: str, scan: ScanResult = None) -> tuple[bool, str]:
         """降级方案：基于关键词的隐私检测"""
-        privacy_keywords = [
-            "身份证", "家庭住址", "电话号码", "学号", "真名",
-            "恋爱", "分手", "出轨", "暗恋", "前任", "男朋友", "女朋友",
-            "父母离婚", "家暴", "家庭矛盾",
-            "性侵", "欺凌", "霸凌", "保密", "隐私"
-        ]
-        
-        user_input_lower = user_input.lower()
-        for keyword in privacy_keywords:
-            if keyword in user_input_lower:
-                return True, f"包含隐私关键词: {keyword}"
-        
-        # 检查手机号和身份证号
-        if re.search(r'\d{11}', user_input):
+        scan = scan or keyword_engine.scan(user_input)
+        match = scan.first("privacy")
+        if match:
+            return True, f"包含隐私关键词: {match.keyword}"
+        
+        # 检查手机号和身份证号（全角数字先折叠为半角）
+        folded = unicodedata.normalize("NFKC", user_input)
+        if PHONE_PATTERN.search(folded):
             return True, "包含疑似手机号"
-        if re.search(r'\d{17}[\dxX]', user_input):
+        if ID_CARD_PATTERN.search(folded):
             return True, "包含疑似身份证号"
         
         return False, "未检测到隐私信息"
@@ -95,9 +206,8 @@ class PerceptionPlanningModule:
         :param conversation_history: 对话历史
         :return: (是否复杂问题, 判断理由)
         """
-        # 获取最近3轮对话作为上下文
-        recent_history = conversation_history[-6:] if len(conversation_history) > 6 else conversation_history
-        history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_history])
+        # 按感知预算截取最近对话作为上下文
+        history_text = context_builder.render_recent(conversation_history)
         
         prompt = f"""你是一个问题复杂度分析专家。请判断用户的问题是否复杂，需要调用更强大的云端模型来回答。
 
@@ -121,11 +231,14 @@ class PerceptionPlanningModule:
 - 否|简单的情绪倾诉"""
 
         try:
-            response = await self.ollama_client.chat(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                options={"temperature": 0.1}
-            )
+            async with inference_scheduler.slot("perception"):
+                response = await self.ollama_client.chat(
+                    "perception",
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    options={"temperature": 0.1},
+                    keep_alive=self.keep_alive
+                )
             
             result = response['message']['content'].strip()
             
@@ -140,19 +253,19 @@ class PerceptionPlanningModule:
                 
         except Exception as e:
             logger.warning(f"复杂度分析模型调用失败，降级到规则检测: {e}")
-            return self._fallback_complexity_detection(user_input, conversation_history)
+            return DegradedDecision(self._fallback_complexity_detection(user_input, conversation_history))
     
-    def _fallback_complexity_detection(self, user_input: str, conversation_history: list) -> tuple[bool, str]:
+    def _fallback_complexity_detection(
+        self,
+        user_input: str,
+        conversation_history: list,
+        scan: ScanResult = None
+    ) -> tuple[bool, str]:
         """降级方案：基于规则的复杂度检测"""
-        complexity_keywords = [
-            "计划", "步骤", "方案", "分析", "建议", "对策",
-            "怎么办", "如何", "怎样", "怎么做", "具体", "详细"
-        ]
-        
-        user_input_lower = user_input.lower()
-        for keyword in complexity_keywords:
-            if keyword in user_input_lower:
-                return True, f"包含复杂度关键词: {keyword}"
+        scan = scan or keyword_engine.scan(user_input)
+        match = scan.first("complexity")
+        if match:
+            return True, f"包含复杂度关键词: {match.keyword}"
         
         if len(user_input) > 100:
             return True, "问题描述较长"
@@ -162,43 +275,102 @@ class PerceptionPlanningModule:
         
         return False, "问题相对简单"
     
-    def detect_crisis(self, user_input: str) -> bool:
+    async def perceive(self, user_input: str, conversation_history: list) -> tuple[bool, str, bool, str]:
+        """
+        合并判断：一次调用同时完成隐私检测与复杂度分析
+        使用 JSON Schema 约束输出，避免解析自由文本
+        :return: (是否隐私问题, 隐私理由, 是否复杂问题, 复杂度理由)
+        """
+        history_text = context_builder.render_recent(conversation_history)
+        
+        try:
+            async with inference_scheduler.slot("perception"):
+                response = await self.ollama_client.chat(
+                    "perception",
+                    model=self.model_name,
+                    messages=[
+                        {"role": "system", "content": COMBINED_PERCEPTION_PROMPT},
+                        {"role": "user", "content": f"对话历史：\n{history_text}\n\n当前用户输入：{user_input}"}
+                    ],
+                    format=COMBINED_PERCEPTION_SCHEMA,
+                    options={"temperature": 0.1, "num_predict": self.num_predict},
+                    keep_alive=self.keep_alive
+                )
+            
+            return self.parse_combined(json.loads(response['message']['content']))
+        
+        except Exception as e:
+            logger.warning(f"合并感知调用失败，降级到规则检测: {e}")
+            return self.fallback_combined(user_input, conversation_history)
+    
+    @staticmethod
+    def parse_combined(result: dict) -> tuple[bool, str, bool, str]:
+        """解析合并感知的 JSON 输出"""
+        is_privacy = bool(result["is_privacy"])
+        privacy_reason = str(result.get("privacy_reason", ""))[:20]
+        if is_privacy:
+            return True, privacy_reason, False, "隐私问题无需复杂度分析"
+        return False, privacy_reason, bool(result["is_complex"]), str(result.get("complexity_reason", ""))[:20]
+    
+    def fallback_combined(self, user_input: str, conversation_history: list) -> tuple[bool, str, bool, str]:
+        """合并感知失败时的规则降级"""
+        is_privacy, privacy_reason = self._fallback_privacy_detection(user_input)
+        if is_privacy:
+            return DegradedDecision((True, privacy_reason, False, "隐私问题无需复杂度分析"))
+        is_complex, complexity_reason = self._fallback_complexity_detection(user_input, conversation_history)
+        return DegradedDecision((False, privacy_reason, is_complex, complexity_reason))
+    
+    def detect_crisis(self, user_input: str, scan: ScanResult = None) -> bool:
         """
         检测危机信号（保持关键词检测以确保快速响应）
+        :param scan: 已有的关键词扫描结果，未提供时现场扫描
         :return: True 表示检测到危机关键词
         """
-        user_input_lower = user_input.lower()
-        for keyword in self.crisis_keywords:
-            if keyword in user_input_lower:
-                return True
-        return False
+        scan = scan or keyword_engine.scan(user_input)
+        return scan.has("crisis")
     
-    async def execute(self, user_input: str, conversation_history: list) -> Dict[str, any]:
+    async def execute(
+        self, user_input: str, conversation_history: list, scan: ScanResult = None
+    ) -> Dict[str, any]:
         """
         执行双层判断
-        :return: 判断结果字典
+        :param scan: 协调器本轮已有的关键词扫描结果，未提供时现场扫描
+        :return: 判断结果字典（timings 记录各阶段耗时，单位毫秒）
         """
+        # 关键词只扫描一遍，危机/隐私/复杂度规则共用扫描结果
+        scan_started = time.perf_counter()
+        scan = scan or keyword_engine.scan(user_input)
+        
         # 危机检测（同步，快速响应）
-        is_crisis = self.detect_crisis(user_input)
+        is_crisis = self.detect_crisis(user_input, scan)
+        timings = {"crisis_scan_ms": round((time.perf_counter() - scan_started) * 1000, 3)}
         if is_crisis:
+            self.tier_counts["rules"] += 1
             return {
                 "is_privacy_issue": True,  # 危机情况强制本地
                 "is_complex_issue": False,
                 "is_crisis": True,
                 "privacy_reason": "危机情况",
                 "complexity_reason": "",
-                "recommended_model": "local"
+                "recommended_model": "local",
+                "perception_tier": "rules",
+                "timings": timings
             }
         
-        # 隐私检测（使用模型）
-        is_privacy, privacy_reason = await self.detect_privacy(user_input)
-        
-        # 复杂度分析（如果不是隐私问题才分析）
-        if is_privacy:
-            is_complex = False
-            complexity_reason = "隐私问题无需复杂度分析"
+        if self.cache.enabled:
+            # 重发的相同消息直接复用判断结果，并发的相同请求共享一次模型调用
+            (tier, decision), source = await self.cache.get_or_run(
+                self.cache.key(user_input, conversation_history),
+                lambda: self._decide(user_input, conversation_history, scan, timings)
+            )
+            if source != "miss":
+                tier = "cache"
         else:
-            is_complex, complexity_reason = await self.analyze_complexity(user_input, conversation_history)
+            tier, decision, _ = await self._decide(user_input, conversation_history, scan, timings)
+        is_privacy, privacy_reason, is_complex, complexity_reason = decision
+        self.tier_counts[tier] += 1
+        
+        logger.info(f"感知规划由 {tier} 层判定，耗时: {timings}")
         
         return {
             "is_privacy_issue": is_privacy,
@@ -206,9 +378,132 @@ class PerceptionPlanningModule:
             "is_crisis": is_crisis,
             "privacy_reason": privacy_reason,
             "complexity_reason": complexity_reason,
-            "recommended_model": self._recommend_model(is_privacy, is_complex, is_crisis)
+            "recommended_model": self._recommend_model(is_privacy, is_complex, is_crisis),
+            "perception_tier": tier,
+            "timings": timings
+        }
+    
+    async def _decide(self, user_input: str, conversation_history: list, scan: ScanResult, timings: dict) -> tuple:
+        """
+        隐私与复杂度判断：级联（规则、分类器）无法确定时调用本地模型
+        :return: (判定层, (是否隐私, 隐私理由, 是否复杂, 复杂度理由), 是否可缓存)；
+                 模型调用失败后的规则降级结果不可缓存，避免一次临时故障在整个有效期内固定降级判断
+        """
+        if self.cascade:
+            # 不含复杂度关键词的简短消息视为简单问题，但隐私判断仍需分类器或大模型给出
+            trivial = len(user_input.strip()) <= self.trivial_length and not self._fallback_complexity_detection(
+                user_input, conversation_history, scan
+            )[0]
+            decided = self._cascade(user_input, conversation_history, scan, trivial)
+            if decided:
+                return (*decided, True)
+        else:
+            trivial = False
+        if self.combined:
+            perceive = self.batcher.perceive if self.batcher.enabled else self.perceive
+            decision, timings["perception_ms"] = await self._timed(perceive(user_input, conversation_history))
+        elif self.concurrent:
+            decision = await self._execute_concurrent(user_input, conversation_history, timings)
+        else:
+            decision = await self._execute_sequential(user_input, conversation_history, timings)
+        cacheable = not isinstance(decision, DegradedDecision)
+        if trivial and not decision[0]:
+            # 简短消息只采纳模型的隐私判断，复杂度仍按规则判为简单
+            decision = (decision[0], decision[1], False, "简短消息")
+        return "llm", decision, cacheable
+    
+    def _cascade(
+        self, user_input: str, conversation_history: list, scan: ScanResult, trivial: bool
+    ) -> Optional[tuple]:
+        """
+        级联判断的前两层
+        规则层只做肯定的隐私判定：关键词漏掉的敏感表述（尤其是简短消息）不能由规则判为非隐私，
+        否则可能被降级或延迟路由发往云端
+        :param trivial: 是否为不含复杂度关键词的简短消息（复杂度直接判为简单）
+        :return: (判定层, (是否隐私, 隐私理由, 是否复杂, 复杂度理由))；两层都无法确定时返回 None
+        """
+        # 第一层：规则。命中隐私关键词直接判定为隐私
+        is_privacy, privacy_reason = self._fallback_privacy_detection(user_input, scan)
+        if is_privacy:
+            return "rules", (True, privacy_reason, False, "隐私问题无需复杂度分析")
+        
+        # 第二层：轻量分类器。隐私概率在不确定区间之外才采纳；复杂度概率同样需确定（简短消息除外）
+        if self.classifier is None:
+            return None
+        p_privacy, p_complex = self.classifier.predict_proba(user_input)
+        if p_privacy >= self.uncertain_high:
+            return "classifier", (True, f"分类器判定({p_privacy:.2f})", False, "隐私问题无需复杂度分析")
+        if p_privacy <= self.uncertain_low and trivial:
+            return "classifier", (False, f"分类器判定({p_privacy:.2f})", False, "简短消息")
+        if p_privacy <= self.uncertain_low and not self.uncertain_low < p_complex < self.uncertain_high:
+            is_complex = p_complex >= self.uncertain_high
+            return "classifier", (False, f"分类器判定({p_privacy:.2f})", is_complex, f"分类器判定({p_complex:.2f})")
+        return None
+    
+    def get_tier_stats(self) -> Dict[str, Dict[str, float]]:
+        """各判定层命中次数与命中率"""
+        total = sum(self.tier_counts.values())
+        return {
+            tier: {"count": count, "rate": round(count / total, 4) if total else 0.0}
+            for tier, count in self.tier_counts.items()
         }
     
+    async def _timed(self, coro) -> tuple:
+        """执行协程并返回 (结果, 耗时毫秒)"""
+        start = time.perf_counter()
+        result = await coro
+        return result, round((time.perf_counter() - start) * 1000, 1)
+    
+    async def _execute_sequential(self, user_input: str, conversation_history: list, timings: dict) -> tuple:
+        """串行执行：先隐私检测，非隐私问题再做复杂度分析"""
+        privacy, timings["privacy_ms"] = await self._timed(self.detect_privacy(user_input))
+        
+        # 复杂度分析（如果不是隐私问题才分析）
+        if privacy[0]:
+            return self._merge(privacy)
+        
+        complexity, timings["complexity_ms"] = await self._timed(
+            self.analyze_complexity(user_input, conversation_history)
+        )
+        return self._merge(privacy, complexity)
+    
+    async def _execute_concurrent(self, user_input: str, conversation_history: list, timings: dict) -> tuple:
+        """
+        并发执行：两个分类同时发起
+        隐私检测判定为"是"时，取消仍在进行的复杂度分析
+        """
+        privacy_task = asyncio.create_task(self._timed(self.detect_privacy(user_input)))
+        complexity_task = asyncio.create_task(
+            self._timed(self.analyze_complexity(user_input, conversation_history))
+        )
+        
+        try:
+            privacy, timings["privacy_ms"] = await privacy_task
+        except BaseException:
+            # 上游取消或异常时，不留下悬空的复杂度请求
+            complexity_task.cancel()
+            raise
+        
+        if privacy[0]:
+            complexity_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await complexity_task
+            return self._merge(privacy)
+        
+        complexity, timings["complexity_ms"] = await complexity_task
+        return self._merge(privacy, complexity)
+    
+    @staticmethod
+    def _merge(privacy: tuple, complexity: tuple = None) -> tuple:
+        """合并两次判断的结果；任一判断为降级结果时整体标记为降级"""
+        if complexity is None:
+            decision = (privacy[0], privacy[1], False, "隐私问题无需复杂度分析")
+        else:
+            decision = (*privacy, *complexity)
+        if isinstance(privacy, DegradedDecision) or isinstance(complexity, DegradedDecision):
+            return DegradedDecision(decision)
+        return decision
+    
     def _recommend_model(self, is_privacy: bool, is_complex: bool, is_crisis: bool) -> str:
         """推荐模型"""
         if is_crisis:
@@ -1,5 +1,6 @@
 """会话阶段管理器"""
 from typing import List, Dict
+from .keyword_engine import keyword_engine, ScanResult
 
 class PhaseManager:
     """会话阶段管理器"""
@@ -26,17 +27,18 @@ class PhaseManager:
         self, 
         current_phase: str, 
         round_count: int,
-        user_input: str
+        user_input: str,
+        scan: ScanResult = None
     ) -> tuple[bool, str]:
         """
         判断是否应该转换阶段
+        :param scan: 已有的关键词扫描结果，未提供时现场扫描
         :return: (是否转换, 新阶段)
         """
-        user_input_lower = user_input.lower()
+        scan = scan or keyword_engine.scan(user_input)
         
         # 如果用户主动询问解决方案，直接进入solution阶段
-        solution_triggers = ["怎么办", "怎么做", "如何", "方法", "建议"]
-        if any(trigger in user_input_lower for trigger in solution_triggers):
+        if scan.has("solution_trigger"):
             if current_phase != "solution":
                 return True, "solution"
         
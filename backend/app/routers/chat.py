@@ -1,46 +1,151 @@
 """对话相关路由"""
-import json
 import random
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 from ..database import get_db
 from ..models import User, Conversation, Message
 from ..schemas import ChatSendRequest, Response
 from ..auth import get_current_user
 from ..coordinator import coordinator
+from ..conversation_cache import conversation_cache
+from ..write_behind import write_behind
+from ..session_affinity import session_affinity
+from ..inference_scheduler import inference_scheduler, current_user_id
+from ..sse import SSEEncoder, SSE_HEADERS
 
 router = APIRouter(prefix="/api/chat", tags=["智能对话"])
 
+
+async def _wait_for_disconnect(http_request: Request) -> None:
+    """等待客户端断开（请求体已读完，之后只会收到 http.disconnect）"""
+    while (await http_request.receive())["type"] != "http.disconnect":
+        pass
+
+
 @router.post("/send")
 async def send_message(
     request: ChatSendRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    x_debug_timings: Optional[str] = Header(None)
 ):
     """发送消息并获取 AI 响应（流式）"""
+    # 本地推理排队已满时直接拒绝（503 + Retry-After），不再建立流
+    inference_scheduler.check_admission("chat")
+    
+    # 认证查询后立即归还连接：依赖注入的会话要到流结束才关闭，
+    # 协调器按工作单元自行开启短会话，流式生成期间不占用连接
+    db.close()
     
-    async def generate() -> AsyncGenerator[str, None]:
-        """生成 SSE 流"""
+    async def events() -> AsyncGenerator[dict, None]:
+        """协调器事件流，异常转为 error 事件"""
+        # 本轮的所有本地推理按该用户公平排队
+        current_user_id.set(current_user.id)
         try:
             async for event in coordinator.process_message(
                 user_input=request.message,
                 user=current_user,
-                db=db,
-                conversation_id=request.conversation_id
+                conversation_id=request.conversation_id,
+                # 请求头 X-Debug-Timings: 1 时在 metadata / end 事件中附带分阶段耗时
+                debug_timings=x_debug_timings == "1"
             ):
-                # 将事件序列化为 SSE 格式
-                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                yield event
         
         except Exception as e:
-            error_event = {
+            yield {
                 "type": "error",
                 "content": f"处理失败: {str(e)}"
             }
-            yield f"data: {json.dumps(error_event, ensure_ascii=False)}\n\n"
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    # 合并连续的 chunk 事件后编码为 SSE 帧；客户端断开时取消上游生成
+    return StreamingResponse(
+        SSEEncoder().stream(events(), disconnected=lambda: _wait_for_disconnect(http_request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+@router.get("/disconnect/stats")
+async def get_disconnect_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """客户端中途断开次数与估计节省的生成 token 数"""
+    return coordinator.metrics.disconnect_stats()
+
+
+@router.get("/perception/stats")
+async def get_perception_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """感知规划各判定层（规则/分类器/大模型）的命中率"""
+    return coordinator.perception_module.get_tier_stats()
+
+
+@router.get("/perception/batching/stats")
+async def get_perception_batching_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """感知微批处理的批次数与平均批大小"""
+    return coordinator.perception_module.batcher.stats()
+
+
+@router.get("/perception/cache/stats")
+async def get_perception_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """感知结果缓存的命中与合并统计"""
+    return coordinator.perception_module.cache.stats()
+
+
+@router.get("/speculation/stats")
+async def get_speculation_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """推测式本地生成的放行/浪费统计"""
+    return coordinator.speculation_stats.snapshot()
+
+
+@router.get("/backends/status")
+async def get_backend_status(
+    current_user: User = Depends(get_current_user)
+):
+    """模型后端熔断器状态与降级统计"""
+    return coordinator.model_router.get_backend_status()
+
+
+@router.get("/cache/stats")
+async def get_cache_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """对话状态缓存的命中统计"""
+    return conversation_cache.stats()
+
+
+@router.get("/write-behind/stats")
+async def get_write_behind_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """assistant 消息写后队列的写入、重试与丢弃统计"""
+    return coordinator.write_behind.stats()
+
+
+@router.get("/session-affinity/stats")
+async def get_session_affinity_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """本地模型上下文复用统计（续接次数、估算节省的预填充时间）"""
+    return session_affinity.stats()
+
+
+@router.get("/scheduler/stats")
+async def get_scheduler_stats(
+    current_user: User = Depends(get_current_user)
+):
+    """本地推理调度器状态与各优先级的排队等待时间"""
+    return inference_scheduler.stats()
 
 
 @router.get("/active")
@@ -71,12 +176,18 @@ async def clear_conversation(
     db: Session = Depends(get_db)
 ):
     """手动清空当前对话"""
+    # 先写完队列中的消息，避免删除后又被写入
+    await write_behind.flush()
+    
     # 删除该用户的所有对话（不论状态）
     conversations = db.query(Conversation).filter(
         Conversation.user_id == current_user.id
     ).all()
     
     for conv in conversations:
+        conversation_cache.invalidate(conv.id)
+        session_affinity.evict(conv.id)
+        
         # 删除所有消息（隐私保护）
         db.query(Message).filter(
             Message.conversation_id == conv.id
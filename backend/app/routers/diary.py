@@ -5,7 +5,6 @@ from sqlalchemy import func, and_, desc
 from typing import List, Optional
 from datetime import datetime, date
 import json
-import ollama
 
 from ..database import get_db
 from ..models import Diary, User, GrowthRecord
@@ -14,6 +13,9 @@ from ..schemas import (
     DiaryUpdateRequest, Response
 )
 from ..auth import get_current_user
+from ..inference_scheduler import inference_scheduler
+from ..ollama_pool import ollama_pool
+from ..model_warmup import configured_model
 
 router = APIRouter(prefix="/api/diary", tags=["diary"])
 
@@ -47,7 +49,8 @@ async def create_diary(
         content=request.content,
         emotions=request.emotions,
         life_dimensions=request.life_dimensions,
-        emotion_trigger=request.emotion_trigger
+        emotion_trigger=request.emotion_trigger,
+        user_id=current_user.id
     )
     
     # 创建日记
@@ -323,7 +326,7 @@ def get_guided_questions(
     return {"question": random.choice(questions)}
 
 
-async def generate_ai_feedback_with_ollama(content: str, emotions: Optional[List[dict]], life_dimensions: Optional[dict], emotion_trigger: Optional[str] = None) -> dict:
+async def generate_ai_feedback_with_ollama(content: str, emotions: Optional[List[dict]], life_dimensions: Optional[dict], emotion_trigger: Optional[str] = None, user_id: Optional[int] = None) -> dict:
     """使用 Ollama 模型生成深度 AI 反馈"""
     try:
         # 构建分析提示词
@@ -369,13 +372,14 @@ async def generate_ai_feedback_with_ollama(content: str, emotions: Optional[List
 
 请确保返回有效的 JSON 格式。"""
         
-        # 调用 Ollama 模型
-        client = ollama.Client()
-        response = client.chat(
-            model="Ethanwhh/Qwen3-4B-xinyi",
-            messages=[{"role": "user", "content": prompt}],
-            format="json"
-        )
+        # 调用 Ollama 模型（后台优先级，排队已满时降级为简单版反馈）
+        async with inference_scheduler.slot("background", user_id):
+            response = await ollama_pool.chat(
+                "background",
+                model=configured_model("chat"),
+                messages=[{"role": "user", "content": prompt}],
+                format="json"
+            )
         
         # 解析响应
         ai_response = response['message']['content']
@@ -55,6 +55,7 @@ class MessageResponse(BaseModel):
     id: int
     role: str
     content: str
+    truncated: Optional[bool] = False  # 客户端中途断开，回复不完整
     created_at: datetime
 
     class Config:
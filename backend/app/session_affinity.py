@@ -0,0 +1,140 @@
+"""会话亲和 - 多轮对话复用本地模型的上下文（KV 缓存）
+
+每个对话保存上一轮生成结束时 Ollama 返回的 context（已编码的 token 序列）
+以及对应前缀（系统提示词 + 历史 + 上一轮回复）的签名。
+下一轮的系统提示词与历史恰好等于该前缀时，只发送新的用户轮次，
+省去整段前缀的重新预填充；阶段切换、历史被截断或摘要变化时签名不一致，
+回退为发送完整提示词。对话空闲超时或被清空时释放上下文。
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionContext:
+    """单个对话保存的模型上下文"""
+
+    __slots__ = ("context", "signature", "last_used")
+
+    def __init__(self, context: List[int], signature: str):
+        self.context = context
+        self.signature = signature
+        self.last_used = time.monotonic()
+
+
+class SessionAffinity:
+    """按对话 id 保存模型上下文的有界 LRU 表"""
+
+    def __init__(self, enabled: bool = None, capacity: int = None, idle_seconds: float = None, max_tokens: int = None):
+        self.enabled = enabled if enabled is not None else (
+            os.getenv("LOCAL_SESSION_AFFINITY", "false").lower() == "true"
+        )
+        self.capacity = capacity or int(os.getenv("LOCAL_SESSION_MAX", "256"))
+        self.idle_seconds = idle_seconds or float(os.getenv("LOCAL_SESSION_IDLE_SECONDS", "600"))
+        # 上下文超过该长度时不再续接，回退为按 token 预算截取的完整提示词
+        self.max_tokens = max_tokens or int(os.getenv("LOCAL_SESSION_MAX_TOKENS", "8192"))
+        self.entries: "OrderedDict[int, SessionContext]" = OrderedDict()
+
+        self.reused = 0
+        self.cold = 0
+        self.prefix_changed = 0
+        self.evicted = 0
+        self.saved_tokens = 0
+        self.saved_ms = 0.0
+        self.last_saved_ms = 0.0
+        # 完整提示词预填充的平均耗时（毫秒 / token），用于估算复用节省的时间
+        self.prefill_ms_per_token: Optional[float] = None
+
+    @staticmethod
+    def signature(system_prompt: str, messages: List[Dict]) -> str:
+        payload = json.dumps(
+            [system_prompt] + [[m["role"], m["content"]] for m in messages],
+            ensure_ascii=False
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, session_id: int, system_prompt: str, history: List[Dict]) -> Optional[SessionContext]:
+        """前缀与上一轮结束时一致则返回可续接的上下文"""
+        self.evict_idle()
+        entry = self.entries.get(session_id)
+        if entry is None:
+            self.cold += 1
+            return None
+        if entry.signature != self.signature(system_prompt, history) or len(entry.context) > self.max_tokens:
+            self.prefix_changed += 1
+            del self.entries[session_id]
+            return None
+        entry.last_used = time.monotonic()
+        self.entries.move_to_end(session_id)
+        return entry
+
+    def store(self, session_id: int, context: List[int], system_prompt: str, messages: List[Dict]) -> None:
+        """保存本轮生成结束后的上下文，messages 为包含本轮问答的完整历史"""
+        if not context:
+            return
+        self.entries[session_id] = SessionContext(context, self.signature(system_prompt, messages))
+        self.entries.move_to_end(session_id)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def evict(self, session_id: int) -> None:
+        if self.entries.pop(session_id, None) is not None:
+            self.evicted += 1
+
+    def evict_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_seconds
+        # 按最近使用排序，最旧的在前
+        while self.entries:
+            session_id, entry = next(iter(self.entries.items()))
+            if entry.last_used >= cutoff:
+                break
+            del self.entries[session_id]
+            self.evicted += 1
+
+    def record_prefill(self, prompt_tokens: int, duration_ns: int) -> None:
+        """记录完整提示词的预填充速度（指数滑动平均）"""
+        if not prompt_tokens or not duration_ns:
+            return
+        rate = duration_ns / 1e6 / prompt_tokens
+        if self.prefill_ms_per_token is None:
+            self.prefill_ms_per_token = rate
+        else:
+            self.prefill_ms_per_token = 0.8 * self.prefill_ms_per_token + 0.2 * rate
+
+    def record_reuse(self, session_id: int, reused_tokens: int) -> float:
+        """记录一次续接，返回估算节省的预填充毫秒数"""
+        saved_ms = reused_tokens * (self.prefill_ms_per_token or 0.0)
+        self.reused += 1
+        self.saved_tokens += reused_tokens
+        self.saved_ms += saved_ms
+        self.last_saved_ms = saved_ms
+        logger.info(f"对话 {session_id} 复用 {reused_tokens} 个上下文 token，约节省预填充 {saved_ms:.1f}ms")
+        return saved_ms
+
+    def stats(self) -> Dict:
+        turns = self.reused + self.cold + self.prefix_changed
+        return {
+            "enabled": self.enabled,
+            "sessions": len(self.entries),
+            "reused": self.reused,
+            "cold": self.cold,
+            "prefix_changed": self.prefix_changed,
+            "evicted": self.evicted,
+            "reuse_rate": round(self.reused / turns, 4) if turns else 0.0,
+            "saved_tokens": self.saved_tokens,
+            "saved_prefill_ms": round(self.saved_ms, 1),
+            "avg_saved_prefill_ms": round(self.saved_ms / self.reused, 1) if self.reused else 0.0,
+            "last_saved_prefill_ms": round(self.last_saved_ms, 1),
+            "prefill_ms_per_token": round(self.prefill_ms_per_token, 3) if self.prefill_ms_per_token else None
+        }
+
+
+# 全局会话亲和实例
+session_affinity = SessionAffinity()
@@ -0,0 +1,82 @@
+"""推测式生成 - 感知规划进行期间提前启动本地模型生成
+
+本地模型的输出先写入缓冲区，感知规划确认走本地路由后再放行；
+若路由到云端或检测到危机，则取消推测流并丢弃已生成的内容。
+"""
+import asyncio
+import contextlib
+import logging
+from typing import AsyncGenerator, Dict
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class SpeculativeGeneration:
+    """后台消费模型流并缓冲输出，等待放行或丢弃"""
+
+    def __init__(self, stream: AsyncGenerator[str, None]):
+        self.stream = stream
+        self.buffer: asyncio.Queue = asyncio.Queue()
+        self.chunk_count = 0
+        self.task = asyncio.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self.stream:
+                self.chunk_count += 1
+                self.buffer.put_nowait(chunk)
+        finally:
+            await self.stream.aclose()
+            self.buffer.put_nowait(_DONE)
+
+    async def release(self) -> AsyncGenerator[str, None]:
+        """放行：先输出已缓冲的内容，再继续转发后续输出"""
+        try:
+            while True:
+                chunk = await self.buffer.get()
+                if chunk is _DONE:
+                    break
+                yield chunk
+            # 透传模型流中的异常
+            await self.task
+        finally:
+            if not self.task.done():
+                await self.discard()
+
+    async def discard(self) -> int:
+        """丢弃：取消后台生成，返回被浪费的输出片段数"""
+        self.task.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await self.task
+        return self.chunk_count
+
+
+class SpeculationStats:
+    """推测式生成的命中/浪费统计"""
+
+    def __init__(self):
+        self.started = 0
+        self.used = 0
+        self.wasted = 0
+        self.wasted_chunks = 0
+
+    def record_started(self) -> None:
+        self.started += 1
+
+    def record_used(self) -> None:
+        self.used += 1
+
+    def record_wasted(self, chunks: int) -> None:
+        self.wasted += 1
+        self.wasted_chunks += chunks
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "started": self.started,
+            "used": self.used,
+            "wasted": self.wasted,
+            "wasted_chunks": self.wasted_chunks,
+            "waste_rate": round(self.wasted / self.started, 4) if self.started else 0.0
+        }
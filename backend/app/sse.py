@@ -0,0 +1,160 @@
+"""SSE 帧编码器 - 合并连续的 chunk 事件，减少小帧写出与序列化开销
+
+- 连续的 chunk 事件按字节数 / 时间窗口合并为一帧
+- chunk 帧使用预编码的前后缀，只对文本内容做 JSON 转义
+- 长时间无输出时发送心跳注释行，配合禁用缓冲的响应头防止代理积压
+- 客户端断开时立即停止并取消上游事件流，不再继续生成
+"""
+import os
+import json
+import time
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+# 禁止代理缓冲 / 转换 SSE 响应
+SSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+_CHUNK_PREFIX = b'data: {"type": "chunk", "content": '
+_FRAME_SUFFIX = b'}\n\n'
+_HEARTBEAT = b': ping\n\n'
+_END = object()
+_DISCONNECTED = object()
+
+
+def encode_event(event: Dict) -> bytes:
+    """将单个事件编码为 SSE 帧"""
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def encode_chunk(content: str) -> bytes:
+    """编码 chunk 事件（与 encode_event 输出一致，但只序列化文本内容）"""
+    return _CHUNK_PREFIX + json.dumps(content, ensure_ascii=False).encode("utf-8") + _FRAME_SUFFIX
+
+
+class SSEEncoder:
+    """按刷新策略合并 chunk 事件并插入心跳的 SSE 流编码器"""
+
+    def __init__(self, max_bytes: int = None, max_ms: float = None, heartbeat_seconds: float = None):
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("SSE_COALESCE_MAX_BYTES", "512"))
+        self.max_delay = (max_ms if max_ms is not None else float(os.getenv("SSE_COALESCE_MAX_MS", "30"))) / 1000
+        self.heartbeat = heartbeat_seconds if heartbeat_seconds is not None else float(
+            os.getenv("SSE_HEARTBEAT_SECONDS", "15")
+        )
+        self.frames = 0
+        self.events = 0
+
+    async def stream(
+        self,
+        events: AsyncIterator[Dict],
+        disconnected: Optional[Callable[[], Awaitable]] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        编码事件流
+        :param events: 协调器产出的事件
+        :param disconnected: 等待客户端断开的协程函数；断开后停止编码并取消上游
+        :yield: SSE 帧字节
+        """
+        # 由单个后台任务拉取上游事件，避免每个 token 创建一次等待任务
+        queue: asyncio.Queue = asyncio.Queue()
+        pump = asyncio.create_task(self._pump(events, queue))
+        watcher = None
+        if disconnected is not None:
+            watcher = asyncio.create_task(disconnected())
+            watcher.add_done_callback(lambda _: queue.put_nowait(_DISCONNECTED))
+        buffer = []
+        buffered_bytes = 0
+        flush_at: Optional[float] = None
+        last_write = time.monotonic()
+
+        def flush() -> bytes:
+            nonlocal buffer, buffered_bytes, flush_at, last_write
+            frame = encode_chunk("".join(buffer))
+            buffer, buffered_bytes, flush_at = [], 0, None
+            last_write = time.monotonic()
+            self.frames += 1
+            return frame
+
+        try:
+            while True:
+                if queue.empty():
+                    # 等待下一个事件，最多等到合并窗口到期或需要发送心跳
+                    deadline = flush_at if flush_at is not None else (
+                        last_write + self.heartbeat if self.heartbeat else None
+                    )
+                    try:
+                        async with asyncio.timeout_at(self._loop_deadline(deadline)):
+                            item = await queue.get()
+                    except TimeoutError:
+                        if buffer:
+                            yield flush()
+                        else:
+                            last_write = time.monotonic()
+                            yield _HEARTBEAT
+                        continue
+                else:
+                    item = queue.get_nowait()
+
+                if item is _END:
+                    break
+                if item is _DISCONNECTED:
+                    # 客户端已断开，剩余内容无需写出；finally 中取消上游
+                    return
+                if isinstance(item, BaseException):
+                    if buffer:
+                        yield flush()
+                    raise item
+                event = item
+                self.events += 1
+
+                if event.get("type") == "chunk":
+                    content = event.get("content", "")
+                    buffer.append(content)
+                    buffered_bytes += len(content.encode("utf-8"))
+                    if flush_at is None:
+                        flush_at = time.monotonic() + self.max_delay
+                    if buffered_bytes >= self.max_bytes or self.max_delay <= 0:
+                        yield flush()
+                    continue
+
+                # 非 chunk 事件：先写出已合并的文本，保证事件顺序不变
+                if buffer:
+                    yield flush()
+                last_write = time.monotonic()
+                self.frames += 1
+                yield encode_event(event)
+
+            if buffer:
+                yield flush()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not pump.done():
+                pump.cancel()
+            # shield：外层任务（客户端断开时由服务器取消）可能被反复取消，
+            # 不能把取消再次传入 pump，否则上游连接的关闭流程会被打断
+            try:
+                await asyncio.shield(pump)
+            except asyncio.CancelledError:
+                pass
+
+    @staticmethod
+    async def _pump(events: AsyncIterator[Dict], queue: asyncio.Queue) -> None:
+        try:
+            async for event in events:
+                queue.put_nowait(event)
+        except Exception as e:
+            queue.put_nowait(e)
+            return
+        queue.put_nowait(_END)
+
+    @staticmethod
+    def _loop_deadline(deadline: Optional[float]) -> Optional[float]:
+        """time.monotonic 时间点换算为事件循环时钟"""
+        if deadline is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return loop.time() + (deadline - time.monotonic())
@@ -0,0 +1,171 @@
+"""写后持久化队列 - 异步批量写入 assistant 消息
+
+聊天回合结束后，assistant 消息不在请求路径上提交，而是放入队列，
+由后台任务跨对话合并为批量插入（一次事务、一次 fsync）。
+应用关闭时会先清空队列再退出。
+
+批量写入失败时按指数退避重试，仍失败则改为逐条写入，只丢弃本身无法写入的记录，
+不连累同一批次中其他对话的消息；丢弃数计入统计与 /metrics。
+
+注意：写后模式下，进程崩溃会丢失尚未落盘的消息（最多一个批次间隔）；
+需要逐条落盘时设置 CHAT_PERSISTENCE=sync。
+"""
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+from .database import SessionLocal
+from .metrics import pipeline_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """后台批量写入 ORM 对象"""
+
+    def __init__(self, session_factory=SessionLocal, batch_size: int = None, interval_ms: float = None):
+        self.session_factory = session_factory
+        self.batch_size = batch_size or int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "64"))
+        self.interval = (interval_ms or float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "50"))) / 1000
+        self.retries = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+        self.retry_backoff = float(os.getenv("WRITE_BEHIND_RETRY_BACKOFF_MS", "100")) / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self.flush_requested: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.pending: Dict[int, int] = defaultdict(int)
+        self.written = 0
+        self.batches = 0
+        self.retried = 0
+        self.row_fallbacks = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            self.flush_requested = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """写完队列中剩余的对象后停止后台任务"""
+        if self.task is None:
+            return
+        await self.flush()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def enqueue(self, obj, group_id: int, on_commit: Callable = None) -> None:
+        """
+        放入待写队列
+        :param group_id: 分组（对话）id，用于按对话等待写入完成
+        :param on_commit: 提交成功后以对象为参数的回调（在写入线程中执行）
+        """
+        await self.start()
+        self.pending[group_id] += 1
+        self.queue.put_nowait((obj, group_id, on_commit))
+
+    def has_pending(self, group_id: int) -> bool:
+        return self.pending.get(group_id, 0) > 0
+
+    async def flush(self) -> None:
+        """立即写入当前队列（不再等待攒批间隔）并等待完成"""
+        if self.queue is not None and self.task is not None and not self.task.done():
+            self.flush_requested.set()
+            await self.queue.join()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.interval
+            # 攒批：直到达到批量上限、间隔到期或有调用方请求立即落盘
+            while len(batch) < self.batch_size and not self.flush_requested.is_set():
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                getter = asyncio.ensure_future(self.queue.get())
+                flush_waiter = asyncio.ensure_future(self.flush_requested.wait())
+                done, _ = await asyncio.wait(
+                    {getter, flush_waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                flush_waiter.cancel()
+                if getter in done:
+                    batch.append(getter.result())
+                else:
+                    # 取消尚未取到元素的 get，元素仍留在队列中
+                    getter.cancel()
+            if self.queue.empty():
+                self.flush_requested.clear()
+
+            try:
+                await self._write_batch(batch)
+            finally:
+                for _, group_id, _ in batch:
+                    self.pending[group_id] -= 1
+                    if self.pending[group_id] <= 0:
+                        self.pending.pop(group_id, None)
+                    self.queue.task_done()
+
+    async def _write_batch(self, batch: List[Tuple]) -> None:
+        """批量写入；失败时退避重试，重试耗尽后逐条写入"""
+        for attempt in range(self.retries + 1):
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                if attempt >= self.retries:
+                    logger.error(f"写后队列批量写入失败（{len(batch)} 条），改为逐条写入: {e}")
+                    break
+                self.retried += 1
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(f"写后队列批量写入失败（{len(batch)} 条），{delay:.2f}s 后重试: {e}")
+                await asyncio.sleep(delay)
+            else:
+                self.written += len(batch)
+                self.batches += 1
+                return
+
+        self.row_fallbacks += 1
+        for item in batch:
+            try:
+                await asyncio.to_thread(self._write, [item])
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                pipeline_metrics.persistence_failures.inc(())
+                logger.error(f"写后队列丢弃对话 {item[1]} 的 1 条记录: {e}")
+
+    def _write(self, batch: List[Tuple]) -> None:
+        db = self.session_factory()
+        # 提交后仍需读取自增 id，避免过期属性触发额外查询
+        db.expire_on_commit = False
+        try:
+            db.add_all([obj for obj, _, _ in batch])
+            db.commit()
+            for obj, _, on_commit in batch:
+                if on_commit:
+                    on_commit(obj)
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "written": self.written,
+            "batches": self.batches,
+            "retried": self.retried,
+            "row_fallbacks": self.row_fallbacks,
+            "failed": self.failed
+        }
+
+
+# 全局写后队列实例
+write_behind = WriteBehindQueue()
@@ -0,0 +1,289 @@
+"""聊天接口并发压测 - 多用户多轮 SSE 对话的延迟分位数
+
+每个模拟用户注册并登录后，进行若干段多轮对话（每段新建对话），逐行解析
+/api/chat/send 的 SSE 流，统计：
+- 首 token 延迟（发送请求到第一个 chunk 帧）
+- token 间隔（相邻 chunk 帧的间隔）
+- 整轮延迟（发送请求到 end 事件）
+- 数据库提交耗时（仅进程内模式，统计服务端每次 Session 提交）
+- 错误率（503 拒绝、其他 HTTP 错误、error 事件、模型错误回复、连接异常）
+结果写入 JSON 文件，便于在不同提交之间对比。
+
+默认在本进程内启动替身模型服务（benchmarks.stub_llm）与后端应用，使用临时
+数据库，无需 Ollama 与 ModelScope；指定 --base-url 时压测已运行的服务
+（此时不统计数据库提交耗时）。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.chat_load --users 20 --conversations 2 --turns 5 --output load.json
+    python -m benchmarks.chat_load --base-url http://127.0.0.1:8000 --users 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import httpx
+import uvicorn
+
+from benchmarks.stub_llm import StubServer, add_stub_arguments, config_from_args
+
+# 覆盖简单倾诉、隐私与复杂问题三类路由（不含危机关键词，避免对话被终止）
+SAMPLE_MESSAGES = [
+    "今天有点累，想找人聊聊",
+    "最近总觉得提不起劲",
+    "谢谢你，感觉好一些了",
+    "我和男朋友分手了，心里很难受",
+    "这件事请帮我保密，我不想让别人知道",
+    "考研压力太大了，能帮我制定一个详细的复习计划吗？",
+    "室友总是很晚回来，我该怎么和她沟通？",
+    "工作和生活总是平衡不好，具体方法有哪些？",
+]
+
+MODEL_ERROR_PREFIXES = ("[错误]", "错误：")
+
+
+def percentiles(values: list) -> dict:
+    """p50 / p95 / p99 / 平均 / 最大（最近秩法）"""
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, int(round(p * len(ordered) + 0.5)) - 1))], 2)
+
+    return {
+        "count": len(ordered),
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+class CommitTimer:
+    """监听 SQLAlchemy Session 提交，记录每次提交耗时（含 flush）"""
+
+    def __init__(self):
+        self.durations = []
+        self.lock = threading.Lock()
+
+    def install(self) -> None:
+        from sqlalchemy import event
+        from sqlalchemy.orm import Session
+
+        @event.listens_for(Session, "before_commit")
+        def before_commit(session):
+            session.info["commit_started"] = time.perf_counter()
+
+        @event.listens_for(Session, "after_commit")
+        def after_commit(session):
+            started = session.info.pop("commit_started", None)
+            if started is not None:
+                with self.lock:
+                    self.durations.append((time.perf_counter() - started) * 1000)
+
+
+class LoadStats:
+    def __init__(self):
+        self.ttft = []
+        self.gaps = []
+        self.turns = []
+        self.chunks = []
+        self.completed = 0
+        self.errors = {"http_503": 0, "http_other": 0, "error_events": 0, "model_errors": 0, "exceptions": 0}
+        self.retry_after = []
+
+
+async def chat_turn(client: httpx.AsyncClient, token: str, message: str, conversation_id, stats: LoadStats):
+    """发送一条消息并解析 SSE 流，返回对话 id"""
+    start = time.perf_counter()
+    first = last = None
+    chunks = 0
+    head = ""
+    try:
+        async with client.stream(
+            "POST", "/api/chat/send",
+            json={"message": message, "conversation_id": conversation_id},
+            headers={"Authorization": f"Bearer {token}"}
+        ) as response:
+            if response.status_code == 503:
+                stats.errors["http_503"] += 1
+                if response.headers.get("Retry-After"):
+                    stats.retry_after.append(float(response.headers["Retry-After"]))
+                return conversation_id
+            if response.status_code != 200:
+                stats.errors["http_other"] += 1
+                return conversation_id
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                now = time.perf_counter()
+                kind = event.get("type")
+                if kind == "metadata":
+                    conversation_id = event.get("conversation_id", conversation_id)
+                elif kind in ("chunk", "crisis"):
+                    if first is None:
+                        first = now
+                        stats.ttft.append((now - start) * 1000)
+                    else:
+                        stats.gaps.append((now - last) * 1000)
+                    last = now
+                    chunks += 1
+                    if len(head) < 8:
+                        head += event.get("content", "")
+                elif kind == "error":
+                    stats.errors["error_events"] += 1
+                    return conversation_id
+                if kind in ("end", "crisis"):
+                    # 模型服务把调用失败转成以错误提示开头的回复文本
+                    if head.startswith(MODEL_ERROR_PREFIXES):
+                        stats.errors["model_errors"] += 1
+                        return conversation_id
+                    stats.turns.append((now - start) * 1000)
+                    stats.chunks.append(chunks)
+                    stats.completed += 1
+    except httpx.HTTPError:
+        stats.errors["exceptions"] += 1
+    return conversation_id
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    await client.post("/api/auth/register", json={"username": username, "password": password})
+    response = await client.post("/api/auth/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def run_load(base_url: str, args, stats: LoadStats, commit_timer: CommitTimer = None) -> dict:
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        # 准备阶段：注册登录不计入压测结果
+        prefix = f"load_{int(time.time())}"
+        tokens = []
+        for index in range(args.users):
+            tokens.append(await login(client, f"{prefix}_{index}", "load_test_pw"))
+        if commit_timer:
+            commit_timer.durations.clear()
+
+        async def user_session(index: int, token: str):
+            rng = random.Random(args.seed + index)
+            await asyncio.sleep(args.ramp_s * index / max(args.users, 1))
+            for _ in range(args.conversations):
+                conversation_id = None
+                for _ in range(args.turns):
+                    conversation_id = await chat_turn(
+                        client, token, rng.choice(SAMPLE_MESSAGES), conversation_id, stats
+                    )
+                    await asyncio.sleep(args.think_ms / 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user_session(index, token) for index, token in enumerate(tokens)))
+        elapsed = time.perf_counter() - start
+
+        # 服务端统计（接口不存在时忽略）
+        server = {}
+        for name in ("scheduler", "cache", "perception", "disconnect", "backends"):
+            path = {"backends": "/api/chat/backends/status"}.get(name, f"/api/chat/{name}/stats")
+            try:
+                response = await client.get(path, headers={"Authorization": f"Bearer {tokens[0]}"})
+                if response.status_code == 200:
+                    server[name] = response.json()
+            except httpx.HTTPError:
+                pass
+    return {"elapsed": elapsed, "server": server}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="聊天接口并发压测")
+    parser.add_argument("--base-url", help="压测已运行的服务；不指定时在进程内启动应用与替身模型")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--conversations", type=int, default=2, help="每个用户的对话段数")
+    parser.add_argument("--turns", type=int, default=5, help="每段对话的轮数")
+    parser.add_argument("--think-ms", type=float, default=500, help="每轮之间的用户思考时间")
+    parser.add_argument("--ramp-s", type=float, default=2, help="用户逐个启动的总时长")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--app-port", type=int, default=18000)
+    parser.add_argument("--stub-port", type=int, default=11500)
+    parser.add_argument("--label", default="", help="写入结果文件的标签")
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stats = LoadStats()
+    commit_timer = None
+
+    if args.base_url:
+        outcome = await run_load(args.base_url, args, stats)
+    else:
+        # 应用模块在导入时读取配置，需先设置环境变量
+        stub_url = f"http://127.0.0.1:{args.stub_port}"
+        os.environ["OLLAMA_HOST"] = stub_url
+        os.environ["MODELSCOPE_BASE_URL"] = f"{stub_url}/v1/chat/completions"
+        os.environ["MODELSCOPE_API_KEY"] = "stub"
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+        from app.main import app
+
+        commit_timer = CommitTimer()
+        commit_timer.install()
+        async with StubServer(config_from_args(args), port=args.stub_port):
+            server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.app_port, log_level="warning"))
+            server_task = asyncio.create_task(server.serve())
+            while not server.started:
+                await asyncio.sleep(0.05)
+            try:
+                outcome = await run_load(f"http://127.0.0.1:{args.app_port}", args, stats, commit_timer)
+            finally:
+                server.should_exit = True
+                await server_task
+
+    attempted = args.users * args.conversations * args.turns
+    failed = sum(stats.errors.values())
+    report = {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output",)},
+        "results": {
+            "turns_attempted": attempted,
+            "turns_completed": stats.completed,
+            "seconds": round(outcome["elapsed"], 2),
+            "turns_per_second": round(stats.completed / outcome["elapsed"], 2) if outcome["elapsed"] else None,
+            "ttft_ms": percentiles(stats.ttft),
+            "inter_token_ms": percentiles(stats.gaps),
+            "turn_ms": percentiles(stats.turns),
+            "chunks_per_turn": percentiles(stats.chunks),
+            "db_commit_ms": percentiles(commit_timer.durations) if commit_timer else None,
+            "errors": stats.errors,
+            "error_rate": round(failed / attempted, 4) if attempted else 0.0,
+            "retry_after_s": percentiles(stats.retry_after),
+        },
+        "server": outcome["server"],
+    }
+
+    print(json.dumps(report["results"], ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+"""聊天持久化基准测试 - 每轮多次提交 vs 单事务 + 写后队列
+
+使用临时 SQLite 文件数据库（保留真实的 fsync 开销），模型与感知规划替换为
+即时返回的桩，只测量协调器的数据库路径。对比三种方式的每秒回合数：
+- legacy：改造前每轮最多 5 次提交的流程（在此脚本中复现）
+- sync：单事务提交本轮变更，assistant 消息同步提交
+- write_behind：单事务提交本轮变更，assistant 消息进入批量写后队列
+
+用法（在 backend 目录下）：
+    python -m benchmarks.chat_persistence --users 16 --turns 10 --think-ms 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import User, Conversation, Message
+from app.coordinator import MultiAgentCoordinator
+from app.conversation_cache import ConversationCache
+from app.write_behind import WriteBehindQueue
+
+
+async def instant_reply(system_prompt, user_input, conversation_history, stream=True, session_id=None):
+    yield "嗯，我在听。"
+
+
+async def simple_perception(user_input, conversation_history, scan=None):
+    return {
+        "is_privacy_issue": False,
+        "is_complex_issue": False,
+        "is_crisis": False,
+        "privacy_reason": "",
+        "complexity_reason": "",
+        "recommended_model": "local",
+        "timings": {}
+    }
+
+
+async def legacy_turn(coordinator, db, user, conversation_id, text):
+    """复现改造前的提交顺序：用户消息、轮次、阶段、assistant 消息各自提交"""
+    conversation = None
+    if conversation_id:
+        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    if conversation is None:
+        conversation = Conversation(user_id=user.id, phase="emotional", round_count=0, status="ongoing")
+        db.add(conversation)
+        db.commit()
+        db.refresh(conversation)
+
+    db.add(Message(conversation_id=conversation.id, role="user", content=text))
+    db.commit()
+    conversation.round_count += 1
+    db.commit()
+
+    db.query(Message).filter(
+        Message.conversation_id == conversation.id
+    ).order_by(Message.created_at.asc()).limit(20).all()
+    await simple_perception(text, [])
+
+    should_transition, new_phase = coordinator.phase_manager.should_transition(
+        conversation.phase, conversation.round_count, text
+    )
+    if should_transition:
+        conversation.phase = new_phase
+        db.commit()
+
+    response = "".join([chunk async for chunk in instant_reply("", text, [])])
+    db.add(Message(
+        conversation_id=conversation.id, role="assistant", content=response,
+        agent_type="ConversationAgent", model_used="local-Qwen3-4B"
+    ))
+    db.commit()
+    return conversation.id
+
+
+async def run(mode: str, users: int, turns: int, think_ms: float) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    # 每个模拟用户持有一个会话，连接池需容纳全部并发用户
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False},
+        pool_size=users
+    )
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    coordinator = MultiAgentCoordinator()
+    coordinator.speculative_local = False
+    coordinator.perception_module.execute = simple_perception
+    coordinator.model_router.local_service.generate_with_prompt = instant_reply
+    coordinator.conversation_cache = ConversationCache()
+    # 协调器的各工作单元与写后队列都使用基准测试的数据库
+    coordinator.session_factory = lambda: session_factory(expire_on_commit=False)
+    coordinator.write_behind = WriteBehindQueue(session_factory=session_factory)
+    coordinator.persistence_mode = "sync" if mode == "sync" else "write_behind"
+
+    setup = session_factory()
+    accounts = [User(username=f"bench_{i}", hashed_password="x") for i in range(users)]
+    setup.add_all(accounts)
+    setup.commit()
+    user_ids = [account.id for account in accounts]
+    setup.close()
+
+    latencies = []
+
+    async def user_session(user_id: int):
+        db = session_factory()
+        user = db.get(User, user_id)
+        conversation_id = None
+        try:
+            for turn in range(turns):
+                text = f"今天第{turn}次想聊聊心情"
+                turn_start = time.perf_counter()
+                if mode == "legacy":
+                    conversation_id = await legacy_turn(coordinator, db, user, conversation_id, text)
+                else:
+                    async for event in coordinator.process_message(text, user, conversation_id=conversation_id):
+                        conversation_id = event.get("conversation_id", conversation_id)
+                latencies.append((time.perf_counter() - turn_start) * 1000)
+                # 用户阅读回复、输入下一条消息的间隔
+                await asyncio.sleep(think_ms / 1000)
+        finally:
+            db.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_session(user_id) for user_id in user_ids))
+    await coordinator.write_behind.stop()
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+
+    return {
+        "mode": mode,
+        "turns": users * turns,
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(users * turns / elapsed, 1),
+        "turn_p50_ms": round(statistics.median(latencies), 2),
+        "turn_p95_ms": round(statistics.quantiles(latencies, n=20)[18], 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="聊天持久化基准")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--think-ms", type=float, default=0, help="每轮之间的用户思考时间")
+    args = parser.parse_args()
+
+    for mode in ("legacy", "sync", "write_behind"):
+        print(await run(mode, args.users, args.turns, args.think_ms))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+"""数据库连接池与并发聊天流 - 验证流式生成期间不占用数据库连接
+
+以很小的连接池（默认 1 个连接、无溢出、短超时）在进程内启动应用与替身模型，
+同时发起多路较慢的聊天流，统计：
+- 成功完成的对话轮数与失败数（连接池耗尽时请求会在超时后失败）
+- 同时处于流式输出中的最大请求数
+- 连接池同时借出的最大连接数，以及流式输出期间借出的连接数
+
+会话在生成期间持有连接时，并发流数受池大小限制；改为短工作单元后，
+所有流都能同时进行，流式输出期间借出的连接数为 0。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.db_pool_streams --streams 16 --pool-size 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from benchmarks.chat_load import git_revision, login
+from benchmarks.stub_llm import StubServer, add_stub_arguments, config_from_args
+
+
+class PoolMonitor:
+    """通过连接池事件统计借出的连接数"""
+
+    def __init__(self):
+        self.checked_out = 0
+        self.peak = 0
+        self.peak_while_streaming = 0
+        self.streaming = 0
+        self.lock = threading.Lock()
+
+    def install(self, engine) -> None:
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "checkout")
+        def checkout(*_):
+            with self.lock:
+                self.checked_out += 1
+                self.peak = max(self.peak, self.checked_out)
+                if self.streaming:
+                    self.peak_while_streaming = max(self.peak_while_streaming, self.checked_out)
+
+        @event.listens_for(engine, "checkin")
+        def checkin(*_):
+            with self.lock:
+                self.checked_out -= 1
+
+    def stream_started(self) -> None:
+        with self.lock:
+            self.streaming += 1
+            if self.checked_out:
+                self.peak_while_streaming = max(self.peak_while_streaming, self.checked_out)
+
+    def stream_finished(self) -> None:
+        with self.lock:
+            self.streaming -= 1
+
+
+async def chat_stream(client: httpx.AsyncClient, token: str, message: str, monitor: PoolMonitor, results: dict):
+    """发送一条消息；收到第一个 chunk 起视为进入流式输出，直到 end 事件"""
+    streaming = False
+    try:
+        async with client.stream(
+            "POST", "/api/chat/send", json={"message": message}, headers={"Authorization": f"Bearer {token}"}
+        ) as response:
+            if response.status_code != 200:
+                results["failed"] += 1
+                return
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                kind = json.loads(line[6:]).get("type")
+                if kind == "chunk" and not streaming:
+                    streaming = True
+                    monitor.stream_started()
+                    results["concurrent"] += 1
+                    results["peak_concurrent"] = max(results["peak_concurrent"], results["concurrent"])
+                elif kind == "end":
+                    results["completed"] += 1
+                    return
+                elif kind == "error":
+                    results["failed"] += 1
+                    return
+        results["failed"] += 1
+    except httpx.HTTPError:
+        results["failed"] += 1
+    finally:
+        if streaming:
+            monitor.stream_finished()
+            results["concurrent"] -= 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="数据库连接池与并发聊天流")
+    parser.add_argument("--streams", type=int, default=16, help="同时发起的聊天流数")
+    parser.add_argument("--pool-size", type=int, default=1)
+    parser.add_argument("--pool-timeout", type=float, default=2, help="等待连接的超时秒数")
+    parser.add_argument("--app-port", type=int, default=18000)
+    parser.add_argument("--stub-port", type=int, default=11500)
+    add_stub_arguments(parser)
+    parser.set_defaults(tokens_per_second=20, reply_tokens=60)
+    args = parser.parse_args()
+
+    # 应用模块在导入时读取配置，需先设置环境变量
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    os.environ.update({
+        "OLLAMA_HOST": stub_url,
+        "MODELSCOPE_BASE_URL": f"{stub_url}/v1/chat/completions",
+        "MODELSCOPE_API_KEY": "stub",
+        "DATABASE_URL": f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'pool.db')}",
+        "DB_POOL_SIZE": str(args.pool_size),
+        "DB_MAX_OVERFLOW": "0",
+        "DB_POOL_TIMEOUT": str(args.pool_timeout),
+        # 推理槽位不成为瓶颈，只观察数据库连接池的影响
+        "OLLAMA_SLOTS": str(args.streams * 2),
+        "OLLAMA_MAX_QUEUE": str(args.streams * 4),
+    })
+    from app.database import engine
+    from app.main import app
+
+    monitor = PoolMonitor()
+    monitor.install(engine)
+    results = {"completed": 0, "failed": 0, "concurrent": 0, "peak_concurrent": 0}
+
+    async with StubServer(config_from_args(args), port=args.stub_port):
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.app_port, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+        try:
+            limits = httpx.Limits(max_connections=args.streams * 2)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.app_port}", timeout=120, limits=limits) as client:
+                tokens = [await login(client, f"pool_{index}", "pool_test_pw") for index in range(args.streams)]
+                start = time.perf_counter()
+                await asyncio.gather(*(
+                    chat_stream(client, token, "今天有点累，想找人聊聊", monitor, results) for token in tokens
+                ))
+                elapsed = time.perf_counter() - start
+        finally:
+            server.should_exit = True
+            await server_task
+
+    report = {
+        "git_revision": git_revision(),
+        "streams": args.streams,
+        "pool_size": args.pool_size,
+        "completed": results["completed"],
+        "failed": results["failed"],
+        "peak_concurrent_streams": results["peak_concurrent"],
+        "peak_checked_out_connections": monitor.peak,
+        "peak_checked_out_while_streaming": monitor.peak_while_streaming,
+        "seconds": round(elapsed, 2),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+"""本地后端并发吞吐基准测试 - Ollama 与 OpenAI 兼容服务（llama.cpp server / vLLM）
+
+在 1 / 8 / 32 个并发会话下，每个会话连续进行若干轮对话，统计：
+- tokens_per_s：所有会话合计的输出速率（按流式片段计，Ollama 与 llama.cpp 均为每片段一个 token）
+- session_tokens_per_s：单个会话在生成期间的平均输出速率
+- ttft_p50_ms / ttft_p95_ms：首 token 延迟（含在推理调度器排队的时间）
+
+默认启动两个替身服务：Ollama 替身按 --ollama-parallel 限制同时处理的请求数（对应
+OLLAMA_NUM_PARALLEL，应用侧推理调度器的槽位数取相同值）；OpenAI 兼容替身不限并发，
+以 --batch-slowdown 模拟连续批处理时批次变大带来的单请求减速。替身只反映并发上限的
+差异，绝对数值以真实服务为准，可用 --ollama-url / --openai-url 指向真实服务：
+    python -m benchmarks.local_backends --ollama-url http://127.0.0.1:11434 \\
+        --openai-url http://127.0.0.1:8080/v1 --model Ethanwhh/Qwen3-4B-xinyi
+
+用法（在 backend 目录下）：
+    python -m benchmarks.local_backends --concurrency 1,8,32 --turns 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from contextlib import AsyncExitStack
+
+from benchmarks.stub_llm import StubConfig, StubServer
+
+SYSTEM_PROMPT = "你是心理陪伴助手，请温和、简洁地回应用户。"
+USER_INPUT = "最近工作压力很大，晚上总是睡不好。"
+
+
+async def run_session(service, session_id: int, turns: int) -> dict:
+    """单个会话连续进行多轮对话"""
+    history = []
+    tokens = 0
+    ttfts = []
+    generating = 0.0
+    errors = 0
+    for _ in range(turns):
+        start = time.perf_counter()
+        first = None
+        reply = []
+        async for chunk in service.generate_with_prompt(
+            SYSTEM_PROMPT, USER_INPUT, history, stream=True, session_id=session_id
+        ):
+            if not chunk:
+                continue
+            if chunk.startswith("[错误]"):
+                errors += 1
+                break
+            if first is None:
+                first = time.perf_counter()
+                ttfts.append((first - start) * 1000)
+            reply.append(chunk)
+        if first is not None:
+            generating += time.perf_counter() - first
+        tokens += len(reply)
+        history += [{"role": "user", "content": USER_INPUT}, {"role": "assistant", "content": "".join(reply)}]
+    return {"tokens": tokens, "ttfts": ttfts, "generating": generating, "errors": errors}
+
+
+async def run_level(service, concurrency: int, turns: int) -> dict:
+    start = time.perf_counter()
+    sessions = await asyncio.gather(*(run_session(service, index, turns) for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    tokens = sum(s["tokens"] for s in sessions)
+    ttfts = sorted(t for s in sessions for t in s["ttfts"])
+    return {
+        "concurrency": concurrency,
+        "tokens": tokens,
+        "elapsed_s": round(elapsed, 2),
+        "tokens_per_s": round(tokens / elapsed, 1),
+        "session_tokens_per_s": round(statistics.mean(
+            s["tokens"] / s["generating"] for s in sessions if s["generating"]
+        ), 1) if tokens else 0,
+        "ttft_p50_ms": round(ttfts[len(ttfts) // 2], 1) if ttfts else None,
+        "ttft_p95_ms": round(ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))], 1) if ttfts else None,
+        "errors": sum(s["errors"] for s in sessions),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="本地后端并发吞吐")
+    parser.add_argument("--concurrency", default="1,8,32", help="并发会话数，逗号分隔")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的对话轮数")
+    parser.add_argument("--backends", default="ollama,openai", help="参与测试的后端")
+    parser.add_argument("--ollama-url", help="真实 Ollama 地址（不填则使用替身）")
+    parser.add_argument("--openai-url", help="真实 OpenAI 兼容服务地址，如 http://127.0.0.1:8080/v1")
+    parser.add_argument("--model", default="Ethanwhh/Qwen3-4B-xinyi")
+    parser.add_argument("--ollama-parallel", type=int, default=4, help="Ollama 并发数（OLLAMA_NUM_PARALLEL）")
+    parser.add_argument("--ollama-port", type=int, default=11500)
+    parser.add_argument("--openai-port", type=int, default=11501)
+    parser.add_argument("--ttft-ms", type=float, default=150)
+    parser.add_argument("--tokens-per-second", type=float, default=30)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--batch-slowdown", type=float, default=0.03)
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    os.environ.update({
+        "OLLAMA_HOST": args.ollama_url or f"http://127.0.0.1:{args.ollama_port}",
+        "OLLAMA_SLOTS": str(args.ollama_parallel),
+        "OLLAMA_MAX_QUEUE": str(max(levels) * 2),
+    })
+    from app.model_router import LocalModelService, OpenAICompatibleLocalService
+
+    def stub(parallel: int, port: int) -> StubServer:
+        return StubServer(StubConfig(
+            ttft_ms=args.ttft_ms,
+            tokens_per_second=args.tokens_per_second,
+            reply_tokens=args.reply_tokens,
+            parallel=parallel,
+            batch_slowdown=args.batch_slowdown
+        ), port=port)
+
+    results = []
+    async with AsyncExitStack() as stack:
+        if not args.ollama_url:
+            await stack.enter_async_context(stub(args.ollama_parallel, args.ollama_port))
+        if not args.openai_url:
+            await stack.enter_async_context(stub(0, args.openai_port))
+        openai_service = OpenAICompatibleLocalService(
+            "bench", args.openai_url or f"http://127.0.0.1:{args.openai_port}/v1", args.model
+        )
+        services = {
+            "ollama": LocalModelService(model=args.model),
+            "openai": openai_service,
+        }
+        for name in args.backends.split(","):
+            for level in levels:
+                row = await run_level(services[name], level, args.turns)
+                results.append({"backend": name, "source": "real" if (
+                    args.ollama_url if name == "ollama" else args.openai_url
+                ) else "stub", **row})
+        await openai_service.shutdown()
+
+    for row in results:
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""模型预热基准测试 - 重启后 / 模型被卸载后首个请求的延迟
+
+替身模型按 --load-ms 模拟 Ollama 加载模型的耗时，依次测量：
+- cold：不预热，重启后的首个感知请求与首个对话请求
+- warm：启动时预热（加载模型并缓存系统提示词）后的首个请求
+- rewarm：模拟 Ollama 卸载模型，后台检查发现后重新预热，再发起请求
+统计感知规划耗时、对话首 token 延迟与替身服务的模型加载次数。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.model_warmup --load-ms 3000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from benchmarks.stub_llm import StubServer, add_stub_arguments, config_from_args
+
+
+async def first_request(perception, local_service) -> dict:
+    start = time.perf_counter()
+    await perception.perceive("最近工作压力很大，晚上总是睡不好", [])
+    perception_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    stream = local_service.generate_with_prompt("你是心理陪伴助手", "最近工作压力很大", [], stream=True)
+    async for _ in stream:
+        break
+    ttft_ms = (time.perf_counter() - start) * 1000
+    await stream.aclose()
+    return {"perception_ms": round(perception_ms, 1), "chat_ttft_ms": round(ttft_ms, 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="模型预热前后的首个请求延迟")
+    parser.add_argument("--stub-port", type=int, default=11500)
+    add_stub_arguments(parser)
+    parser.set_defaults(load_ms=3000, ttft_ms=150, tokens_per_second=60)
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    os.environ.update({"OLLAMA_HOST": stub_url, "PERCEPTION_CASCADE": "false", "PERCEPTION_BATCH_WINDOW_MS": "0"})
+    from app.conversation_agent import ConversationAgent
+    from app.model_router import LocalModelService
+    from app.model_warmup import ModelWarmup
+    from app.perception_planning import PerceptionPlanningModule, COMBINED_PERCEPTION_PROMPT
+
+    async def scenario(name: str, stub: StubServer, prepare) -> dict:
+        perception = PerceptionPlanningModule(combined=True)
+        local_service = LocalModelService()
+        warmup = ModelWarmup()
+        warmup.register("perception", perception, "model_name", perception.keep_alive, [COMBINED_PERCEPTION_PROMPT])
+        warmup.register("chat", local_service, "model", local_service.keep_alive,
+                        [ConversationAgent().phase_prompts["emotional"]])
+        loads_before = stub.state.loads
+        warmup_ms = await prepare(warmup, perception, local_service)
+        row = {"scenario": name, "warmup_ms": warmup_ms, **await first_request(perception, local_service)}
+        row["model_loads"] = stub.state.loads - loads_before
+        row["readiness"] = {model: info["state"] for model, info in warmup.readiness()["models"].items()}
+        return row
+
+    async def cold(warmup, perception, local_service):
+        return None
+
+    async def warm(warmup, perception, local_service):
+        start = time.perf_counter()
+        await warmup.resolve()
+        await warmup.check()
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    async def rewarm(warmup, perception, local_service):
+        await warm(warmup, perception, local_service)
+        async with httpx.AsyncClient() as client:
+            await client.post(f"{stub_url}/stub/unload")
+        # 后台检查的一次循环：发现卸载后重新预热
+        return await warm(warmup, perception, local_service)
+
+    results = []
+    for name, prepare in (("cold", cold), ("warm", warm), ("rewarm", rewarm)):
+        # 每个场景使用新的替身服务，相当于 Ollama 重启后模型未加载
+        async with StubServer(config_from_args(args), port=args.stub_port) as stub:
+            results.append(await scenario(name, stub, prepare))
+
+    for row in results:
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""共享 Ollama 客户端基准测试 - 每次调用新建客户端 vs 进程内共享连接池
+
+以固定并发向替身 Ollama 发送短的非流式对话请求（感知 / 日记分析一类的调用），统计：
+- p50_ms / p95_ms：单次调用延迟
+- connections：替身服务看到的客户端连接数（每次新建客户端时每个请求都要建连）
+另有重启场景：Ollama 在请求发出后才开始监听，共享客户端按重试策略等待连接恢复，
+单次客户端直接失败。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.ollama_client --requests 400 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import ollama
+
+from benchmarks.stub_llm import StubServer, add_stub_arguments, config_from_args
+
+MESSAGES = [{"role": "user", "content": "今天有点累"}]
+
+
+async def run(call, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call()
+            except Exception:
+                errors += 1
+                return
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests_per_s": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2], 2) if latencies else None,
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2) if latencies else None,
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="共享 Ollama 客户端 vs 每次新建客户端")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stub-port", type=int, default=11500)
+    parser.add_argument("--restart-delay-ms", type=float, default=300, help="重启场景中 Ollama 恢复监听的延迟")
+    add_stub_arguments(parser)
+    parser.set_defaults(ttft_ms=5, reply_tokens=4, tokens_per_second=0)
+    args = parser.parse_args()
+
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{args.stub_port}"
+    from app.ollama_pool import OllamaPool
+
+    async def per_call():
+        # 改造前的日记分析：每次调用新建客户端
+        client = ollama.AsyncClient()
+        try:
+            return await client.chat(model="Ethanwhh/Qwen3-4B-xinyi", messages=MESSAGES)
+        finally:
+            await client.close()
+
+    pool = OllamaPool()
+
+    async def shared():
+        return await pool.chat("background", model="Ethanwhh/Qwen3-4B-xinyi", messages=MESSAGES)
+
+    results = []
+    for name, call in (("per_call", per_call), ("shared", shared)):
+        async with StubServer(config_from_args(args), port=args.stub_port) as stub:
+            row = await run(call, args.requests, args.concurrency)
+            results.append({"client": name, "scenario": "steady", **row,
+                            "connections": len(stub.state.client_ports)})
+
+    # 重启场景：请求先发出，替身服务稍后才开始监听
+    for name, call in (("per_call", per_call), ("shared", shared)):
+        async def restart():
+            await asyncio.sleep(args.restart_delay_ms / 1000)
+            return await StubServer(config_from_args(args), port=args.stub_port).__aenter__()
+
+        starter = asyncio.create_task(restart())
+        row = await run(call, args.concurrency, args.concurrency)
+        stub = await starter
+        await stub.__aexit__(None, None, None)
+        results.append({"client": name, "scenario": "restart", **row})
+    await pool.shutdown()
+
+    for row in results:
+        print(json.dumps(row, ensure_ascii=False))
+    print(json.dumps({"shared_pool_stats": pool.stats()}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
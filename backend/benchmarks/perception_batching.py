@@ -0,0 +1,60 @@
+"""感知微批处理基准测试 - 并发请求逐条调用 vs 攒批调用
+
+同时发起多条感知请求，对比关闭批处理（每条一次模型调用）与开启批处理时的
+吞吐（条/秒）与模型调用次数。级联感知关闭，保证每条都会走到模型。
+
+用法（在 backend 目录下，需本地 Ollama 已加载模型）：
+    python -m benchmarks.perception_batching --concurrency 8 --rounds 3 --window-ms 10
+"""
+import argparse
+import asyncio
+import time
+
+from app.perception_planning import PerceptionPlanningModule
+from app.perception_batcher import PerceptionBatcher
+from benchmarks.perception_latency import SAMPLE_INPUTS, RecordingClient
+
+
+async def run_mode(window_ms: float, concurrency: int, rounds: int) -> dict:
+    module = PerceptionPlanningModule(concurrent=False, combined=True)
+    module.cascade = False
+    module.batcher = PerceptionBatcher(module, window_ms=window_ms, max_batch=concurrency)
+    recorder = RecordingClient(module.ollama_client)
+    module.ollama_client = recorder
+
+    # 预热，排除模型加载时间
+    await module.perceive(SAMPLE_INPUTS[0], [])
+    recorder.calls = recorder.eval_count = 0
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(
+            module.execute(SAMPLE_INPUTS[i % len(SAMPLE_INPUTS)], [])
+            for i in range(concurrency)
+        ))
+    elapsed = time.perf_counter() - start
+
+    total = concurrency * rounds
+    return {
+        "window_ms": window_ms,
+        "perceptions": total,
+        "model_calls": recorder.calls,
+        "eval_tokens": recorder.eval_count,
+        "seconds": round(elapsed, 2),
+        "perceptions_per_second": round(total / elapsed, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="感知微批处理基准")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--window-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    for window_ms in (0, args.window_ms):
+        print(await run_mode(window_ms, args.concurrency, args.rounds))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
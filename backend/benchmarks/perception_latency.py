@@ -0,0 +1,88 @@
+"""感知规划基准测试 - 对比两次自由文本调用与单次结构化输出调用
+
+每轮都必须调用模型，因此运行时关闭感知结果缓存（PERCEPTION_CACHE_TTL=0）、
+级联规则与分类器（PERCEPTION_CASCADE=false）以及微批处理（PERCEPTION_BATCH_WINDOW_MS=0）。
+
+用法（在 backend 目录下，需本地 Ollama 已加载模型）：
+    python -m benchmarks.perception_latency --rounds 5
+
+使用替身模型服务（不需要 Ollama）：
+    python -m benchmarks.stub_llm --port 11500 &
+    OLLAMA_HOST=http://127.0.0.1:11500 python -m benchmarks.perception_latency --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from app.perception_planning import PerceptionPlanningModule
+
+SAMPLE_INPUTS = [
+    "谢谢你，今天感觉好多了",
+    "我和男朋友分手了，心里很难受",
+    "考研压力太大了，能帮我制定一个详细的复习计划吗？",
+    "最近总是失眠，不知道怎么办",
+    "室友总是很晚回来，吵得我睡不着，我该怎么和她沟通？",
+]
+
+
+class RecordingClient:
+    """包装 Ollama 客户端，记录每次调用生成的 token 数"""
+
+    def __init__(self, client):
+        self.client = client
+        self.eval_count = 0
+        self.calls = 0
+
+    async def chat(self, *args, **kwargs):
+        response = await self.client.chat(*args, **kwargs)
+        self.calls += 1
+        self.eval_count += response.get("eval_count") or 0
+        return response
+
+
+async def run_mode(combined: bool, rounds: int) -> dict:
+    module = PerceptionPlanningModule(concurrent=False, combined=combined)
+    recorder = RecordingClient(module.ollama_client)
+    module.ollama_client = recorder
+
+    # 预热一次，排除模型加载时间
+    await module.execute(SAMPLE_INPUTS[0], [])
+    recorder.eval_count = recorder.calls = 0
+
+    latencies = []
+    for _ in range(rounds):
+        for text in SAMPLE_INPUTS:
+            start = time.perf_counter()
+            await module.execute(text, [])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "mode": "combined" if combined else "two-call",
+        "turns": len(latencies),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "p50_ms": round(statistics.median(latencies), 1),
+        "max_ms": round(max(latencies), 1),
+        "model_calls": recorder.calls,
+        "tokens_per_turn": round(recorder.eval_count / len(latencies), 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="感知规划延迟基准")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    # 只比较调用方式本身：缓存命中、规则层与分类器判定都会跳过模型调用
+    os.environ.update({
+        "PERCEPTION_CACHE_TTL": "0",
+        "PERCEPTION_CASCADE": "false",
+        "PERCEPTION_BATCH_WINDOW_MS": "0",
+    })
+    for combined in (False, True):
+        print(await run_mode(combined, args.rounds))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
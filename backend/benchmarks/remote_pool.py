@@ -0,0 +1,77 @@
+"""云端模型连接池基准测试 - 对比每次新建客户端与共享连接池
+
+在本进程内启动替身模型服务（benchmarks.stub_llm），统计服务端看到的
+TCP 连接数（按客户端端口去重）和每轮对话耗时。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.remote_pool --users 16 --turns 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from app.model_router import RemoteModelService
+from benchmarks.stub_llm import StubConfig, StubServer
+
+HOST = "127.0.0.1"
+PORT = 18081
+
+
+async def chat_turn(service: RemoteModelService) -> float:
+    start = time.perf_counter()
+    async for _ in service.generate_with_prompt("system", "你好", [], stream=True):
+        pass
+    return (time.perf_counter() - start) * 1000
+
+
+async def run(stub: StubServer, pooled: bool, users: int, turns: int) -> dict:
+    stub.state.client_ports.clear()
+    service = RemoteModelService()
+    latencies = []
+
+    async def user_session():
+        for _ in range(turns):
+            if pooled:
+                latencies.append(await chat_turn(service))
+            else:
+                # 模拟改造前：每条消息新建并关闭一个客户端
+                per_request = RemoteModelService()
+                await per_request.startup()
+                try:
+                    latencies.append(await chat_turn(per_request))
+                finally:
+                    await per_request.shutdown()
+
+    await service.startup()
+    try:
+        await asyncio.gather(*(user_session() for _ in range(users)))
+    finally:
+        await service.shutdown()
+
+    return {
+        "mode": "pooled" if pooled else "per-request",
+        "turns": len(latencies),
+        "tcp_connections": len(stub.state.client_ports),
+        "mean_ms": round(statistics.mean(latencies), 2),
+        "p50_ms": round(statistics.median(latencies), 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="云端模型连接池基准")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["MODELSCOPE_BASE_URL"] = f"http://{HOST}:{PORT}/v1/chat/completions"
+    os.environ.setdefault("MODELSCOPE_API_KEY", "benchmark")
+
+    # 即时返回 6 个 token，只测量连接开销
+    async with StubServer(StubConfig(ttft_ms=0, tokens_per_second=0, reply_tokens=6), HOST, PORT) as stub:
+        for pooled in (False, True):
+            print(await run(stub, pooled, args.users, args.turns))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""SSE 编码基准测试 - 逐 token 成帧 vs 合并编码
+
+模拟多个并发对话按固定速率输出单 token 的 chunk 事件，经本机回环 socket
+逐帧写出（write + drain，近似 ASGI 服务器的单帧发送开销），统计两种编码方式
+写出的帧数、帧速率以及进程消耗的 CPU 时间。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.sse_encoding --streams 64 --tokens 400 --tokens-per-second 40
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.sse import SSEEncoder
+
+
+async def token_events(tokens: int, interval: float):
+    yield {"type": "metadata", "conversation_id": 1, "phase": "emotional", "model_used": "local-Qwen3-4B"}
+    for i in range(tokens):
+        await asyncio.sleep(interval)
+        yield {"type": "chunk", "content": "好" if i % 2 else "的"}
+    yield {"type": "end"}
+
+
+async def per_token(events):
+    """改造前：每个事件单独序列化为一帧"""
+    async for event in events:
+        yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def discard(reader, writer):
+    while await reader.read(65536):
+        pass
+    writer.close()
+
+
+async def consume(frames, counter: dict, port: int):
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        async for frame in frames:
+            writer.write(frame)
+            await writer.drain()
+            counter["frames"] += 1
+            counter["bytes"] += len(frame)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run(mode: str, streams: int, tokens: int, tokens_per_second: float) -> dict:
+    counter = {"frames": 0, "bytes": 0}
+    interval = 1 / tokens_per_second
+
+    def frames_for(events):
+        if mode == "per-token":
+            return per_token(events)
+        return SSEEncoder().stream(events)
+
+    server = await asyncio.start_server(discard, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(
+        consume(frames_for(token_events(tokens, interval)), counter, port)
+        for _ in range(streams)
+    ))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    server.close()
+    await server.wait_closed()
+
+    return {
+        "mode": mode,
+        "frames": counter["frames"],
+        "frames_per_second": round(counter["frames"] / wall, 1),
+        "bytes": counter["bytes"],
+        "cpu_seconds": round(cpu, 3),
+        "wall_seconds": round(wall, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="SSE 编码基准")
+    parser.add_argument("--streams", type=int, default=64)
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--tokens-per-second", type=float, default=40)
+    args = parser.parse_args()
+
+    for mode in ("per-token", "coalesced"):
+        print(await run(mode, args.streams, args.tokens, args.tokens_per_second))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,471 @@
+"""本地替身模型服务 - 离线、可复现的性能测试用 LLM 桩
+
+实现足够的 Ollama 接口（/api/chat、/api/generate）与 OpenAI 兼容的
+/v1/chat/completions（流式与非流式），LocalModelService、RemoteModelService
+与 PerceptionPlanningModule 无需修改，只需把地址指向本服务：
+    OLLAMA_HOST=http://127.0.0.1:11500
+    MODELSCOPE_BASE_URL=http://127.0.0.1:11500/v1/chat/completions
+    MODELSCOPE_API_KEY=stub
+
+可配置首 token 延迟、输出速率、预填充耗时、模型加载耗时（按 keep_alive 常驻，
+/api/ps 查看、/stub/unload 模拟卸载）、并发槽位、批处理减速与错误率，以及回复前
+Qwen3 风格的 <think> 推理块（请求关闭思考时不输出）；随机数使用
+固定种子，同一配置下的输出与错误序列可复现。感知类请求（结构化输出、
+"是/否|理由" 格式）按脚本规则返回确定的判断结果。
+
+用法（在 backend 目录下）：
+    python -m benchmarks.stub_llm --port 11500 --ttft-ms 300 --tokens-per-second 20
+    python -m benchmarks.stub_llm --script classifier_script.json --error-rate 0.05
+
+脚本文件格式（按顺序匹配用户输入中的子串，第一条命中生效）：
+    {"rules": [{"match": "分手", "is_privacy": true, "reason": "情感隐私"},
+               {"match": "计划", "is_complex": true, "reason": "需要详细方案"}]}
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 默认的感知脚本：与关键词引擎的典型类别大致对应
+DEFAULT_RULES = [
+    {"match": "身份证", "is_privacy": True, "reason": "个人身份信息"},
+    {"match": "手机号", "is_privacy": True, "reason": "个人身份信息"},
+    {"match": "分手", "is_privacy": True, "reason": "情感隐私"},
+    {"match": "男朋友", "is_privacy": True, "reason": "情感隐私"},
+    {"match": "女朋友", "is_privacy": True, "reason": "情感隐私"},
+    {"match": "家暴", "is_privacy": True, "reason": "家庭隐私"},
+    {"match": "保密", "is_privacy": True, "reason": "明确的隐私表达"},
+    {"match": "计划", "is_complex": True, "reason": "需要详细方案"},
+    {"match": "怎么办", "is_complex": True, "reason": "需要系统性建议"},
+    {"match": "如何", "is_complex": True, "reason": "需要系统性建议"},
+    {"match": "具体方法", "is_complex": True, "reason": "需要系统性建议"},
+]
+
+DEFAULT_THINKING = "嗯，用户现在情绪有些低落，我需要先共情，再温和地引导对方说出更多感受。"
+
+# Qwen3 关闭思考时在 assistant 轮次开头预填的空推理块
+EMPTY_THINK_BLOCK = "<think>\n\n</think>\n\n"
+
+DEFAULT_REPLY = (
+    "我能感受到你现在的心情，这确实让人不太好受。你愿意多说一些吗？"
+    "我们可以一起慢慢梳理，看看哪些地方最让你困扰，也想想有什么小事能让你今天轻松一点。"
+)
+
+
+@dataclass
+class StubConfig:
+    """替身服务配置"""
+    ttft_ms: float = 200.0
+    tokens_per_second: float = 30.0
+    reply_tokens: int = 60
+    # 回复前 <think> 推理块的 token 数，0 表示不输出推理块
+    think_tokens: int = 0
+    # 每千个提示词字符的额外预填充耗时，用于模拟长上下文的代价
+    prefill_ms_per_kchar: float = 0.0
+    # 同时处理的请求数（模拟 Ollama 的 NUM_PARALLEL），0 表示不限
+    parallel: int = 0
+    # 模型未加载（首次请求或被卸载后）时的加载耗时，模拟 Ollama 的冷启动
+    load_ms: float = 0.0
+    # 已安装的模型（/api/tags），名称匹配不区分大小写，未写标签时视为 :latest
+    models: List[str] = field(default_factory=lambda: ["Ethanwhh/Qwen3-4B-xinyi:latest"])
+    # 连续批处理的解码减速：每多一个同时解码的请求，单个请求的 token 间隔增加的比例
+    batch_slowdown: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 42
+    reply: str = DEFAULT_REPLY
+    rules: List[Dict] = field(default_factory=lambda: list(DEFAULT_RULES))
+
+
+class StubState:
+    """运行时状态与统计"""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.slots = asyncio.Semaphore(config.parallel) if config.parallel > 0 else None
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self.client_ports = set()
+        # 实际产出的回复 token 数（调用方断开后停止计数，用于验证取消是否传到上游）
+        self.tokens_streamed = 0
+        # 正在解码的请求数
+        self.decoding = 0
+        # 已加载的模型：规范名 -> 卸载时间（monotonic），以及模型加载次数
+        self.loaded: Dict[str, float] = {}
+        self.loads = 0
+        self.load_lock = asyncio.Lock()
+
+    async def ensure_loaded(self, model: str, keep_alive) -> None:
+        """请求的模型未加载时先付出加载耗时；按请求的 keep_alive（默认 5 分钟）刷新常驻时间"""
+        key = _model_key(model)
+        async with self.load_lock:
+            if self.loaded.get(key, 0) <= time.monotonic():
+                self.loads += 1
+                await asyncio.sleep(self.config.load_ms / 1000)
+            self.loaded[key] = time.monotonic() + _keep_alive_seconds(keep_alive)
+
+    def classify(self, text: str) -> Dict:
+        """按脚本规则给出隐私 / 复杂度判断"""
+        result = {"is_privacy": False, "privacy_reason": "普通情绪表达",
+                  "is_complex": False, "complexity_reason": "简单的情绪倾诉"}
+        for rule in self.config.rules:
+            if rule["match"] not in text:
+                continue
+            if rule.get("is_privacy"):
+                result.update(is_privacy=True, privacy_reason=rule.get("reason", "脚本判定"))
+                result.update(is_complex=False, complexity_reason="隐私问题无需复杂度分析")
+                break
+            if rule.get("is_complex") and not result["is_complex"]:
+                result.update(is_complex=True, complexity_reason=rule.get("reason", "脚本判定"))
+        return result
+
+    def tokens(self, count: int, thinking: bool = False) -> List[str]:
+        reply = self.config.reply
+        tokens = [reply[i % len(reply)] for i in range(count)]
+        if thinking and self.config.think_tokens > 0:
+            reasoning = [DEFAULT_THINKING[i % len(DEFAULT_THINKING)] for i in range(self.config.think_tokens)]
+            tokens = ["<think>", "\n"] + reasoning + ["\n", "</think>", "\n\n"] + tokens
+        return tokens
+
+
+def _model_key(name: str) -> str:
+    name = name.strip().lower()
+    return name if ":" in name.rsplit("/", 1)[-1] else f"{name}:latest"
+
+
+def _keep_alive_seconds(value) -> float:
+    """Ollama keep_alive：数字为秒，字符串如 30m / 10s / 1h，负数表示常驻"""
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        units = {"s": 1, "m": 60, "h": 3600}
+        seconds = float(value[:-1]) * units[value[-1]] if value[-1] in units else float(value)
+    return float("inf") if seconds < 0 else seconds
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _prompt_text(messages: List[Dict]) -> str:
+    return "".join(str(m.get("content", "")) for m in messages)
+
+
+def _last_user(messages: List[Dict]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return str(message.get("content", ""))
+    return ""
+
+
+def _perception_answer(state: StubState, messages: List[Dict], fmt) -> Optional[str]:
+    """识别感知类请求并返回脚本化的答案；普通对话返回 None"""
+    system = next((str(m.get("content", "")) for m in messages if m.get("role") == "system"), "")
+    user = _last_user(messages)
+
+    if isinstance(fmt, dict):
+        results = fmt.get("properties", {}).get("results")
+        if results is not None:
+            # 批量感知：按【消息N】分段逐条判断
+            sections = user.split("【消息")[1:]
+            answers = []
+            for index, section in enumerate(sections, 1):
+                current = section.split("当前用户输入：", 1)[-1]
+                answers.append({"id": index, **state.classify(current)})
+            return json.dumps({"results": answers}, ensure_ascii=False)
+        current = user.split("当前用户输入：", 1)[-1]
+        return json.dumps(state.classify(current), ensure_ascii=False)
+
+    if fmt == "json" and "感知" in system:
+        return json.dumps(state.classify(user), ensure_ascii=False)
+
+    # 自由文本的两段式感知：只回答 "是/否|理由"
+    if "格式：是/否|理由" in user:
+        current = user.split("当前用户输入：", 1)[-1].split("用户输入：", 1)[-1]
+        result = state.classify(current.split("\n", 1)[0])
+        if "隐私检测专家" in user:
+            return ("是|" if result["is_privacy"] else "否|") + result["privacy_reason"]
+        return ("是|" if result["is_complex"] else "否|") + result["complexity_reason"]
+    return None
+
+
+async def _generate(state: StubState, prompt_chars: int, answer: Optional[str], thinking: bool = True,
+                    num_predict: Optional[int] = None):
+    """按配置的首 token 延迟与速率产出 token（感知答案整体作为一个片段；num_predict 限制 token 数）"""
+    config = state.config
+    prefill = config.ttft_ms + prompt_chars / 1000 * config.prefill_ms_per_kchar
+    await asyncio.sleep(prefill / 1000)
+    if answer is not None:
+        yield answer
+        return
+    interval = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+    state.decoding += 1
+    try:
+        for index, token in enumerate(state.tokens(config.reply_tokens, thinking)[:num_predict]):
+            if index and interval:
+                await asyncio.sleep(interval * (1 + config.batch_slowdown * (state.decoding - 1)))
+            state.tokens_streamed += 1
+            yield token
+    finally:
+        state.decoding -= 1
+
+
+def create_app(config: StubConfig = None) -> FastAPI:
+    """创建替身服务应用"""
+    state = StubState(config or StubConfig())
+    app = FastAPI(title="stub-llm")
+    app.state.stub = state
+
+    def record(request: Request, endpoint: str) -> bool:
+        """记录请求，按错误率决定是否返回错误"""
+        state.requests[endpoint] = state.requests.get(endpoint, 0) + 1
+        if request.client:
+            state.client_ports.add(request.client.port)
+        if state.config.error_rate and state.random.random() < state.config.error_rate:
+            state.errors += 1
+            return True
+        return False
+
+    async def with_slot(stream):
+        if state.slots is None:
+            async for item in stream:
+                yield item
+            return
+        async with state.slots:
+            async for item in stream:
+                yield item
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        if record(request, "ollama_chat"):
+            return JSONResponse({"error": "stub injected error"}, status_code=500)
+        messages = body.get("messages", [])
+        model = body.get("model", "stub")
+        answer = _perception_answer(state, messages, body.get("format"))
+        prompt_chars = len(_prompt_text(messages))
+        thinking = body.get("think") is not False
+        num_predict = (body.get("options") or {}).get("num_predict")
+        started = time.perf_counter_ns()
+        await state.ensure_loaded(model, body.get("keep_alive"))
+
+        def final(count: int) -> Dict:
+            return {
+                "model": model, "created_at": _now(), "done": True, "done_reason": "stop",
+                "message": {"role": "assistant", "content": ""},
+                "total_duration": time.perf_counter_ns() - started,
+                "prompt_eval_count": prompt_chars, "eval_count": count
+            }
+
+        if not body.get("stream", True):
+            content = "".join([token async for token in with_slot(_generate(state, prompt_chars, answer, thinking, num_predict))])
+            response = final(len(content))
+            response["message"]["content"] = content
+            return response
+
+        async def stream():
+            count = 0
+            async for token in with_slot(_generate(state, prompt_chars, answer, thinking, num_predict)):
+                count += 1
+                chunk = {"model": model, "created_at": _now(), "done": False,
+                         "message": {"role": "assistant", "content": token}}
+                yield json.dumps(chunk, ensure_ascii=False) + "\n"
+            yield json.dumps(final(count), ensure_ascii=False) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.post("/api/generate")
+    async def ollama_generate(request: Request):
+        body = await request.json()
+        if record(request, "ollama_generate"):
+            return JSONResponse({"error": "stub injected error"}, status_code=500)
+        model = body.get("model", "stub")
+        prompt = body.get("prompt", "")
+        context = list(body.get("context") or [])
+        # 续接的上下文不再计入预填充
+        prompt_chars = len(prompt)
+        # raw 模式下以预填的空推理块关闭思考
+        thinking = body.get("think") is not False and not prompt.endswith(EMPTY_THINK_BLOCK)
+        num_predict = (body.get("options") or {}).get("num_predict")
+        started = time.perf_counter_ns()
+        await state.ensure_loaded(model, body.get("keep_alive"))
+        if not prompt and not context:
+            # 空提示词只加载模型（Ollama 的预加载方式）
+            return {"model": model, "created_at": _now(), "done": True, "done_reason": "load", "response": ""}
+
+        def final(tokens: List[str]) -> Dict:
+            return {
+                "model": model, "created_at": _now(), "done": True, "done_reason": "stop", "response": "",
+                "context": context + [ord(ch) for ch in prompt] + [ord(ch) for ch in "".join(tokens)],
+                "total_duration": time.perf_counter_ns() - started,
+                "prompt_eval_count": prompt_chars,
+                "prompt_eval_duration": int((state.config.ttft_ms + prompt_chars / 1000 * state.config.prefill_ms_per_kchar) * 1e6),
+                "eval_count": len(tokens)
+            }
+
+        if not body.get("stream", True):
+            tokens = [token async for token in with_slot(_generate(state, prompt_chars, None, thinking, num_predict))]
+            response = final(tokens)
+            response["response"] = "".join(tokens)
+            return response
+
+        async def stream():
+            tokens = []
+            async for token in with_slot(_generate(state, prompt_chars, None, thinking, num_predict)):
+                tokens.append(token)
+                yield json.dumps({"model": model, "created_at": _now(), "done": False, "response": token},
+                                 ensure_ascii=False) + "\n"
+            yield json.dumps(final(tokens), ensure_ascii=False) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        if record(request, "openai_chat"):
+            return JSONResponse({"error": {"message": "stub injected error"}}, status_code=500)
+        messages = body.get("messages", [])
+        answer = _perception_answer(state, messages, None)
+        prompt_chars = len(_prompt_text(messages))
+        model = body.get("model", "stub")
+        # ModelScope 用顶层 enable_thinking，llama.cpp / vLLM 用 chat_template_kwargs
+        template_kwargs = body.get("chat_template_kwargs") or {}
+        thinking = body.get("enable_thinking") is not False and template_kwargs.get("enable_thinking") is not False
+        num_predict = body.get("max_tokens")
+
+        if not body.get("stream"):
+            content = "".join([token async for token in with_slot(_generate(state, prompt_chars, answer, thinking, num_predict))])
+            return {
+                "id": "stub", "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}]
+            }
+
+        async def stream():
+            async for token in with_slot(_generate(state, prompt_chars, answer, thinking, num_predict)):
+                data = {"id": "stub", "object": "chat.completion.chunk", "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token}}]}
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": name, "model": name} for name in state.config.models]}
+
+    @app.get("/api/ps")
+    async def ps():
+        now = time.monotonic()
+        return {"models": [
+            {"name": key, "model": key,
+             "expires_at": "0001-01-01T00:00:00Z" if expires == float("inf") else
+             datetime.fromtimestamp(time.time() + expires - now, timezone.utc).isoformat()}
+            for key, expires in state.loaded.items() if expires > now
+        ]}
+
+    @app.post("/stub/unload")
+    async def unload():
+        """模拟 Ollama 卸载全部模型（内存压力或 keep_alive 到期）"""
+        state.loaded.clear()
+        return {"unloaded": True}
+
+    @app.get("/stub/stats")
+    async def stats():
+        return {
+            "requests": state.requests,
+            "errors": state.errors,
+            "tokens_streamed": state.tokens_streamed,
+            "model_loads": state.loads,
+            "client_connections": len(state.client_ports)
+        }
+
+    return app
+
+
+class StubServer:
+    """在当前事件循环中后台运行替身服务，供其他基准脚本使用"""
+
+    def __init__(self, config: StubConfig = None, host: str = "127.0.0.1", port: int = 11500):
+        self.app = create_app(config)
+        self.host = host
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def state(self) -> StubState:
+        return self.app.state.stub
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def __aenter__(self) -> "StubServer":
+        self.task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            if self.task.done():
+                self.task.result()
+            await asyncio.sleep(0.05)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.server.should_exit = True
+        await self.task
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    config = StubConfig(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        think_tokens=args.think_tokens,
+        prefill_ms_per_kchar=args.prefill_ms_per_kchar,
+        parallel=args.parallel,
+        batch_slowdown=args.batch_slowdown,
+        load_ms=args.load_ms,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            config.rules = json.load(f)["rules"]
+    return config
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """替身服务的命令行参数（其他基准脚本复用）"""
+    parser.add_argument("--ttft-ms", type=float, default=200, help="首 token 延迟（毫秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=30, help="输出速率")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="每条回复的 token 数")
+    parser.add_argument("--think-tokens", type=int, default=0, help="回复前 <think> 推理块的 token 数")
+    parser.add_argument("--prefill-ms-per-kchar", type=float, default=0, help="每千字符提示词的预填充耗时")
+    parser.add_argument("--parallel", type=int, default=0, help="并发处理上限，0 表示不限")
+    parser.add_argument("--load-ms", type=float, default=0, help="模型未加载时的加载耗时（毫秒）")
+    parser.add_argument("--batch-slowdown", type=float, default=0, help="每多一个同时解码的请求，token 间隔增加的比例")
+    parser.add_argument("--error-rate", type=float, default=0, help="注入错误的比例（0-1）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--script", help="感知判断脚本（JSON）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地替身模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""推理块处理基准测试 - 不处理 / 流式去除 / 请求时关闭思考的首 token 延迟
+
+替身模型在回答前输出 Qwen3 风格的 <think> 推理块，分别以三种方式经模型服务
+与输出变换链取流，统计：
+- first_chunk_ms：用户收到首个片段的时间（不处理时首个片段就是推理块）
+- first_answer_ms：用户收到正式回答首个字符的时间
+- stored_chars：最终保存的回复长度；think_leaked：回复中是否残留推理块
+
+用法（在 backend 目录下）：
+    python -m benchmarks.think_suppression --think-tokens 120 --rounds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from benchmarks.stub_llm import StubServer, add_stub_arguments, config_from_args
+
+# 三种处理方式：(输出变换器, 请求时关闭思考)
+MODES = {
+    "keep": ("error_normalize,crisis_scan", False),
+    "strip": ("error_normalize,think_filter,crisis_scan", False),
+    "disable": ("error_normalize,think_filter,crisis_scan", True),
+}
+
+
+async def run_turn(service, pipeline) -> dict:
+    chain = pipeline.build()
+    start = time.perf_counter()
+    first_chunk = first_answer = None
+    text = ""
+    async for chunk in chain.apply(service.generate_with_prompt("你是心理陪伴助手", "今天有点累", [], stream=True)):
+        now = time.perf_counter()
+        if first_chunk is None:
+            first_chunk = now
+        text += chunk
+        # 正式回答：推理块（若未去除）闭合之后的首个非空白字符
+        answer = text.split("</think>", 1)[1] if "</think>" in text else ("" if "<think>" in text else text)
+        if first_answer is None and answer.strip():
+            first_answer = now
+    return {
+        "first_chunk_ms": (first_chunk - start) * 1000,
+        "first_answer_ms": (first_answer - start) * 1000 if first_answer else None,
+        "stored_chars": len(text),
+        "think_leaked": "<think>" in text,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="推理块处理的首 token 延迟")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--stub-port", type=int, default=11500)
+    add_stub_arguments(parser)
+    parser.set_defaults(think_tokens=120, tokens_per_second=60, ttft_ms=150)
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    os.environ.update({
+        "OLLAMA_HOST": stub_url,
+        "MODELSCOPE_BASE_URL": f"{stub_url}/v1/chat/completions",
+        "MODELSCOPE_API_KEY": "stub",
+    })
+    from app.model_router import model_router
+    from app.output_transducers import OutputPipeline
+
+    services = {"local": model_router.local_service, "remote": model_router.remote_service}
+    results = []
+    async with StubServer(config_from_args(args), port=args.stub_port):
+        for backend, service in services.items():
+            for mode, (names, disable_thinking) in MODES.items():
+                service.disable_thinking = disable_thinking
+                pipeline = OutputPipeline(names)
+                turns = [await run_turn(service, pipeline) for _ in range(args.rounds)]
+                results.append({
+                    "backend": backend,
+                    "mode": mode,
+                    "first_chunk_ms": round(statistics.median(t["first_chunk_ms"] for t in turns), 1),
+                    "first_answer_ms": round(statistics.median(t["first_answer_ms"] for t in turns), 1),
+                    "stored_chars": turns[-1]["stored_chars"],
+                    "think_leaked": any(t["think_leaked"] for t in turns),
+                })
+        await model_router.remote_service.shutdown()
+
+    for row in results:
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())